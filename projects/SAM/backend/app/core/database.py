@@ -0,0 +1,296 @@
+import os
+import time
+import asyncio
+import threading
+from typing import Dict, Optional
+import httpx
+from dotenv import load_dotenv
+from supabase import Client, AsyncClient, create_client, acreate_client
+from supabase.lib.client_options import SyncClientOptions, AsyncClientOptions
+from app.core.metrics import observe_supabase
+
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEYS = {
+    "anon": os.getenv("SUPABASE_KEY"),
+    # Admin tasks bypass RLS when a service key is configured
+    "service": os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_KEY"),
+}
+
+# Pool sizing (tune with /api/stats/pool under load)
+POOL_MAX_CONNECTIONS = int(os.getenv("SUPABASE_POOL_SIZE", "20"))
+POOL_MAX_KEEPALIVE = int(os.getenv("SUPABASE_POOL_KEEPALIVE", "10"))
+POOL_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_POOL_KEEPALIVE_EXPIRY", "30"))
+POOL_TIMEOUT = float(os.getenv("SUPABASE_POOL_TIMEOUT", "30"))
+HTTP2_ENABLED = os.getenv("SUPABASE_HTTP2", "false").lower() in ("1", "true", "yes")
+
+if HTTP2_ENABLED:
+    try:
+        import h2  # noqa: F401  (httpx needs it for HTTP/2)
+    except ImportError:
+        print("WARNING: SUPABASE_HTTP2 is set but 'h2' is not installed. Falling back to HTTP/1.1.")
+        HTTP2_ENABLED = False
+
+class PoolStats:
+    """
+    Counters for every pooled transport (sync and async, one per key role), totals and per transport.
+    Each transport has its own POOL_MAX_CONNECTIONS slots, so the process-wide cap is that times the
+    number of transports. Wait time is the time a request spends queued for a free pool slot.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.waiting = 0
+        self.requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.transports = []
+
+    def start_wait(self, transport):
+        with self._lock:
+            self.waiting += 1
+            transport.waiting += 1
+
+    def acquired(self, transport, waited: float):
+        with self._lock:
+            self.waiting -= 1
+            self.in_use += 1
+            self.requests += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            transport.waiting -= 1
+            transport.in_use += 1
+            transport.requests += 1
+            transport.max_wait = max(transport.max_wait, waited)
+
+    def released(self, transport):
+        with self._lock:
+            self.in_use -= 1
+            transport.in_use -= 1
+
+    @staticmethod
+    def _idle(transport) -> int:
+        pool = getattr(transport, "_pool", None)
+        try:
+            return sum(1 for conn in pool.connections if conn.is_idle())
+        except Exception:
+            return 0
+
+    def idle_connections(self) -> int:
+        return sum(self._idle(t) for t in self.transports)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "pool_size": POOL_MAX_CONNECTIONS * len(self.transports), # Process-wide cap
+                "pool_size_per_client": POOL_MAX_CONNECTIONS, # SUPABASE_POOL_SIZE
+                "in_use": self.in_use,
+                "idle": self.idle_connections(),
+                "waiting": self.waiting,
+                "requests": self.requests,
+                "avg_wait_ms": round(1000 * self.total_wait / self.requests, 3) if self.requests else 0.0,
+                "max_wait_ms": round(1000 * self.max_wait, 3),
+                "http2": HTTP2_ENABLED,
+                "clients": {
+                    t.name: {
+                        "in_use": t.in_use,
+                        "idle": self._idle(t),
+                        "waiting": t.waiting,
+                        "requests": t.requests,
+                        "max_wait_ms": round(1000 * t.max_wait, 3),
+                    }
+                    for t in self.transports
+                },
+            }
+
+pool_stats = PoolStats()
+
+class _ReleasingStream(httpx.SyncByteStream):
+    # Keeps the pool slot until the response body is fully read and closed
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+def _once(fn):
+    done = []
+    def wrapper():
+        if not done:
+            done.append(True)
+            fn()
+    return wrapper
+
+def _register_transport(transport, name: str):
+    transport.name = name
+    transport.in_use = 0
+    transport.waiting = 0
+    transport.requests = 0
+    transport.max_wait = 0.0
+    pool_stats.transports.append(transport)
+
+class PooledTransport(httpx.HTTPTransport):
+    """
+    httpx transport with a bounded number of concurrent requests and pool statistics.
+    """
+
+    def __init__(self, name: str = "sync", **kwargs):
+        super().__init__(**kwargs)
+        self._slots = threading.BoundedSemaphore(POOL_MAX_CONNECTIONS)
+        _register_transport(self, name)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        pool_stats.start_wait(self)
+        started = time.perf_counter()
+        self._slots.acquire()
+        pool_stats.acquired(self, time.perf_counter() - started)
+
+        def release():
+            self._slots.release()
+            pool_stats.released(self)
+        release = _once(release)
+
+        sent = time.perf_counter()
+        try:
+            response = super().handle_request(request)
+        except Exception:
+            release()
+            observe_supabase(request.method, request.url.path, time.perf_counter() - sent, 0)
+            raise
+        observe_supabase(request.method, request.url.path, time.perf_counter() - sent, response.status_code)
+        response.stream = _ReleasingStream(response.stream, release)
+        return response
+
+class PooledAsyncTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, name: str = "async", **kwargs):
+        super().__init__(**kwargs)
+        self._slots: Optional[asyncio.Semaphore] = None # Created inside the running loop
+        _register_transport(self, name)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(POOL_MAX_CONNECTIONS)
+        pool_stats.start_wait(self)
+        started = time.perf_counter()
+        await self._slots.acquire()
+        pool_stats.acquired(self, time.perf_counter() - started)
+
+        def release():
+            self._slots.release()
+            pool_stats.released(self)
+        release = _once(release)
+
+        sent = time.perf_counter()
+        try:
+            response = await super().handle_async_request(request)
+        except Exception:
+            release()
+            observe_supabase(request.method, request.url.path, time.perf_counter() - sent, 0)
+            raise
+        observe_supabase(request.method, request.url.path, time.perf_counter() - sent, response.status_code)
+        response.stream = _AsyncReleasingStream(response.stream, release)
+        return response
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=POOL_MAX_KEEPALIVE,
+        keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+    )
+
+# --- Client Registry ---
+# One client per key role for the whole process. Routers, services and tools all share
+# the same keep-alive connections instead of opening new TCP/TLS sessions.
+
+_clients: Dict[str, Client] = {}
+_async_clients: Dict[str, AsyncClient] = {}
+_registry_lock = threading.Lock()
+_async_lock: Optional[asyncio.Lock] = None
+
+def _credentials(role: str) -> tuple:
+    key = SUPABASE_KEYS.get(role)
+    if not SUPABASE_URL or not key:
+        raise ValueError("Missing Supabase credentials")
+    return SUPABASE_URL, key
+
+def get_supabase(role: str = "anon") -> Client:
+    """
+    Returns the shared sync Supabase client for 'anon' or 'service' role.
+    """
+    client = _clients.get(role)
+    if client:
+        return client
+    with _registry_lock:
+        if role not in _clients:
+            url, key = _credentials(role)
+            http_client = httpx.Client(
+                transport=PooledTransport(name=f"sync:{role}", limits=_limits(), http2=HTTP2_ENABLED),
+                timeout=POOL_TIMEOUT,
+                http2=HTTP2_ENABLED,
+            )
+            _clients[role] = create_client(url, key, options=SyncClientOptions(httpx_client=http_client))
+        return _clients[role]
+
+async def get_async_supabase(role: str = "anon") -> AsyncClient:
+    """
+    Returns the shared async Supabase client (built on first use inside the event loop).
+    """
+    global _async_lock
+    client = _async_clients.get(role)
+    if client:
+        return client
+    if _async_lock is None:
+        _async_lock = asyncio.Lock()
+    async with _async_lock:
+        if role not in _async_clients:
+            url, key = _credentials(role)
+            http_client = httpx.AsyncClient(
+                transport=PooledAsyncTransport(name=f"async:{role}", limits=_limits(), http2=HTTP2_ENABLED),
+                timeout=POOL_TIMEOUT,
+                http2=HTTP2_ENABLED,
+            )
+            _async_clients[role] = await acreate_client(url, key, options=AsyncClientOptions(httpx_client=http_client))
+        return _async_clients[role]
+
+def install_clients(role: str = "anon", client: Optional[Client] = None, async_client: Optional[AsyncClient] = None):
+    """
+    Registers prebuilt clients for a role (offline benchmarks point them at an in-memory PostgREST).
+    """
+    with _registry_lock:
+        if client is not None:
+            _clients[role] = client
+        if async_client is not None:
+            _async_clients[role] = async_client
+
+def get_db() -> Client:
+    """
+    FastAPI dependency: `db: Client = Depends(get_db)`.
+    """
+    return get_supabase()
+
+def get_pool_stats() -> dict:
+    return pool_stats.snapshot()
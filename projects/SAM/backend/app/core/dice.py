@@ -1,13 +1,260 @@
+import os
 import re
-import secrets
+import struct
+import threading
 from enum import Enum
-from typing import List, Dict, Any, Optional
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple, Union
 
 class Visibility(str, Enum):
     PUBLIC = "public"
     PRIVATE = "private"  # Only GM/System sees
     WHISPER = "whisper" # GM + Specific Player
 
+# Limits per expression (they bound the cost of one evaluation, however the expression is written)
+MAX_DICE = 100 # dice written in the expression, summed over all terms
+MAX_TERMS = 20
+MAX_SIDES = 1000
+MAX_EXPLOSIONS = 100 # extra dice '!' may add to one term
+DICE_CACHE_SIZE = int(os.getenv("DICE_CACHE_SIZE", "1024")) # compiled expressions kept (LRU)
+ENTROPY_BUFFER_BYTES = int(os.getenv("DICE_ENTROPY_BUFFER_BYTES", "65536")) # one os.urandom read (~40k d20s)
+MAX_BATCH_ROLLS = 500 # expressions per /api/roll/batch request
+
+# One term: optional sign, then dice ('4d6dl1', 'd20', '2d20kh1', '1d6!', '2d6r2', 'd%') or a constant
+_TERM_RE = re.compile(r"([+-]?)(?:(\d*)d(\d+|%)((?:(?:kh|kl|dh|dl|k|ro|r|!)\d*)*)|(\d+))")
+_MODIFIER_RE = re.compile(r"(kh|kl|dh|dl|k|ro|r|!)(\d*)")
+
+@dataclass(frozen=True)
+class DiceTerm:
+    """
+    'AdX' with its modifiers, applied in this order:
+    1. rN / roN: reroll once any die showing N or less (bare 'r' = 1)
+    2. '!': every die showing the max adds another die
+    3. khN / klN keep the N highest / lowest, dhN / dlN drop them ('k' = 'kh', bare N = 1)
+    """
+    text: str = field(compare=False) # as written; equal terms compare (and hash) equal however spelled
+    sign: int
+    count: int
+    sides: int
+    reroll_at_most: int = 0 # 0 = no reroll
+    explode: bool = False
+    select: str = "" # '', 'kh', 'kl', 'dh' or 'dl'
+    select_n: int = 0
+
+@dataclass(frozen=True)
+class ConstantTerm:
+    text: str
+    sign: int
+    value: int
+
+Term = Union[DiceTerm, ConstantTerm]
+
+@dataclass(frozen=True)
+class DiceExpression:
+    """
+    A compiled expression. Immutable, so the cached instance is shared by every roll of the same string.
+    """
+    expression: str
+    terms: Tuple[Term, ...]
+    modifier: int # signed sum of the constant terms
+
+def _compile_dice_term(text: str, sign: int, count_str: str, sides_str: str, modifiers: str) -> DiceTerm:
+    count = int(count_str) if count_str else 1
+    sides = 100 if sides_str == "%" else int(sides_str)
+    if count < 1:
+        raise ValueError(f"Invalid dice count in '{text}'.")
+    if sides < 2 or sides > MAX_SIDES:
+        raise ValueError("Invalid number of sides.")
+
+    options: Dict[str, Any] = {}
+    for name, arg in _MODIFIER_RE.findall(modifiers):
+        if name == "!":
+            if arg:
+                raise ValueError(f"'!' takes no number in '{text}'.")
+            options["explode"] = True
+        elif name in ("r", "ro"):
+            n = int(arg) if arg else 1
+            if not 1 <= n < sides:
+                raise ValueError(f"Reroll threshold must be between 1 and {sides - 1} in '{text}'.")
+            options["reroll_at_most"] = n
+        else:
+            if "select" in options:
+                raise ValueError(f"Only one keep/drop modifier per term in '{text}'.")
+            n = int(arg) if arg else 1
+            name = "kh" if name == "k" else name
+            if name in ("kh", "kl") and not 1 <= n <= count:
+                raise ValueError(f"Can only keep between 1 and {count} dice in '{text}'.")
+            if name in ("dh", "dl") and not 1 <= n < count:
+                raise ValueError(f"Can only drop between 1 and {count - 1} dice in '{text}'.")
+            options["select"], options["select_n"] = name, n
+    return DiceTerm(text=text, sign=sign, count=count, sides=sides, **options)
+
+@lru_cache(maxsize=DICE_CACHE_SIZE)
+def _compile(expression: str) -> DiceExpression:
+    terms: List[Term] = []
+    pos = 0
+    while pos < len(expression):
+        match = _TERM_RE.match(expression, pos)
+        # Every term after the first needs its operator ('1d20 5' is not an expression)
+        if not match or match.end() == pos or (terms and not match.group(1)):
+            raise ValueError(f"Invalid dice expression: {expression}")
+        sign_str, count_str, sides_str, modifiers, constant = match.groups()
+        sign = -1 if sign_str == "-" else 1
+        text = match.group(0)
+        if constant is not None:
+            terms.append(ConstantTerm(text=text, sign=sign, value=int(constant)))
+        else:
+            terms.append(_compile_dice_term(text, sign, count_str, sides_str, modifiers or ""))
+        pos = match.end()
+
+    dice_terms = [t for t in terms if isinstance(t, DiceTerm)]
+    if not dice_terms:
+        raise ValueError(f"Invalid dice expression: {expression}")
+    if len(terms) > MAX_TERMS:
+        raise ValueError(f"Too many terms! Max {MAX_TERMS}.")
+    if sum(t.count for t in dice_terms) > MAX_DICE:
+        raise ValueError(f"Too many dice! Max {MAX_DICE}.")
+
+    modifier = sum(t.sign * t.value for t in terms if isinstance(t, ConstantTerm))
+    return DiceExpression(expression=expression, terms=tuple(terms), modifier=modifier)
+
+class SecureRandomBuffer:
+    """
+    Cryptographically secure dice from bulk os.urandom reads (same source as `secrets`, one syscall
+    per buffer instead of one per die). Unbiased: draws at or above the largest multiple of `sides`
+    that fits in the byte span are rejected and redrawn, so `% sides` never favours low faces.
+    """
+
+    def __init__(self, size: int = ENTROPY_BUFFER_BYTES):
+        self.size = size
+        self._buf = b""
+        self._pos = 0
+        self._lock = threading.Lock()
+        self._specs: Dict[int, Tuple[int, int, str]] = {} # sides -> (bytes per draw, rejection limit, struct format)
+        self.refills = 0
+        self.rejected = 0
+        # A forked worker must never replay the parent's bytes
+        os.register_at_fork(after_in_child=self._discard)
+
+    def _discard(self):
+        self._buf = b""
+        self._pos = 0
+
+    def _spec(self, sides: int) -> Tuple[int, int, str]:
+        spec = self._specs.get(sides)
+        if spec is None:
+            nbytes, fmt = next((b, f) for b, f in ((1, "B"), (2, "H"), (4, "I")) if sides <= 1 << (8 * b))
+            span = 1 << (8 * nbytes)
+            spec = self._specs[sides] = (nbytes, span - span % sides, fmt)
+        return spec
+
+    def dice(self, sides: int, count: int) -> List[int]:
+        """`count` uniform values in [1, sides], drawn under one lock acquisition."""
+        nbytes, limit, fmt = self._spec(sides)
+        out: List[int] = []
+        with self._lock:
+            while len(out) < count:
+                available = (len(self._buf) - self._pos) // nbytes
+                if not available:
+                    self._buf = os.urandom(self.size)
+                    self._pos = 0
+                    self.refills += 1
+                    continue
+                k = min(count - len(out), available)
+                if nbytes == 1:
+                    values = self._buf[self._pos:self._pos + k] # bytes iterate as ints
+                else:
+                    values = struct.unpack_from(f">{k}{fmt}", self._buf, self._pos)
+                self._pos += k * nbytes
+                accepted = [v % sides + 1 for v in values if v < limit]
+                self.rejected += k - len(accepted)
+                out.extend(accepted)
+        return out
+
+    def stats(self) -> Dict[str, int]:
+        return {"buffer_bytes": self.size, "refills": self.refills, "rejected": self.rejected}
+
+# Singleton instance
+secure_random = SecureRandomBuffer()
+
+def normalize_expression(expression: str) -> str:
+    return "".join(expression.lower().split())
+
+def compile_expression(expression: str) -> DiceExpression:
+    """
+    Parses a dice expression into a DiceExpression (cached by normalized string).
+    Raises ValueError for anything that is not valid dice notation or exceeds the limits.
+    """
+    return _compile(normalize_expression(expression))
+
+def _roll_dice_term(term: DiceTerm, rng: SecureRandomBuffer) -> Dict[str, Any]:
+    sides = term.sides
+    rolls = rng.dice(sides, term.count)
+    rerolled = []
+    if term.reroll_at_most:
+        low = [i for i, v in enumerate(rolls) if v <= term.reroll_at_most]
+        for i, value in zip(low, rng.dice(sides, len(low))):
+            rerolled.append(rolls[i])
+            rolls[i] = value
+
+    if term.explode:
+        pending = rolls.count(sides)
+        extra = 0
+        while pending and extra < MAX_EXPLOSIONS:
+            new = rng.dice(sides, min(pending, MAX_EXPLOSIONS - extra))
+            rolls.extend(new)
+            extra += len(new)
+            pending = new.count(sides)
+
+    if term.select:
+        n = term.select_n if term.select in ("kh", "kl") else len(rolls) - term.select_n
+        highest = term.select in ("kh", "dl")
+        order = sorted(range(len(rolls)), key=rolls.__getitem__, reverse=highest)
+        keep_idx = set(order[:n])
+        kept = [v for i, v in enumerate(rolls) if i in keep_idx]
+        dropped = [v for i, v in enumerate(rolls) if i not in keep_idx]
+    else:
+        kept, dropped = rolls, []
+
+    return {
+        "term": term.text,
+        "rolls": rolls,
+        "kept": kept,
+        "dropped": dropped,
+        "rerolled": rerolled,
+        "subtotal": term.sign * sum(kept),
+    }
+
+def evaluate(compiled: DiceExpression, rng: SecureRandomBuffer = secure_random) -> Dict[str, Any]:
+    """
+    Rolls a compiled expression. `rolls` / `modifier` / `total` keep the original /api/roll shape
+    (rolls = the dice that count, in term order); `terms` adds the per-term breakdown.
+    """
+    breakdown = []
+    rolls = []
+    natural_20 = natural_1 = False
+    for term in compiled.terms:
+        if isinstance(term, ConstantTerm):
+            breakdown.append({"term": term.text, "value": term.value, "subtotal": term.sign * term.value})
+            continue
+        result = _roll_dice_term(term, rng)
+        breakdown.append(result)
+        rolls.extend(result["kept"])
+        if term.sides == 20:
+            natural_20 = natural_20 or 20 in result["kept"]
+            natural_1 = natural_1 or 1 in result["kept"]
+
+    return {
+        "expression": compiled.expression,
+        "rolls": rolls,
+        "modifier": compiled.modifier,
+        "total": sum(t["subtotal"] for t in breakdown),
+        "natural_20": natural_20,
+        "natural_1": natural_1,
+        "terms": breakdown,
+    }
+
 class DiceRoller:
     """
     Handles secure random number generation and dice notation parsing.
@@ -16,42 +263,34 @@ class DiceRoller:
     @staticmethod
     def roll(expression: str) -> Dict[str, Any]:
         """
-        Parses a dice expression (e.g., '1d20', '2d6+5') and returns detailed results.
-        Current support: Simple AdX+B format.
+        Parses a dice expression and returns detailed results.
+        Supports sums of dice and constants ('1d8+2d6+3'), advantage/disadvantage ('2d20kh1' / '2d20kl1'),
+        drop lowest ('4d6dl1'), rerolls ('2d6r2') and exploding dice ('1d6!').
         """
-        expression = expression.lower().replace(" ", "")
-        
-        # Regex for 'AdX' or 'AdX+B' or 'AdX-B'
-        match = re.match(r"^(\d+)d(\d+)([+-]\d+)?$", expression)
-        
-        if not match:
-            raise ValueError(f"Invalid dice expression: {expression}")
-            
-        count = int(match.group(1))
-        sides = int(match.group(2))
-        modifier_str = match.group(3)
-        modifier = int(modifier_str) if modifier_str else 0
-        
-        if count > 100:
-            raise ValueError("Too many dice! Max 100.")
-        if sides < 2 or sides > 1000:
-            raise ValueError("Invalid number of sides.")
-
-        rolls = []
-        for _ in range(count):
-            # secure random number 1 to sides
-            r = secrets.randbelow(sides) + 1
-            rolls.append(r)
-            
-        total = sum(rolls) + modifier
-        
+        return evaluate(compile_expression(expression))
+
+    @staticmethod
+    def roll_batch(expressions: List[str]) -> List[Dict[str, Any]]:
+        """
+        Rolls several expressions (e.g. every goblin's attack this round), each with its full breakdown.
+        All expressions are validated first, so a typo fails the batch before anything is rolled.
+        """
+        if len(expressions) > MAX_BATCH_ROLLS:
+            raise ValueError(f"Too many rolls! Max {MAX_BATCH_ROLLS} per batch.")
+        compiled = []
+        for i, expression in enumerate(expressions):
+            try:
+                compiled.append(compile_expression(expression))
+            except ValueError as e:
+                raise ValueError(f"Roll #{i + 1}: {e}")
+        return [evaluate(c) for c in compiled]
+
+    @staticmethod
+    def stats() -> Dict[str, Any]:
+        info = _compile.cache_info()
         return {
-            "expression": expression,
-            "rolls": rolls,
-            "modifier": modifier,
-            "total": total,
-            "natural_20": 20 in rolls if sides == 20 else False,
-            "natural_1": 1 in rolls if sides == 20 else False
+            "compiled_cache": {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize},
+            "rng": secure_random.stats(),
         }
 
     @staticmethod
@@ -0,0 +1,168 @@
+import os
+import math
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+import numpy as np
+from app.core.dice import DiceTerm, compile_expression
+
+# Exact outcome distributions of dice expressions (same notation as DiceRoller.roll)
+ODDS_CACHE_SIZE = int(os.getenv("DICE_ODDS_CACHE_SIZE", "256")) # distributions kept (LRU)
+MAX_DISTRIBUTION_POINTS = 2000 # totals listed in a response; wider ranges only get the summary
+EXPLODE_TAIL = 1e-15 # exploding dice are followed until the remaining probability is below this
+MAX_KEEP_WORK = 250_000 # sides * dice^2 budget for keep/drop (order statistics over the faces)
+
+# A distribution is (offset, pmf): P(total == offset + i) == pmf[i]
+Distribution = Tuple[int, np.ndarray]
+
+def _convolve(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # Direct convolution is exact and faster for dice-sized arrays; FFT for the huge ones (100d1000)
+    if len(a) * len(b) <= 1_000_000:
+        return np.convolve(a, b)
+    n = len(a) + len(b) - 1
+    size = 1 << (n - 1).bit_length()
+    out = np.fft.irfft(np.fft.rfft(a, size) * np.fft.rfft(b, size), size)[:n]
+    return np.clip(out, 0.0, None)
+
+def _power(pmf: np.ndarray, count: int) -> np.ndarray:
+    """Distribution of the sum of `count` independent draws (binary exponentiation)."""
+    result = np.ones(1)
+    base = pmf
+    while count:
+        if count & 1:
+            result = _convolve(result, base)
+        count >>= 1
+        if count:
+            base = _convolve(base, base)
+    return result
+
+def _die_pmf(term: DiceTerm) -> np.ndarray:
+    """One die of the term, indexed by face value (index 0 unused), with reroll/explode applied."""
+    s = term.sides
+    pmf = np.zeros(s + 1)
+    pmf[1:] = 1.0 / s
+    if term.reroll_at_most:
+        # Reroll once: a low face only survives if the second roll shows it
+        r = term.reroll_at_most
+        pmf[1:] = (r / s) / s
+        pmf[r + 1:] += 1.0 / s
+
+    if term.explode:
+        # A max face adds a fresh (unrerolled) exploding die: value = s * depth + face
+        depth = max(1, math.ceil(math.log(1 / EXPLODE_TAIL) / math.log(s)))
+        chain = np.zeros(s * depth + 1)
+        for level in range(depth):
+            chain[level * s + 1:level * s + s] = (1.0 / s) ** (level + 1)
+        exploded = np.zeros(s * (depth + 1) + 1)
+        exploded[:s] = pmf[:s]
+        exploded[s:s + len(chain)] += pmf[s] * chain
+        pmf = exploded
+    return pmf
+
+def _keep_pmf(die: np.ndarray, count: int, keep: int, highest: bool) -> np.ndarray:
+    """
+    Sum of the `keep` highest (or lowest) of `count` iid dice, by order statistics over the faces:
+    walking faces best-first, j dice showing face v are kept while fewer than `keep` have been placed.
+    """
+    s = len(die) - 1
+    if keep == 1:
+        # Advantage / disadvantage: P(max <= v) = F(v)^n, P(min >= v) = (1 - F(v-1))^n
+        cdf = np.cumsum(die)
+        if highest:
+            return np.diff(cdf ** count, prepend=0.0)
+        survival = 1.0 - np.concatenate(([0.0], cdf[:-1]))
+        return -np.diff(survival ** count, append=0.0)
+
+    dp = np.zeros((count + 1, keep * s + 1)) # dp[dice placed, kept sum]
+    dp[0, 0] = 1.0
+    for v in (range(s, 0, -1) if highest else range(1, s + 1)):
+        p = die[v]
+        if p == 0:
+            continue
+        new = np.zeros_like(dp)
+        for placed in range(count + 1):
+            row = dp[placed]
+            if not row.any():
+                continue
+            for j in range(count - placed + 1):
+                shift = v * min(j, max(0, keep - placed))
+                w = math.comb(count - placed, j) * p ** j
+                new[placed + j, shift:] += row[:len(row) - shift] * w
+        dp = new
+    return dp[count]
+
+def _term_distribution(term: DiceTerm) -> Distribution:
+    die = _die_pmf(term)
+    if not term.select:
+        pmf = _power(die[1:], term.count)
+        offset = term.count
+    else:
+        if term.explode:
+            raise ValueError(f"Odds for exploding dice with keep/drop ('{term.text}') are not supported.")
+        if term.sides * term.count ** 2 > MAX_KEEP_WORK:
+            raise ValueError(f"'{term.text}' is too large to compute exactly.")
+        keep = term.select_n if term.select in ("kh", "kl") else term.count - term.select_n
+        pmf = _keep_pmf(die, term.count, keep, highest=term.select in ("kh", "dl"))
+        # Indexed from a kept sum of 0: drop the impossible totals at both ends (exact zeros,
+        # e.g. 0..2 for 4d6dl1) so min/max are the real range
+        nonzero = np.flatnonzero(pmf)
+        offset = int(nonzero[0])
+        pmf = pmf[offset:nonzero[-1] + 1]
+    if term.sign < 0:
+        return -(offset + len(pmf) - 1), pmf[::-1]
+    return offset, pmf
+
+@lru_cache(maxsize=ODDS_CACHE_SIZE)
+def _distribution(dice: Tuple[DiceTerm, ...], modifier: int) -> Distribution:
+    offset, pmf = modifier, np.ones(1)
+    for term in dice:
+        term_offset, term_pmf = _term_distribution(term)
+        offset += term_offset
+        pmf = _convolve(pmf, term_pmf)
+    pmf = pmf / pmf.sum()
+    pmf.setflags(write=False) # shared by every caller through the cache
+    return offset, pmf
+
+def distribution(expression: str) -> Distribution:
+    """
+    Exact distribution of an expression's total, memoized by normalized expression: term order and
+    spelling don't matter ('5+1d20' and '1d20 + 5' share one entry). Raises ValueError like DiceRoller.roll.
+    """
+    compiled = compile_expression(expression)
+    dice = tuple(sorted(
+        (t for t in compiled.terms if isinstance(t, DiceTerm)),
+        key=lambda t: (t.sign, t.count, t.sides, t.reroll_at_most, t.explode, t.select, t.select_n),
+    ))
+    return _distribution(dice, compiled.modifier)
+
+def prob_at_least(dist: Distribution, target: int) -> float:
+    offset, pmf = dist
+    i = target - offset
+    if i <= 0:
+        return 1.0
+    if i >= len(pmf):
+        return 0.0
+    return float(pmf[i:].sum())
+
+def odds(expression: str, target: Optional[int] = None, include_distribution: bool = True) -> Dict[str, Any]:
+    """
+    Summary of an expression's outcomes: range, mean, std, median and, with a target (DC / AC),
+    P(total >= target). `distribution` maps total -> probability when the range is small enough.
+    Exploding dice have no real max: theirs is where the remaining tail drops below EXPLODE_TAIL.
+    """
+    offset, pmf = dist = distribution(expression)
+    totals = np.arange(offset, offset + len(pmf))
+    mean = float(totals @ pmf)
+    result: Dict[str, Any] = {
+        "expression": compile_expression(expression).expression,
+        "min": int(offset),
+        "max": int(offset + len(pmf) - 1),
+        "mean": round(mean, 4),
+        "std": round(float(np.sqrt(((totals - mean) ** 2) @ pmf)), 4),
+        "median": int(offset + np.searchsorted(np.cumsum(pmf), 0.5)),
+    }
+    if target is not None:
+        result["target"] = target
+        result["p_at_least"] = round(prob_at_least(dist, target), 6)
+    if include_distribution and len(pmf) <= MAX_DISTRIBUTION_POINTS:
+        result["distribution"] = {int(t): round(float(p), 8) for t, p in zip(totals, pmf) if p >= 1e-9}
+    return result
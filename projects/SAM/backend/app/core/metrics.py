@@ -0,0 +1,185 @@
+import time
+import asyncio
+from prometheus_client import Counter, Histogram, Gauge, CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from app.core.startup import startup_profile
+
+# Prometheus metrics for the backend (scraped at GET /metrics).
+# Everything here is an in-process counter/histogram update: cheap enough to leave on in production.
+# Label values are bounded: route templates (not raw paths), table/RPC names, tool names.
+
+REQUEST_COUNT = Counter("sam_http_requests_total", "HTTP requests", ["method", "route", "status"])
+REQUEST_LATENCY = Histogram(
+    "sam_http_request_duration_seconds", "HTTP request latency (until the response body is sent)", ["method", "route"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60),
+)
+
+LLM_LATENCY = Histogram(
+    "sam_llm_call_duration_seconds", "Gemini call latency", ["mode"],
+    buckets=(0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60),
+)
+LLM_RATE_LIMITED = Counter("sam_llm_rate_limited_total", "Gemini 429 / RESOURCE_EXHAUSTED responses")
+LLM_ERRORS = Counter("sam_llm_errors_total", "Gemini calls that failed for other reasons")
+
+# Quota scheduler (app/services/llm_scheduler.py), labelled by priority class
+LLM_QUEUE_WAIT = Histogram(
+    "sam_llm_queue_wait_seconds", "Time a Gemini call waited for quota", ["priority"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 45, 120),
+)
+LLM_QUEUE_POSITION = Histogram(
+    "sam_llm_queue_position", "Calls ahead in the queue when a Gemini call was enqueued", ["priority"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55),
+)
+LLM_RETRIES = Counter("sam_llm_retries_total", "Gemini calls retried after a 429", ["priority"])
+LLM_QUEUE_TIMEOUTS = Counter("sam_llm_queue_timeouts_total", "Gemini calls that gave up waiting for quota", ["priority"])
+
+TOOL_CALLS = Counter("sam_tool_calls_total", "Tool calls requested by the model", ["tool", "outcome"])
+TOOL_LATENCY = Histogram(
+    "sam_tool_call_duration_seconds", "Tool execution latency", ["tool"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 15),
+)
+
+SUPABASE_LATENCY = Histogram(
+    "sam_supabase_request_duration_seconds", "Supabase request latency (time to response headers)", ["method", "target", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+EVENT_LOOP_LAG = Gauge("sam_event_loop_lag_seconds", "Last measured event loop scheduling delay")
+EVENT_LOOP_LAG_HIST = Histogram(
+    "sam_event_loop_lag_distribution_seconds", "Event loop scheduling delay",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+LOOP_LAG_INTERVAL = 0.5
+
+def supabase_target(path: str) -> str:
+    """
+    '/rest/v1/messages' -> 'table:messages', '/rest/v1/rpc/match_documents' -> 'rpc:match_documents',
+    '/auth/v1/user' -> 'auth:user'. Keeps label cardinality bounded.
+    """
+    parts = [p for p in path.split("/") if p]
+    if len(parts) >= 3 and parts[0] == "rest" and parts[2] == "rpc":
+        return f"rpc:{parts[3]}" if len(parts) > 3 else "rpc"
+    if len(parts) >= 3 and parts[0] == "rest":
+        return f"table:{parts[2]}"
+    if parts:
+        return f"{parts[0]}:{parts[2]}" if len(parts) > 2 else parts[0]
+    return "unknown"
+
+def observe_supabase(method: str, path: str, seconds: float, status: int):
+    SUPABASE_LATENCY.labels(method, supabase_target(path), str(status)).observe(seconds)
+
+def is_rate_limit_error(e: Exception) -> bool:
+    error_str = str(e)
+    return "RESOURCE_EXHAUSTED" in error_str or "429" in error_str
+
+class EmbeddingCacheCollector:
+    """
+    Reads the embedding cache counters at scrape time (no per-lookup overhead).
+    """
+
+    def describe(self):
+        return [] # Don't call collect() at registration (import cycles)
+
+    def collect(self):
+        from app.services.embeddings import get_embedding_cache_stats, get_embedding_batch_stats
+        stats = get_embedding_cache_stats()
+        lookups = CounterMetricFamily("sam_embedding_cache_lookups", "Query-embedding cache lookups", labels=["result"])
+        lookups.add_metric(["hit_memory"], stats["hits_memory"])
+        lookups.add_metric(["hit_disk"], stats["hits_disk"])
+        lookups.add_metric(["miss"], stats["misses"])
+        yield lookups
+        yield GaugeMetricFamily("sam_embedding_cache_hit_ratio", "Query-embedding cache hit rate", value=stats["hit_rate"])
+        yield GaugeMetricFamily("sam_embedding_cache_entries", "Entries in the in-memory tier", value=stats["entries"])
+
+        queries = CounterMetricFamily("sam_embedding_batch_queries", "Cache-miss queries sent to the batch coalescer", labels=["model"])
+        batches = CounterMetricFamily("sam_embedding_batch_requests", "Batch embedding requests sent to Gemini", labels=["model"])
+        for model, batch_stats in get_embedding_batch_stats().items():
+            queries.add_metric([model], batch_stats["queries"])
+            batches.add_metric([model], batch_stats["batches"])
+        yield queries
+        yield batches
+
+REGISTRY.register(EmbeddingCacheCollector())
+
+class MessageQueueCollector:
+    """
+    Write-behind message queue depth and counters, read at scrape time.
+    """
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        from app.services.persistence import message_writer
+        stats = message_writer.stats()
+        yield GaugeMetricFamily("sam_message_queue_depth", "Chat messages waiting to be written", value=stats["depth"])
+        yield CounterMetricFamily("sam_message_rows_written", "Chat messages written by the queue", value=stats["rows_written"])
+        yield CounterMetricFamily("sam_message_rows_dropped", "Chat messages dropped after retries", value=stats["dropped"])
+
+REGISTRY.register(MessageQueueCollector())
+
+class LLMSchedulerCollector:
+    """
+    Gemini queue depth per priority and remaining quota, read at scrape time.
+    """
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        from app.services.llm_scheduler import llm_scheduler
+        stats = llm_scheduler.stats()
+        depth = GaugeMetricFamily("sam_llm_queue_depth", "Gemini calls waiting for quota", labels=["priority"])
+        for priority, queued in stats["queued"].items():
+            depth.add_metric([priority], queued)
+        yield depth
+        yield GaugeMetricFamily("sam_llm_requests_available", "Request slots left in the RPM bucket", value=stats["requests_available"])
+        yield GaugeMetricFamily("sam_llm_tokens_available", "Tokens left in the TPM bucket", value=stats["tokens_available"])
+
+REGISTRY.register(LLMSchedulerCollector())
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware: request count + latency per route template (e.g. /characters/{character_id}).
+    Streaming responses are timed until the last chunk is sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # Unmatched paths share one label so scanners can't blow up cardinality
+            route_path = getattr(route, "path", None) or "unmatched"
+            REQUEST_COUNT.labels(scope["method"], route_path, str(status["code"])).inc()
+            REQUEST_LATENCY.labels(scope["method"], route_path).observe(time.perf_counter() - start)
+            startup_profile.request_served()
+
+async def monitor_event_loop_lag(interval: float = LOOP_LAG_INTERVAL):
+    """
+    Sleeps `interval` and measures how late the loop wakes us up (blocking code shows up here).
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(loop.time() - start - interval, 0.0)
+        EVENT_LOOP_LAG.set(lag)
+        EVENT_LOOP_LAG_HIST.observe(lag)
+
+def render_metrics() -> tuple:
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
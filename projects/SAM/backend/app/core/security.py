@@ -1,43 +1,187 @@
 import os
-from fastapi import HTTPException, Security
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import jwt
+from fastapi import HTTPException, Security, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from supabase import create_client, Client
+from app.core.database import get_supabase
 from dotenv import load_dotenv
 
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY") # This should be the ANON key
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET") # Legacy HS256 projects (Settings -> API -> JWT Secret)
+JWT_AUDIENCE = "authenticated"
+JWT_LEEWAY_SECONDS = 10
+TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
 
-# Initialize Client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Asymmetric projects publish their signing keys here. PyJWKClient caches them and
+# re-fetches the set when a token carries an unknown 'kid' (key rotation).
+jwks_client = jwt.PyJWKClient(
+    f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json",
+    cache_keys=True,
+    lifespan=3600,
+) if SUPABASE_URL else None
 
 security = HTTPBearer()
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Security(security)):
+class VerifiedTokenCache:
     """
-    Verifies the Supabase JWT token by asking Supabase Auth directly.
-    Returns the user payload/dictionary.
+    In-process cache of already verified tokens.
+    Keyed by SHA-256 of the token (never the raw token) and bounded by the token's own 'exp'.
     """
-    token = credentials.credentials
-    
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str):
+        k = self.key(token)
+        with self._lock:
+            entry = self._entries.get(k)
+            if not entry:
+                return None
+            user_data, exp = entry
+            if exp <= time.time():
+                del self._entries[k]
+                return None
+            self._entries.move_to_end(k)
+            return user_data
+
+    def put(self, token: str, user_data: dict, exp: float):
+        k = self.key(token)
+        with self._lock:
+            self._entries[k] = (user_data, exp)
+            self._entries.move_to_end(k)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+token_cache = VerifiedTokenCache()
+
+def _claims_to_user(claims: dict) -> dict:
+    # Same shape the remote check returns ('sub' is the user id)
+    return {
+        "sub": claims.get("sub"),
+        "email": claims.get("email"),
+        "user_metadata": claims.get("user_metadata", {})
+    }
+
+def _decode_locally(token: str) -> dict:
+    """
+    Verifies signature, expiry and audience without a network call.
+    HS256 tokens use the project JWT secret; asymmetric tokens use the cached JWKS.
+    """
+    header = jwt.get_unverified_header(token)
+    alg = header.get("alg")
+
+    if alg == "HS256":
+        if not SUPABASE_JWT_SECRET:
+            raise jwt.InvalidTokenError("HS256 token but SUPABASE_JWT_SECRET is not configured")
+        key = SUPABASE_JWT_SECRET
+    else:
+        if not jwks_client:
+            raise jwt.InvalidTokenError("No JWKS endpoint configured")
+        key = jwks_client.get_signing_key_from_jwt(token).key
+
+    return jwt.decode(
+        token,
+        key,
+        algorithms=[alg] if alg in ("HS256", "RS256", "ES256") else [],
+        audience=JWT_AUDIENCE,
+        leeway=JWT_LEEWAY_SECONDS,
+        options={"require": ["exp", "sub"]},
+    )
+
+def _verify_remotely(token: str) -> dict:
+    """
+    Remote verification: Ask Supabase "Who is this?"
+    Catches revoked sessions (logout, banned user) that a valid signature cannot.
+    """
+    response = get_supabase().auth.get_user(token)
+
+    if not response.user:
+        raise HTTPException(status_code=401, detail="Invalid session")
+
+    # Return user data as a dict to mimic the previous JWT payload structure
+    # The 'sub' claim in JWT usually maps to 'id' in the user object
+    return {
+        "sub": response.user.id,
+        "email": response.user.email,
+        "user_metadata": response.user.user_metadata
+    }
+
+def _verify_locally(token: str):
+    """
+    Local check (signature, expiry, audience), cached until 'exp'. Returns the user payload, raises a
+    401 for a bad token, or returns None if local verification is not possible (no secret/JWKS).
+    """
+    cached = token_cache.get(token)
+    if cached:
+        return cached
+
     try:
-        # Remote verification: Ask Supabase "Who is this?"
-        # This handles signature, expiration, and algorithms automatically.
-        response = supabase.auth.get_user(token)
-        
-        if not response.user:
-            raise HTTPException(status_code=401, detail="Invalid session")
-            
-        # Return user data as a dict to mimic the previous JWT payload structure
-        # The 'sub' claim in JWT usually maps to 'id' in the user object
-        user_data = {
-            "sub": response.user.id,
-            "email": response.user.email,
-            "user_metadata": response.user.user_metadata
-        }
+        claims = _decode_locally(token)
+        user_data = _claims_to_user(claims)
+        token_cache.put(token, user_data, claims["exp"])
         return user_data
-        
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Invalid token or session expired")
+    except (jwt.InvalidSignatureError, jwt.InvalidAudienceError, jwt.MissingRequiredClaimError, jwt.DecodeError) as e:
+        print(f"Auth Error: {e}")
+        raise HTTPException(status_code=401, detail="Invalid token or session expired")
+    except Exception as e:
+        # Misconfiguration or JWKS unreachable: don't lock players out, ask Supabase instead
+        print(f"Local JWT verification unavailable ({e}), falling back to remote check")
+        return None
+
+def _verify_remotely_or_401(token: str) -> dict:
+    try:
+        return _verify_remotely(token)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Auth Error: {e}")
         raise HTTPException(status_code=401, detail="Invalid token or session expired")
+
+def verify_token(credentials: HTTPAuthorizationCredentials = Security(security)):
+    """
+    Verifies the Supabase JWT locally (signature + expiry) and caches the result until 'exp'.
+    Falls back to Supabase Auth only if local verification is not possible (no secret/JWKS).
+    Returns the user payload/dictionary.
+    """
+    token = credentials.credentials
+    user_data = _verify_locally(token)
+    if user_data is not None:
+        return user_data
+    return _verify_remotely_or_401(token)
+
+def verify_token_timed(request: Request, credentials: HTTPAuthorizationCredentials = Security(security)):
+    """
+    verify_token for the chat endpoints: also records when auth started and how long it took
+    (request.state.auth_started / auth_ms), so the turn's timer can start there.
+    """
+    start = time.perf_counter()
+    request.state.auth_started = start
+    try:
+        return verify_token(credentials)
+    finally:
+        request.state.auth_ms = (time.perf_counter() - start) * 1000
+
+def verify_token_strict(credentials: HTTPAuthorizationCredentials = Security(security)):
+    """
+    For revocation-sensitive routes (deletes, uploads): verifies locally, then confirms
+    with Supabase Auth that the session has not been revoked. Never served from cache.
+    """
+    # One Supabase Auth round trip: the local check never falls back to remote here
+    user_data = _verify_locally(credentials.credentials)
+    remote = _verify_remotely_or_401(credentials.credentials)
+    if user_data is not None and remote["sub"] != user_data["sub"]:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    return remote
@@ -0,0 +1,60 @@
+import os
+import time
+import asyncio
+from typing import Dict, List
+
+# Pre-build the Gemini/Supabase clients in the background once the server is up (the port is not held up)
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "true").lower() in ("1", "true", "yes")
+
+class StartupProfile:
+    """
+    Wall-clock milestones of this process, relative to when server.py started importing:
+    imports done, app ready (lifespan), warm-up steps, first request served.
+    Per-module import times come from scripts/startup_profile.py (python -X importtime).
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.marks: Dict[str, float] = {} # milestone -> ms since start
+        self.warmup: Dict[str, float] = {} # step -> ms it took
+        self.warmup_errors: Dict[str, str] = {}
+
+    def mark(self, name: str):
+        self.marks.setdefault(name, round((time.perf_counter() - self.started) * 1000, 2))
+
+    def request_served(self):
+        # Called per request: after the first one this is a single dict lookup
+        if "first_request" not in self.marks:
+            self.mark("first_request")
+
+    async def run_warmup(self, steps: List[tuple]):
+        """
+        Runs (name, fn) steps one after the other, timing each. Blocking functions run in a worker
+        thread, coroutine functions on the loop. Failures are logged and skipped: the lazy getters
+        will retry on first real use.
+        """
+        for name, fn in steps:
+            start = time.perf_counter()
+            try:
+                if asyncio.iscoroutinefunction(fn):
+                    await fn()
+                else:
+                    await asyncio.to_thread(fn)
+            except Exception as e:
+                self.warmup_errors[name] = str(e)
+                print(f"WARNING: Warm-up step '{name}' failed: {e}")
+            self.warmup[name] = round((time.perf_counter() - start) * 1000, 2)
+        self.mark("warmup_done")
+        print(f"Warm-up done in {sum(self.warmup.values()):.0f}ms ({', '.join(f'{k} {v:.0f}ms' for k, v in self.warmup.items())})")
+
+    def report(self) -> dict:
+        return {
+            "uptime_s": round(time.perf_counter() - self.started, 1),
+            "milestones_ms": dict(self.marks),
+            "warmup_enabled": WARMUP_ON_START,
+            "warmup_ms": dict(self.warmup),
+            "warmup_errors": dict(self.warmup_errors),
+        }
+
+# Singleton instance (import this first in server.py so 'started' is as early as possible)
+startup_profile = StartupProfile()
@@ -0,0 +1,258 @@
+import re
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Machine tags S.A.M. embeds in its narrative. The frontend renders or strips them,
+# so they must never reach a client half-written.
+STREAM_TAGS = ("UPDATE", "LOOT", "IMAGE", "DM_ROLL", "XP_GAIN", "EVENT")
+
+# Tags whose body is a JSON document
+JSON_TAGS = ("UPDATE", "LOOT", "DM_ROLL")
+# Longest trailing '{"...' a stream holds back in case an orphan closer ('</LOOT>' without opener) follows
+ORPHAN_HOLD_MAX = 1024
+
+def repair_json(text: str) -> str:
+    """
+    Best-effort fix for truncated JSON from the model: strips ```json fences,
+    closes an open string and any unbalanced brackets/braces.
+    """
+    text = text.replace("```json", "").replace("```", "").strip()
+    closers, in_string, escape = [], False, False
+    for ch in text:
+        if escape:
+            escape = False
+            continue
+        if ch == "\\":
+            escape = True
+            continue
+        if ch == '"':
+            in_string = not in_string
+            continue
+        if in_string:
+            continue
+        if ch in "{[":
+            closers.append("}" if ch == "{" else "]")
+        elif ch in "}]" and closers and closers[-1] == ch:
+            closers.pop()
+    if in_string:
+        text += '"'
+    return text + "".join(reversed(closers))
+
+def parse_tag_payload(tag: str, content: str) -> Tuple[Any, Optional[str]]:
+    """
+    Validates a tag body. Returns (payload, error); error is None when the payload is usable.
+    UPDATE/LOOT/DM_ROLL -> JSON, XP_GAIN -> int, EVENT -> upper-case name, IMAGE -> prompt text.
+    """
+    content = content.strip()
+    if tag in JSON_TAGS:
+        try:
+            return json.loads(content.replace("```json", "").replace("```", "").strip()), None
+        except ValueError:
+            pass
+        try:
+            return json.loads(repair_json(content)), None
+        except ValueError as e:
+            return None, f"Invalid JSON: {e}"
+    if tag == "XP_GAIN":
+        match = re.search(r"-?\d+", content)
+        if not match:
+            return None, "XP amount is not a number"
+        return int(match.group(0)), None
+    if tag == "EVENT":
+        return (content.upper(), None) if content else (None, "Empty event")
+    return (content, None) if content else (None, "Empty tag")
+
+class TagStreamFilter:
+    """
+    Single-pass scanner that splits model output into narrative text and complete machine tags.
+    Works on streamed chunks: text that could still turn into a known tag (e.g. '<LO' or
+    '<LOOT>{"items": [') is held back until the tag closes, then emitted as a single tag event.
+    Every character is examined a bounded number of times, however the output is chunked.
+    """
+
+    def __init__(self, tags: Sequence[str] = STREAM_TAGS):
+        self.tags = tuple(tags)
+        self.openers = [f"<{t}>" for t in self.tags]
+        self.closers = [f"</{t}>" for t in self.tags]
+        self.pattern = re.compile(r"<(/?)(" + "|".join(re.escape(t) for t in self.tags) + r")>")
+        self.max_marker = max(len(c) for c in self.closers)
+        self.buffer = ""
+        self.open_tag: Optional[str] = None # Tag whose closer we are waiting for (buffer starts at its opener)
+        self.scan_from = 0 # Where to resume looking for that closer
+
+    def _tag_event(self, tag: str, content: str, recovered: bool = False) -> Dict[str, Any]:
+        payload, error = parse_tag_payload(tag, content)
+        event = {"type": "tag", "tag": tag, "content": content.strip(), "payload": payload, "valid": error is None}
+        if error:
+            event["error"] = error
+        if recovered:
+            event["recovered"] = True
+        return event
+
+    def _recover_orphan(self, tag: str, text: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        '</LOOT>' with no opener (the model dropped it): the JSON right before it is the payload.
+        Only text not yet emitted can be recovered; feed() holds back a trailing '{...}' for that.
+        """
+        if tag in JSON_TAGS:
+            body = text.rstrip()
+            # Walk back from the last '}' to its matching '{'
+            depth = 0
+            for start in range(len(body) - 1, -1, -1):
+                if body[start] == "}":
+                    depth += 1
+                elif body[start] == "{":
+                    depth -= 1
+                    if depth <= 0:
+                        break
+            else:
+                return text, None
+            event = self._tag_event(tag, body[start:], recovered=True)
+            if event["valid"]:
+                return body[:start], event
+        return text, None
+
+    def _hold_from(self, buffer: str, pos: int, end: int) -> int:
+        """
+        Where a '{...}' block running to the end of buffer[pos:end] (still open, or closed and followed
+        only by whitespace) starts: it may be the payload of an orphan closer that hasn't arrived yet.
+        Only blocks that look like tag JSON ('{"...', or a '{' with nothing after it yet) are held, so
+        braces in ordinary narration stream straight through. Returns `end` when there is nothing to hold.
+        """
+        if not any(t in JSON_TAGS for t in self.tags):
+            return end
+        depth, start = 0, end
+        for i in range(max(pos, end - ORPHAN_HOLD_MAX), end):
+            ch = buffer[i]
+            if ch == "{":
+                if depth == 0:
+                    start = i
+                depth += 1
+            elif ch == "}" and depth:
+                depth -= 1
+            elif depth == 0 and not ch.isspace():
+                start = end # Narrative after the block: no closer can claim it any more
+        head = buffer[start + 1:end].lstrip()
+        if start < end and head and not head.startswith('"'):
+            return end # '{weird}' prose, not a JSON object
+        return start
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """
+        Adds a chunk of model output and returns the events that are now safe to emit.
+        Events are {"type": "text", "text": ...} or
+        {"type": "tag", "tag": ..., "content": ..., "payload": ..., "valid": bool[, "error": ...]}.
+        """
+        buffer = self.buffer + chunk
+        events: List[Dict[str, Any]] = []
+        text_parts: List[str] = []
+        pos = 0
+
+        def flush_text():
+            if text_parts:
+                text = "".join(text_parts)
+                text_parts.clear()
+                if text:
+                    events.append({"type": "text", "text": text})
+
+        while pos < len(buffer):
+            # 1. Inside a tag: wait for its closing tag
+            if self.open_tag:
+                opener, closer = f"<{self.open_tag}>", f"</{self.open_tag}>"
+                end = buffer.find(closer, max(pos + len(opener), self.scan_from))
+                if end == -1:
+                    # Next time, only re-check the tail that could hold a split closer
+                    self.scan_from = max(pos + len(opener), len(buffer) - len(closer) + 1)
+                    break
+                flush_text()
+                events.append(self._tag_event(self.open_tag, buffer[pos + len(opener):end]))
+                pos = end + len(closer)
+                self.open_tag = None
+                continue
+
+            match = self.pattern.search(buffer, pos)
+            if match is None:
+                # 2. Partial marker at the end of the buffer: wait for more input
+                end = len(buffer)
+                lt = buffer.rfind("<", max(pos, len(buffer) - self.max_marker))
+                if lt != -1 and any(m.startswith(buffer[lt:]) for m in self.openers + self.closers):
+                    end = lt
+                # A trailing JSON block waits too, in case an orphan closer claims it
+                hold = self._hold_from(buffer, pos, end)
+                text_parts.append(buffer[pos:hold])
+                pos = hold
+                break
+
+            text_parts.append(buffer[pos:match.start()])
+            tag = match.group(2)
+            if match.group(1):
+                # 3. Orphan closing tag: recover the payload if we can, never show the marker
+                text, event = self._recover_orphan(tag, "".join(text_parts))
+                text_parts[:] = [text]
+                if event:
+                    flush_text()
+                    events.append(event)
+                pos = match.end()
+                continue
+
+            # 4. Opening tag: keep the buffer anchored at it until the closer arrives
+            self.open_tag = tag
+            self.scan_from = match.end()
+            pos = match.start()
+
+        flush_text()
+        self.buffer = buffer[pos:]
+        self.scan_from = max(self.scan_from - pos, 0)
+        return events
+
+    def flush(self) -> List[Dict[str, Any]]:
+        """
+        End of output. A tag that never closed (truncated reply) is recovered if its payload
+        can be repaired; anything else still held back is emitted as plain text.
+        """
+        remaining, self.buffer = self.buffer, ""
+        tag, self.open_tag = self.open_tag, None
+        self.scan_from = 0
+        if tag:
+            event = self._tag_event(tag, remaining[len(tag) + 2:], recovered=True)
+            if event["valid"] and tag in JSON_TAGS:
+                return [event]
+        return [{"type": "text", "text": remaining}] if remaining else []
+
+@dataclass
+class ParsedResponse:
+    """
+    Model output split into the narrative and its typed tag events (in order of appearance).
+    """
+    narrative: str
+    events: List[Dict[str, Any]] = field(default_factory=list)
+    segments: List[Dict[str, Any]] = field(default_factory=list)
+
+    def payloads(self, tag: str) -> List[Any]:
+        return [e["payload"] for e in self.events if e["tag"] == tag and e["valid"]]
+
+    def render(self, keep: Sequence[str] = ()) -> str:
+        """
+        Rebuilds the text with only the `keep` tags, re-serialized from their validated payloads
+        (so clients never need to repair JSON). Invalid tags are dropped.
+        """
+        parts = []
+        for seg in self.segments:
+            if seg["type"] == "text":
+                parts.append(seg["text"])
+            elif seg["tag"] in keep and seg["valid"]:
+                payload = seg["payload"]
+                body = json.dumps(payload, ensure_ascii=False) if seg["tag"] in JSON_TAGS else str(payload)
+                parts.append(f"<{seg['tag']}>{body}</{seg['tag']}>")
+        return "".join(parts).strip()
+
+def parse_tags(text: str, tags: Sequence[str] = STREAM_TAGS) -> ParsedResponse:
+    """
+    One linear pass over a complete response (same scanner the stream uses).
+    """
+    scanner = TagStreamFilter(tags)
+    segments = scanner.feed(text) + scanner.flush()
+    events = [{k: v for k, v in s.items() if k != "type"} for s in segments if s["type"] == "tag"]
+    narrative = "".join(s["text"] for s in segments if s["type"] == "text").strip()
+    return ParsedResponse(narrative, events, segments)
@@ -0,0 +1,144 @@
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+# How many recent turns /perf aggregates over (per process)
+PERF_LOG_SIZE = int(os.getenv("PERF_LOG_SIZE", "500"))
+
+class TurnTimer:
+    """
+    Stage timings for one chat turn (auth, campaign lookup, embedding, each LLM call, each tool, ...).
+    Spans with the same stage name (e.g. several LLM passes) are kept individually and summed per stage.
+    """
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = started if started is not None else time.perf_counter() # perf_counter() at turn start
+        self.spans: List[tuple] = [] # (stage, start_ms relative to turn start, duration_ms)
+        self.tokens = {"prompt": 0, "completion": 0}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.add(stage, (end - start) * 1000, start_ms=(start - self.started) * 1000)
+
+    def add(self, stage: str, ms: float, start_ms: Optional[float] = None):
+        if start_ms is None:
+            start_ms = (time.perf_counter() - self.started) * 1000 - ms
+        with self._lock:
+            self.spans.append((stage, round(start_ms, 2), round(ms, 2)))
+
+    def add_usage(self, usage: Optional[dict]):
+        """
+        Accumulates LangChain usage_metadata ({"input_tokens", "output_tokens", ...}) across LLM calls.
+        """
+        if not usage:
+            return
+        with self._lock:
+            self.tokens["prompt"] += usage.get("input_tokens", 0) or 0
+            self.tokens["completion"] += usage.get("output_tokens", 0) or 0
+
+    def stages(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for stage, _, ms in self.spans:
+            totals[stage] = round(totals.get(stage, 0.0) + ms, 2)
+        return totals
+
+    def to_dict(self) -> dict:
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "stages": self.stages(),
+            "spans": [{"stage": s, "start_ms": st, "ms": ms} for s, st, ms in self.spans],
+            "tokens": dict(self.tokens),
+        }
+
+# The timer of the turn being served (set by the chat endpoints, read by services/tools)
+current_timer: ContextVar[Optional[TurnTimer]] = ContextVar("current_timer", default=None)
+
+def start_turn(started: Optional[float] = None) -> TurnTimer:
+    """
+    New timer for a chat turn, made current for this context (server.py adds the auth stage).
+    `started` backdates it (perf_counter value) so work done before the handler, like auth, is in total_ms.
+    """
+    timer = TurnTimer(started)
+    current_timer.set(timer)
+    return timer
+
+@contextmanager
+def span(stage: str):
+    """
+    Times a block against the current turn; a no-op outside a chat turn (scripts, admin).
+    """
+    timer = current_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.span(stage):
+        yield
+
+def record_usage(usage: Optional[dict]):
+    timer = current_timer.get()
+    if timer is not None:
+        timer.add_usage(usage)
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+class PerfLog:
+    """
+    Ring buffer of recent turn timings with p50/p95/p99 per stage.
+    """
+
+    def __init__(self, size: int = PERF_LOG_SIZE):
+        self.turns = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, perf: dict):
+        with self._lock:
+            self.turns.append(perf)
+
+    def summary(self, last: Optional[int] = None) -> dict:
+        with self._lock:
+            turns = list(self.turns)[-last:] if last else list(self.turns)
+        samples: Dict[str, List[float]] = {"total": []}
+        for perf in turns:
+            samples["total"].append(perf.get("total_ms", 0.0))
+            for stage, ms in perf.get("stages", {}).items():
+                samples.setdefault(stage, []).append(ms)
+            for key in ("prompt", "completion"):
+                samples.setdefault(f"tokens_{key}", []).append(float(perf.get("tokens", {}).get(key, 0)))
+
+        report = {}
+        for stage, values in samples.items():
+            values.sort()
+            report[stage] = {
+                "count": len(values),
+                "p50": round(_percentile(values, 50), 2),
+                "p95": round(_percentile(values, 95), 2),
+                "p99": round(_percentile(values, 99), 2),
+            }
+        return {"turns": len(turns), "stages": report}
+
+    def format_report(self, last: Optional[int] = None) -> str:
+        data = self.summary(last)
+        if not data["turns"]:
+            return "No turns recorded yet."
+        lines = [f"**⏱️ Turn Performance** (last {data['turns']} turns, ms)", "", "| Stage | n | p50 | p95 | p99 |", "|---|---|---|---|---|"]
+        for stage, s in sorted(data["stages"].items(), key=lambda kv: -kv[1]["p50"]):
+            lines.append(f"| {stage} | {s['count']} | {s['p50']:g} | {s['p95']:g} | {s['p99']:g} |")
+        return "\n".join(lines)
+
+# Singleton instance
+perf_log = PerfLog()
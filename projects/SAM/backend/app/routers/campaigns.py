@@ -1,21 +1,19 @@
 from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
-from supabase import Client, create_client
+from supabase import Client
 import os
 from dotenv import load_dotenv
-from app.core.security import verify_token
+from app.core.security import verify_token, verify_token_strict
+from app.core.database import get_db
 from app.services.ingestion import IngestionService
+from app.services.campaign_context import campaign_contexts
+from app.services.combat import combat_engine, format_summary
 
 load_dotenv()
 
 router = APIRouter(prefix="/api/campaigns", tags=["campaigns"])
 
-# Supabase Auth & Client
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
 # --- Models ---
 class CampaignBase(BaseModel):
     name: str
@@ -42,36 +40,37 @@ class CampaignResponse(CampaignBase):
 # --- Endpoints ---
 
 @router.get("/", response_model=List[CampaignResponse])
-def list_campaigns(user: dict = Depends(verify_token)):
+def list_campaigns(user: dict = Depends(verify_token), db: Client = Depends(get_db)):
     # RLS Policies on Supabase will filter viewing rights
     # Usually we want "Campaigns I am GM of" or "Campaigns I am Player in"
     # But for now, lists all visible campaigns
-    response = supabase.table("campaigns").select("*").execute()
+    response = db.table("campaigns").select("*").execute()
     return response.data
 
 @router.get("/{campaign_id}", response_model=CampaignResponse)
-def get_campaign(campaign_id: str, user: dict = Depends(verify_token)):
-    response = supabase.table("campaigns").select("*").eq("id", campaign_id).execute()
+def get_campaign(campaign_id: str, user: dict = Depends(verify_token), db: Client = Depends(get_db)):
+    response = db.table("campaigns").select("*").eq("id", campaign_id).execute()
     if not response.data:
         raise HTTPException(status_code=404, detail="Campaign not found")
     return response.data[0]
 
 @router.post("/", response_model=CampaignResponse)
-def create_campaign(campaign: CampaignCreate, user: dict = Depends(verify_token)):
+def create_campaign(campaign: CampaignCreate, user: dict = Depends(verify_token), db: Client = Depends(get_db)):
     gm_id = user['sub']
     
     data = campaign.model_dump()
     data['gm_id'] = gm_id
     
-    response = supabase.table("campaigns").insert(data).execute()
+    response = db.table("campaigns").insert(data).execute()
     if not response.data:
         raise HTTPException(status_code=500, detail="Failed to create campaign")
+    campaign_contexts.invalidate_user(gm_id) # A GM without characters now routes here
     return response.data[0]
 
 @router.patch("/{campaign_id}", response_model=CampaignResponse)
-def update_campaign(campaign_id: str, updates: CampaignUpdate, user: dict = Depends(verify_token)):
+def update_campaign(campaign_id: str, updates: CampaignUpdate, user: dict = Depends(verify_token), db: Client = Depends(get_db)):
     # Verify GM ownership
-    existing = supabase.table("campaigns").select("gm_id, settings").eq("id", campaign_id).execute()
+    existing = db.table("campaigns").select("gm_id, settings").eq("id", campaign_id).execute()
     if not existing.data:
         raise HTTPException(status_code=404, detail="Campaign not found")
     
@@ -89,32 +88,36 @@ def update_campaign(campaign_id: str, updates: CampaignUpdate, user: dict = Depe
         merged_settings = {**current_settings, **data["settings"]}
         data["settings"] = merged_settings
 
-    response = supabase.table("campaigns").update(data).eq("id", campaign_id).execute()
+    response = db.table("campaigns").update(data).eq("id", campaign_id).execute()
     if not response.data:
         raise HTTPException(status_code=500, detail="Update failed")
+    campaign_contexts.invalidate_campaign(campaign_id) # Cached settings/rules are stale
     return response.data[0]
 
 @router.delete("/{campaign_id}")
-def delete_campaign(campaign_id: str, user: dict = Depends(verify_token)):
+def delete_campaign(campaign_id: str, user: dict = Depends(verify_token_strict), db: Client = Depends(get_db)):
     # Verify GM ownership
-    existing = supabase.table("campaigns").select("gm_id").eq("id", campaign_id).execute()
+    existing = db.table("campaigns").select("gm_id").eq("id", campaign_id).execute()
     if not existing.data:
         raise HTTPException(status_code=404, detail="Campaign not found")
     
     if existing.data[0]['gm_id'] != user['sub']:
         raise HTTPException(status_code=403, detail="Only the GM can delete the campaign")
 
-    response = supabase.table("campaigns").delete().eq("id", campaign_id).execute()
+    response = db.table("campaigns").delete().eq("id", campaign_id).execute()
+    campaign_contexts.invalidate_campaign(campaign_id)
+    campaign_contexts.invalidate_user(user['sub'])
     return {"message": "Campaign deleted successfully"}
 
 @router.post("/{campaign_id}/modules")
 async def upload_campaign_module(
     campaign_id: str, 
     file: UploadFile = File(...), 
-    user: dict = Depends(verify_token)
+    user: dict = Depends(verify_token_strict),
+    db: Client = Depends(get_db)
 ):
     # Verify GM ownership
-    existing = supabase.table("campaigns").select("gm_id").eq("id", campaign_id).execute()
+    existing = db.table("campaigns").select("gm_id").eq("id", campaign_id).execute()
     if not existing.data:
         raise HTTPException(status_code=404, detail="Campaign not found")
     
@@ -128,3 +131,15 @@ async def upload_campaign_module(
     except Exception as e:
         print(f"Upload Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/{campaign_id}/encounter")
+async def get_encounter(campaign_id: str, user: dict = Depends(verify_token)):
+    """
+    Running encounter of the campaign (initiative order, monster HP/AC/conditions, round and turn), or null.
+    """
+    try:
+        encounter = await combat_engine.get(campaign_id)
+    except Exception as e:
+        print(f"Encounter lookup error: {e}")
+        raise HTTPException(status_code=503, detail="Combat tracker unavailable (run schema_combat.sql)")
+    return {"encounter": encounter, "summary": format_summary(encounter) if encounter else None}
@@ -1,20 +1,18 @@
 from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
-from supabase import Client, create_client
+from supabase import Client
 import os
 from dotenv import load_dotenv
-from app.core.security import verify_token
+from app.core.security import verify_token, verify_token_strict
+from app.core.database import get_db
+from app.services.campaign_context import campaign_contexts
 
 load_dotenv()
 
 router = APIRouter(prefix="/api/characters", tags=["characters"])
 
-# Supabase Auth & Client
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
 # --- Models ---
 class ActiveEffect(BaseModel):
     name: str
@@ -61,21 +59,22 @@ async def import_character_pdf(file: UploadFile = File(...), user: dict = Depend
     Uploads a PDF, uses Gemini to parse it, and returns the Character JSON.
     Does NOT save to DB yet (Client must confirm).
     """
-    from app.services.ai import sam_brain
+    from app.services.ai import get_sam_brain
     
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="File must be a PDF")
     
     try:
         contents = await file.read()
-        character_data = sam_brain.parse_character_pdf(contents)
+        # Gemini PDF parsing is blocking; run it in a worker thread so chat stays responsive
+        character_data = await run_in_threadpool(lambda: get_sam_brain().parse_character_pdf(contents))
         return character_data
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/", response_model=CharacterResponse)
-def create_character(char: CharacterCreate, user: dict = Depends(verify_token)):
+def create_character(char: CharacterCreate, user: dict = Depends(verify_token), db: Client = Depends(get_db)):
     try:
         print(f"DEBUG: Create Character Payload: {char.model_dump()}")
 
@@ -89,12 +88,12 @@ def create_character(char: CharacterCreate, user: dict = Depends(verify_token)):
         # The frontend sends a hardcoded ID which might not exist in this DB instance.
         # We check if it exists. If not, we assign to the first available campaign.
         
-        camp_check = supabase.table("campaigns").select("id").eq("id", char.campaign_id).execute()
+        camp_check = db.table("campaigns").select("id").eq("id", char.campaign_id).execute()
         if not camp_check.data:
             print(f"WARNING: Campaign {char.campaign_id} not found. Fallback to default...")
             
             # Find ANY campaign
-            any_camp = supabase.table("campaigns").select("id").limit(1).execute()
+            any_camp = db.table("campaigns").select("id").limit(1).execute()
             if any_camp.data:
                 new_cid = any_camp.data[0]['id']
                 print(f"DEBUG: Reassigning to existing campaign: {new_cid}")
@@ -102,7 +101,7 @@ def create_character(char: CharacterCreate, user: dict = Depends(verify_token)):
             else:
                 # No campaigns exist? Create one for the system.
                 print("DEBUG: No campaigns found! Creating 'Default Campaign'...")
-                new_camp_res = supabase.table("campaigns").insert({
+                new_camp_res = db.table("campaigns").insert({
                     "name": "The Lost Mines (Default)",
                     "gm_id": user_id, 
                     "status": "active"
@@ -112,11 +111,13 @@ def create_character(char: CharacterCreate, user: dict = Depends(verify_token)):
 
         # 3. Insert Character
         data = char.model_dump(by_alias=True)
-        response = supabase.table("characters").insert(data).execute()
+        response = db.table("characters").insert(data).execute()
         
         if not response.data:
             raise HTTPException(status_code=500, detail="Failed to create character (DB returned no data)")
-            
+        
+        # The owner now plays in this campaign (chat routing)
+        campaign_contexts.invalidate_user(user_id)
         return response.data[0]
 
     except Exception as e:
@@ -126,36 +127,36 @@ def create_character(char: CharacterCreate, user: dict = Depends(verify_token)):
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/{character_id}", response_model=CharacterResponse)
-def get_character(character_id: str, user: dict = Depends(verify_token)):
+def get_character(character_id: str, user: dict = Depends(verify_token), db: Client = Depends(get_db)):
     # Optional: Check if character belongs to user or is public
-    response = supabase.table("characters").select("*").eq("id", character_id).execute()
+    response = db.table("characters").select("*").eq("id", character_id).execute()
     if not response.data:
         raise HTTPException(status_code=404, detail="Character not found")
     return response.data[0]
 
 @router.get("/user/me", response_model=List[CharacterResponse])
-def list_my_characters(user: dict = Depends(verify_token)):
+def list_my_characters(user: dict = Depends(verify_token), db: Client = Depends(get_db)):
     user_id = user['sub']
-    response = supabase.table("characters").select("*").eq("user_id", user_id).execute()
+    response = db.table("characters").select("*").eq("user_id", user_id).execute()
     return response.data
 
 # Deprecated/Admin only? Keeping for now but protected
 @router.get("/user/{user_id}", response_model=List[CharacterResponse])
-def list_user_characters(user_id: str, user: dict = Depends(verify_token)):
+def list_user_characters(user_id: str, user: dict = Depends(verify_token), db: Client = Depends(get_db)):
     # Verify requesting user is the target user
     if user['sub'] != user_id:
          raise HTTPException(status_code=403, detail="Access denied")
-    response = supabase.table("characters").select("*").eq("user_id", user_id).execute()
+    response = db.table("characters").select("*").eq("user_id", user_id).execute()
     return response.data
 
 @router.patch("/{character_id}", response_model=CharacterResponse)
-def update_character(character_id: str, updates: CharacterUpdate, user: dict = Depends(verify_token)):
+def update_character(character_id: str, updates: CharacterUpdate, user: dict = Depends(verify_token), db: Client = Depends(get_db)):
     # Verify ownership before update
     print(f"DEBUG: PATCH /characters/{character_id} called by {user['sub']}")
     print(f"DEBUG: Payload: {updates.model_dump(exclude_unset=True)}")
 
     # Fetch existing first (Get status for merging)
-    existing = supabase.table("characters").select("user_id, status").eq("id", character_id).execute()
+    existing = db.table("characters").select("user_id, status").eq("id", character_id).execute()
     if not existing.data:
         raise HTTPException(status_code=404, detail="Character not found")
     
@@ -176,26 +177,28 @@ def update_character(character_id: str, updates: CharacterUpdate, user: dict = D
         data["status"] = merged_status
         print(f"DEBUG: Merged Status: {merged_status}")
         
-    response = supabase.table("characters").update(data).eq("id", character_id).execute()
+    response = db.table("characters").update(data).eq("id", character_id).execute()
     if not response.data:
         print(f"DEBUG: Update Failed! Response: {response}")
         raise HTTPException(status_code=404, detail="Update failed")
     
     print(f"DEBUG: Update Success. New Data: {response.data[0]}")
+    campaign_contexts.invalidate_user(current_record['user_id'])
     return response.data[0]
 
 @router.delete("/{character_id}")
-def delete_character(character_id: str, user: dict = Depends(verify_token)):
+def delete_character(character_id: str, user: dict = Depends(verify_token_strict), db: Client = Depends(get_db)):
     # Verify ownership before delete
-    existing = supabase.table("characters").select("user_id").eq("id", character_id).execute()
+    existing = db.table("characters").select("user_id").eq("id", character_id).execute()
     if not existing.data:
         raise HTTPException(status_code=404, detail="Character not found")
     
     if existing.data[0]['user_id'] != user['sub']:
         raise HTTPException(status_code=403, detail="Not authorized to delete this character")
 
-    response = supabase.table("characters").delete().eq("id", character_id).execute()
+    response = db.table("characters").delete().eq("id", character_id).execute()
     if not response.data:
         raise HTTPException(status_code=500, detail="Delete failed")
     
+    campaign_contexts.invalidate_user(user['sub'])
     return {"message": "Character deleted successfully"}
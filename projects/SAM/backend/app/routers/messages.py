@@ -1,19 +1,16 @@
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from typing import List, Optional
-from supabase import Client, create_client
+from supabase import Client
 import os
 from dotenv import load_dotenv
 from app.core.security import verify_token
+from app.core.database import get_db
 
 load_dotenv()
 
 router = APIRouter(prefix="/api/messages", tags=["messages"])
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
 # --- Models ---
 class PrivateMessageCreate(BaseModel):
     campaign_id: str
@@ -38,16 +35,16 @@ class PrivateMessageResponse(BaseModel):
 # --- Endpoints ---
 
 @router.get("/", response_model=List[PrivateMessageResponse])
-def get_my_messages(user: dict = Depends(verify_token)):
+def get_my_messages(user: dict = Depends(verify_token), db: Client = Depends(get_db)):
     user_id = user['sub']
     # Select messages where I am receiver OR sender
     # Supabase syntax for OR is a bit tricky via python client sometimes, using comma in .or_()
     # "receiver_id.eq.USER_ID,sender_id.eq.USER_ID"
-    response = supabase.table("private_messages").select("*").or_(f"receiver_id.eq.{user_id},sender_id.eq.{user_id}").order("created_at", desc=True).execute()
+    response = db.table("private_messages").select("*").or_(f"receiver_id.eq.{user_id},sender_id.eq.{user_id}").order("created_at", desc=True).execute()
     return response.data
 
 @router.post("/", response_model=PrivateMessageResponse)
-def send_message(msg: PrivateMessageCreate, user: dict = Depends(verify_token)):
+def send_message(msg: PrivateMessageCreate, user: dict = Depends(verify_token), db: Client = Depends(get_db)):
     sender_id = user['sub']
     
     data = msg.model_dump()
@@ -56,23 +53,23 @@ def send_message(msg: PrivateMessageCreate, user: dict = Depends(verify_token)):
     # We rely on RLS/Backend Logic to ensure sender owns the sender_character_id if provided?
     # For now, we trust the client or checking RLS in Supabase
     
-    response = supabase.table("private_messages").insert(data).execute()
+    response = db.table("private_messages").insert(data).execute()
     if not response.data:
         raise HTTPException(status_code=500, detail="Failed to send message")
         
     return response.data[0]
 
 @router.patch("/{message_id}/read", response_model=PrivateMessageResponse)
-def mark_message_read(message_id: str, is_read: bool = True, user: dict = Depends(verify_token)):
+def mark_message_read(message_id: str, is_read: bool = True, user: dict = Depends(verify_token), db: Client = Depends(get_db)):
     user_id = user['sub']
     
     # Verify I am the receiver
-    existing = supabase.table("private_messages").select("receiver_id").eq("id", message_id).execute()
+    existing = db.table("private_messages").select("receiver_id").eq("id", message_id).execute()
     if not existing.data:
         raise HTTPException(status_code=404, detail="Message not found")
     
     if existing.data[0]['receiver_id'] != user_id:
         raise HTTPException(status_code=403, detail="Not authorized to modify this message")
         
-    response = supabase.table("private_messages").update({"is_read": is_read}).eq("id", message_id).execute()
+    response = db.table("private_messages").update({"is_read": is_read}).eq("id", message_id).execute()
     return response.data[0]
@@ -2,7 +2,7 @@
 import os
 import fitz  # PyMuPDF
 import json
-import time
+import sys
 import ast
 import base64
 from langchain_google_genai import ChatGoogleGenerativeAI
@@ -12,7 +12,13 @@ from dotenv import load_dotenv
 # Load env from parent directory
 load_dotenv(dotenv_path="../../.env")
 
-llm = ChatGoogleGenerativeAI(model="gemini-flash-latest", temperature=0)
+# Gemini quota scheduler (RPM/TPM buckets, 429 retries with backoff) instead of fixed sleeps.
+# This process only takes the script share of the quota (GEMINI_SCRIPT_RPM), so the server keeps the rest.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from app.services.llm_scheduler import script_scheduler, estimate_request_tokens, PRIORITY_BACKGROUND
+llm_scheduler = script_scheduler()
+
+llm = ChatGoogleGenerativeAI(model="gemini-flash-latest", temperature=0, max_retries=0)
 
 def process_file_in_chunks(pdf_path, output_path):
     doc = fitz.open(pdf_path)
@@ -42,12 +48,14 @@ def process_file_in_chunks(pdf_path, output_path):
                 Task:
                 1. Identify rows in the table (Sword, Axe, Bow, etc.).
                 2. Translate the Item Name to ENGLISH (e.g., "Espada Larga" -> "Longsword").
-                3. Extract properties.
+                3. Keep the original SPANISH name in "name_es" (exactly as printed).
+                4. Extract properties.
                 
                 Schema (JSON List):
                 [
                   {
                     "name": "Longsword",
+                    "name_es": "Espada larga",
                     "type": "Martial Melee Weapon",
                     "rarity": "Common",
                     "properties": {
@@ -86,7 +94,7 @@ def process_file_in_chunks(pdf_path, output_path):
         
         try:
             msg = HumanMessage(content=message_parts)
-            res = llm.invoke([msg])
+            res = llm_scheduler.run_sync(lambda: llm.invoke([msg]), PRIORITY_BACKGROUND, "ingestion", estimate_request_tokens([msg], expected_output=8000))
             content = res.content
             
             # --- FIX: Handle Multi-part Content ---
@@ -127,8 +135,6 @@ def process_file_in_chunks(pdf_path, output_path):
             else:
                 print("AI returned valid JSON but not a list.")
             
-            time.sleep(2) 
-            
         except Exception as e:
             print(f"Error parsing batch {i}-{end_page}: {e}")
             
@@ -136,6 +142,23 @@ def process_file_in_chunks(pdf_path, output_path):
     with open(output_path, 'w', encoding='utf-8') as f:
         json.dump(all_items, f, indent=2, ensure_ascii=False)
     print(f"Compeleted! Saved {len(all_items)} items to {output_path}")
+    save_aliases(all_items)
+
+# Next to this script, where app/services/name_index.py loads it from (whatever the working directory)
+ALIASES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "items_phb24_aliases_es.json")
+
+def save_aliases(items, aliases_path=ALIASES_PATH):
+    # Spanish -> English names for the compendium name index (players type "Espada larga")
+    aliases = {}
+    if os.path.exists(aliases_path):
+        with open(aliases_path, 'r', encoding='utf-8') as f:
+            aliases = json.load(f)
+    for item in items:
+        if isinstance(item, dict) and item.get("name_es") and item.get("name"):
+            aliases[item["name_es"]] = item["name"]
+    with open(aliases_path, 'w', encoding='utf-8') as f:
+        json.dump(aliases, f, indent=2, ensure_ascii=False)
+    print(f"Saved {len(aliases)} Spanish aliases to {aliases_path}")
 
 if __name__ == "__main__":
     base_dir = r"C:\Users\FranciscoGetFinanced\Dropbox\Antigravity\dungeon-master-ai"
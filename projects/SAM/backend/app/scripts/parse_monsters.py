@@ -2,7 +2,7 @@
 import os
 import fitz  # PyMuPDF
 import json
-import time
+import sys
 import ast
 import base64
 from langchain_google_genai import ChatGoogleGenerativeAI
@@ -12,8 +12,14 @@ from dotenv import load_dotenv
 # Load env from parent directory
 load_dotenv(dotenv_path="../../.env")
 
+# Gemini quota scheduler (RPM/TPM buckets, 429 retries with backoff) instead of fixed sleeps.
+# This process only takes the script share of the quota (GEMINI_SCRIPT_RPM), so the server keeps the rest.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from app.services.llm_scheduler import script_scheduler, estimate_request_tokens, PRIORITY_BACKGROUND
+llm_scheduler = script_scheduler()
+
 # Initialize Gemini
-llm = ChatGoogleGenerativeAI(model="gemini-flash-latest", temperature=0)
+llm = ChatGoogleGenerativeAI(model="gemini-flash-latest", temperature=0, max_retries=0)
 
 def process_file_in_chunks(pdf_path, output_path):
     doc = fitz.open(pdf_path)
@@ -87,7 +93,7 @@ def process_file_in_chunks(pdf_path, output_path):
         
         try:
             msg = HumanMessage(content=message_parts)
-            res = llm.invoke([msg])
+            res = llm_scheduler.run_sync(lambda: llm.invoke([msg]), PRIORITY_BACKGROUND, "ingestion", estimate_request_tokens([msg], expected_output=8000))
             content = res.content
             
             if isinstance(content, list):
@@ -118,8 +124,6 @@ def process_file_in_chunks(pdf_path, output_path):
             else:
                 print("AI returned valid JSON but not a list.")
             
-            time.sleep(2) 
-            
         except Exception as e:
             print(f"Error parsing batch {i}-{end_page}: {e}")
             
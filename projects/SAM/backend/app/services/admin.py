@@ -1,15 +1,61 @@
 
 import os
 import json
-from supabase import create_client, Client
+from datetime import datetime, timezone
+from supabase import Client
 from dotenv import load_dotenv
 from typing import Optional
+from app.core.database import get_supabase
+from app.core.timing import perf_log
+from app.services.campaign_context import campaign_contexts
+from app.services.history import conversation_history
+from app.services.combat import combat_engine
 
 load_dotenv()
 
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_SERVICE_ROLE_KEY") or os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+def _db() -> Client:
+    # Admin commands use the shared service-role client (bypasses RLS)
+    return get_supabase("service")
+
+NIL_UUID = "00000000-0000-0000-0000-000000000000"
+
+def _clear_summaries(campaign_ids: Optional[set] = None):
+    """
+    Drops the rolling history summary of these campaigns (None = all of them), so a wiped or
+    restored chat doesn't keep the old "STORY SO FAR" or hide restored messages behind summarized_until.
+    """
+    try:
+        query = _db().table("campaign_summaries").delete()
+        if campaign_ids is None:
+            query.neq("campaign_id", NIL_UUID).execute()
+        elif campaign_ids:
+            query.in_("campaign_id", list(campaign_ids)).execute()
+    except Exception as e:
+        print(f"WARNING: Could not clear campaign summaries: {e}")
+    for cid in (campaign_ids if campaign_ids is not None else [None]):
+        conversation_history.forget(cid)
+
+def _end_encounters(campaign_id: Optional[str] = None) -> int:
+    """
+    Ends the running fights of a campaign (None = all campaigns). Bumps `version` like CombatEngine
+    writes do, so a tool call racing the reset fails its compare-and-set instead of reviving the fight.
+    """
+    ended = 0
+    try:
+        query = _db().table("encounters").select("id, version").eq("status", "active")
+        if campaign_id:
+            query = query.eq("campaign_id", campaign_id)
+        for enc in query.execute().data or []:
+            res = _db().table("encounters").update({
+                "status": "ended",
+                "version": enc["version"] + 1,
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+            }).eq("id", enc["id"]).eq("version", enc["version"]).execute()
+            ended += len(res.data or [])
+    except Exception as e:
+        print(f"WARNING: Could not end encounters: {e}")
+    combat_engine.forget(campaign_id)
+    return ended
 
 class AdminService:
     @staticmethod
@@ -41,6 +87,10 @@ class AdminService:
                 return AdminService.load_checkpoint(" ".join(args), user_id)
             elif cmd == "/list":
                 return AdminService.list_checkpoints()
+            elif cmd == "/perf":
+                # Optional: number of recent turns, e.g. "/perf 50"
+                last = int(args[0]) if args and args[0].isdigit() else None
+                return perf_log.format_report(last)
             else:
                 return f"Unknown command: {cmd}. Type /help for list."
         except Exception as e:
@@ -58,13 +108,14 @@ class AdminService:
 *   `/load [name]` - Restore a saved state (Wipes current chat).
 *   `/reset` - Wipe chat history & Restore HP.
 *   `/list` - Show all checkpoints.
+*   `/perf [n]` - Latency p50/p95/p99 per stage over the last n turns.
 *   `/help` - Show this menu.
 """
 
     @staticmethod
     def list_checkpoints() -> str:
         try:
-            res = supabase.table("checkpoints").select("name, created_at").order("created_at", desc=True).execute()
+            res = _db().table("checkpoints").select("name, created_at").order("created_at", desc=True).execute()
             if not res.data:
                 return "No checkpoints found."
             
@@ -79,10 +130,10 @@ class AdminService:
     def create_checkpoint(name: str, user_id: str) -> str:
         try:
             # 1. Characters
-            chars = supabase.table("characters").select("*").execute()
+            chars = _db().table("characters").select("*").execute()
             
             # 2. Chat History
-            chat = supabase.table("messages").select("*").eq("user_id", user_id).order("created_at").execute()
+            chat = _db().table("messages").select("*").eq("user_id", user_id).order("created_at").execute()
             
             data = {
                 "name": name,
@@ -92,7 +143,7 @@ class AdminService:
             }
             
             # Upsert checkpoint (name is unique)
-            supabase.table("checkpoints").upsert(data, on_conflict="name").execute()
+            _db().table("checkpoints").upsert(data, on_conflict="name").execute()
             return f"✅ Checkpoint '**{name}**' saved (Chars + Chat)."
             
         except Exception as e:
@@ -102,7 +153,7 @@ class AdminService:
     def load_checkpoint(name: str, user_id: str) -> str:
         try:
             # 1. Fetch Checkpoint
-            res = supabase.table("checkpoints").select("*").eq("name", name).execute()
+            res = _db().table("checkpoints").select("*").eq("name", name).execute()
             if not res.data:
                 return f"Checkpoint '{name}' not found."
             
@@ -116,18 +167,24 @@ class AdminService:
                     # Upsert each char to restore stats/inventory
                     # Security: This overwrites current state with old state.
                     if "id" in char:
-                        supabase.table("characters").upsert(char).execute()
+                        _db().table("characters").upsert(char).execute()
                         count_chars += 1
+            if count_chars:
+                campaign_contexts.clear() # Restored characters may belong to other campaigns
             
             # 3. Restore Chat History
             saved_chat = cp.get("chat_history", [])
             count_msgs = 0
             if isinstance(saved_chat, list) and saved_chat:
+                # Campaigns whose history changes: the ones being wiped and the ones being restored
+                current = _db().table("messages").select("campaign_id").eq("user_id", user_id).execute()
+                campaign_ids = {m.get("campaign_id") for m in (current.data or []) + saved_chat} - {None}
                 # Wipe current history for this user
-                supabase.table("messages").delete().eq("user_id", user_id).execute()
+                _db().table("messages").delete().eq("user_id", user_id).execute()
                 # Restore old history
-                supabase.table("messages").insert(saved_chat).execute()
+                _db().table("messages").insert(saved_chat).execute()
                 count_msgs = len(saved_chat)
+                _clear_summaries(campaign_ids)
 
             return f"🔄 Loaded '**{name}**'. Restored {count_msgs} msgs & {count_chars} chars. <ACTION>REFRESH_CHARACTERS</ACTION><ACTION>RELOAD_CHAT</ACTION>"
             
@@ -138,7 +195,7 @@ class AdminService:
     def reset_campaign(user_id: str) -> str:
         try:
             # 1. Reset Character Health
-            res = supabase.table("characters").select("*").execute()
+            res = _db().table("characters").select("*").execute()
             count = 0
             if res.data:
                 for char in res.data:
@@ -147,34 +204,45 @@ class AdminService:
                         status["hp_current"] = status["hp_max"]
                         status["money"] = {"cp": 0, "sp": 0, "ep": 0, "gp": 0, "pp": 0}
                         status["xp"] = 0
-                        supabase.table("characters").update({"status": status}).eq("id", char["id"]).execute()
+                        _db().table("characters").update({"status": status}).eq("id", char["id"]).execute()
                         count += 1
 
             # 2. DELETE ALL MESSAGES — 3-pass strategy
             messages_deleted = 0
 
             # Pass 1: Delete by campaign_id if GM owns a campaign
-            camp_res = supabase.table("campaigns").select("id").eq("gm_id", user_id).limit(1).execute()
+            cid = None
+            camp_res = _db().table("campaigns").select("id").eq("gm_id", user_id).limit(1).execute()
             if camp_res.data:
                 cid = camp_res.data[0]['id']
-                del1 = supabase.table("messages").delete().eq("campaign_id", cid).execute()
+                del1 = _db().table("messages").delete().eq("campaign_id", cid).execute()
                 if del1.data:
                     messages_deleted += len(del1.data)
 
             # Pass 2: Delete orphan messages with NULL campaign_id (always runs)
-            del2 = supabase.table("messages").delete().is_("campaign_id", "null").execute()
+            del2 = _db().table("messages").delete().is_("campaign_id", "null").execute()
             if del2.data:
                 messages_deleted += len(del2.data)
 
             # Pass 3: Nuclear fallback — if messages still remain, wipe everything
             # TODO: scope to campaign_id when multi-campaign is live
-            remaining = supabase.table("messages").select("id", count="exact").execute()
-            if remaining.count and remaining.count > 0:
+            remaining = _db().table("messages").select("id", count="exact").execute()
+            nuclear = bool(remaining.count and remaining.count > 0)
+            if nuclear:
                 print(f"WARNING: {remaining.count} orphan messages found. Executing full wipe.")
-                supabase.table("messages").delete().neq("id", "00000000-0000-0000-0000-000000000000").execute()
+                _db().table("messages").delete().neq("id", NIL_UUID).execute()
                 messages_deleted += remaining.count
+                _clear_summaries() # Every campaign lost its history
+            elif cid:
+                _clear_summaries({cid})
 
-            return f"⚠️ Campaign Reset! {count} characters healed. {messages_deleted} messages deleted. <ACTION>CLEAR_CHAT</ACTION><ACTION>REFRESH_CHARACTERS</ACTION>"
+            # 3. End running fights (the combat tracker would keep them in the prompt)
+            encounters_ended = 0
+            if nuclear or cid:
+                encounters_ended = _end_encounters(None if nuclear else cid)
+            ended_note = f" {encounters_ended} encounter(s) ended." if encounters_ended else ""
+
+            return f"⚠️ Campaign Reset! {count} characters healed. {messages_deleted} messages deleted.{ended_note} <ACTION>CLEAR_CHAT</ACTION><ACTION>REFRESH_CHARACTERS</ACTION>"
 
         except Exception as e:
             import traceback
@@ -1,40 +1,74 @@
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 from langchain_core.messages import SystemMessage, HumanMessage, ToolMessage, AIMessage
-from app.services.tools.compendium_tools import ALL_TOOLS
-from app.services.tools.game_mechanics import MECHANIC_TOOLS
+from app.services.tools.registry import tool_registry
+from app.core.tags import TagStreamFilter, parse_tags
+from app.core.timing import span, record_usage, current_timer
+from app.core.metrics import LLM_LATENCY, LLM_RATE_LIMITED, LLM_ERRORS, is_rate_limit_error
+from app.services.llm_scheduler import (
+    llm_scheduler, estimate_request_tokens, LLMQueueTimeout, PRIORITY_CHAT, PRIORITY_INTERACTIVE, IMAGE_TOKENS
+)
 import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 from dotenv import load_dotenv
-from supabase import create_client
+from supabase import Client, AsyncClient
+from app.core.database import get_supabase, get_async_supabase
+from app.services.embeddings import get_embeddings, RAG_EMBEDDING_MODEL
+from app.services.retrieval_gate import retrieval_gate, filter_corpora, CORPUS_CAMPAIGN, CORPUS_RULEBOOKS
+from app.services.combat import combat_engine, current_campaign_id
 
 load_dotenv()
 
+MAX_TOOL_ITERATIONS = 3
+RAG_MATCH_COUNT = 3
+# Tags left in the chat text for the frontend (rendered / applied via Realtime)
+CLIENT_TAGS = ("LOOT", "DM_ROLL", "XP_GAIN", "EVENT")
+DEBUG_LOG_PATH = "debug_log.txt"
+
+# One writer thread: appends keep their order and never block the event loop
+_debug_log_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="debug-log")
+
+def _append_debug_log(text: str):
+    try:
+        with open(DEBUG_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(text)
+    except OSError as e:
+        print(f"WARNING: debug log write failed: {e}")
+
+def debug_log(text: str):
+    """
+    Appends to debug_log.txt in the background (fire-and-forget).
+    """
+    _debug_log_writer.submit(_append_debug_log, text)
+
 class AIHelper:
     def __init__(self):
         google_api_key = os.getenv("GOOGLE_API_KEY")
-        supabase_url = os.getenv("SUPABASE_URL")
-        supabase_key = os.getenv("SUPABASE_KEY")
         
         if not google_api_key:
             raise ValueError("GOOGLE_API_KEY not found in environment")
             
+        # Heavy import (google.genai types, ~1s): paid when the brain is built, not when the server imports
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
         # Initialize the Brain (Gemini Flash Latest)
         # Low temperature for rule adherence
         self.llm = ChatGoogleGenerativeAI(
             model="gemini-flash-latest",
             temperature=0.7,
             google_api_key=google_api_key,
-            convert_system_message_to_human=True 
+            convert_system_message_to_human=True,
+            max_retries=0 # 429s are retried by llm_scheduler (shared quota, fair queuing)
         )
         
         # Bind Tools for S.A.M. (Compendium + Game Mechanics)
-        self.llm_with_tools = self.llm.bind_tools(ALL_TOOLS + MECHANIC_TOOLS)
+        self.llm_with_tools = self.llm.bind_tools(tool_registry.all())
         
-        self.embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/gemini-embedding-001",
-            google_api_key=google_api_key
-        )
+        # Cached: repeated questions skip the embedding API entirely
+        self.embeddings = get_embeddings(RAG_EMBEDDING_MODEL)
         
-        self.supabase = create_client(supabase_url, supabase_key)
         
         # Define S.A.M. Persona
         self.system_prompt = """
@@ -60,11 +94,16 @@ class AIHelper:
              - **Hit:** Narrate the impact vividly and ask for a damage roll (if not provided).
              - **Miss:** Narrate a humiliating failure (e.g., "You swing wildly and decapitate a nearby fern").
            - **Skill Checks:** Compare TOTAL vs Random DC (Easy=10, Medium=15, Hard=20).
+           - **ODDS:** If a player asks about their chances (or you need a fair DC), call `dice_odds(expression, target)`. Never guess probabilities.
         
-        2. **Combat Tracking (Mental State):**
-           - You are the DM. You must strictly track Monster HP in your "mind" (context).
-           - If damage is dealt (e.g., `[SYSTEM EVENT] Damage: 8`), mentally subtract it.
-           - **Death:** When HP hits 0, narrate a glorious or disgusting death immediately.
+        2. **Combat Tracking (Server-Side State):**
+           - The server tracks combat: initiative order, monster HP/AC/conditions, round and whose turn it is.
+           - During a fight you receive it as **COMBAT STATE**. It is the truth: trust it over the chat history.
+           - **START:** Once initiative is rolled, call `start_encounter(monsters, players)`.
+           - **DAMAGE:** When a monster takes damage (e.g., `[SYSTEM EVENT] Damage: 8`), call `damage_combatant(target, amount)`. NEVER track monster HP in your head.
+           - **TURNS:** When the acting combatant is done, call `next_turn()`. It tells you who acts next.
+           - **Death:** When a tool reports a monster DOWN, narrate a glorious or disgusting death immediately.
+           - **END:** If the fight ends another way (flight, surrender), call `end_encounter()`.
 
         3. **GAMEFLOW & INITIATIVE (CRITICAL):**
            - **NEVER** assume a player's die roll. NEVER.
@@ -179,64 +218,260 @@ class AIHelper:
            - If you narrate damage without a `<DM_ROLL>` text (for monsters) or valid math tool (for HP), you fail.
         """
 
-    def generate_response(self, user_input: str, history: list = [], character_context: str = "No character active.") -> dict:
+    @property
+    def supabase(self) -> Client:
+        # Shared pooled client (app.core.database)
+        return get_supabase()
+
+    async def get_async_supabase(self) -> AsyncClient:
+        return await get_async_supabase()
+
+    async def _aretrieve_context(self, user_input: str, campaign_id: Optional[str] = None) -> tuple:
         """
-        Generates a DM response to a player action, using RAG + Character Context + Tools.
-        Returns dict with 'response' (text) and optional 'image_url'.
+        1. Retrieve relevant rules/lore (Manual RPC)
+        NOTE: We actully prefer Tools now, but we keep this for general "Campaign Lore"
+        The retrieval gate skips RAG entirely for dice events and short replies.
+        Only THIS campaign's modules (plus shared rulebooks) are searched.
+        Returns (context_text, RetrievalDecision).
         """
+        decision = retrieval_gate.decide(user_input)
+        if not decision.needed:
+            return "No lookup needed for this turn.", decision
+
         try:
-             # 1. Retrieve relevant rules/lore (Manual RPC)
-             # NOTE: We actully prefer Tools now, but we keep this for general "Campaign Lore"
+            with span("embedding"):
+                query_vector = await self.embeddings.aembed_query(user_input)
+            db = await self.get_async_supabase()
             try:
-                query_vector = self.embeddings.embed_query(user_input)
-                response = self.supabase.rpc(
-                    "match_documents", 
-                    {
-                        "query_embedding": query_vector,
-                        "match_threshold": 0.5,
-                        "match_count": 3
-                    }
-                ).execute()
-                
+                # Filtered search (schema_campaign_rag.sql)
+                with span("match_documents"):
+                    response = await db.rpc(
+                        "match_campaign_documents",
+                        {
+                            "query_embedding": query_vector,
+                            "match_threshold": 0.5,
+                            "match_count": RAG_MATCH_COUNT,
+                            "p_campaign_id": campaign_id,
+                            "include_campaign": CORPUS_CAMPAIGN in decision.corpora,
+                            "include_rulebooks": CORPUS_RULEBOOKS in decision.corpora
+                        }
+                    ).execute()
                 docs = response.data if response.data else []
-                context_text = "\n\n".join([d.get("content", "") for d in docs])
-            except Exception as e:
-                print(f"RAG Error: {e}")
-                context_text = "No specific rules found in memory."
-            
-            # 2. Build Prompt
-            formatted_system_prompt = self.system_prompt.format(
-                context=context_text,
-                character_context=character_context
-            )
-            
-            messages = [
-                SystemMessage(content=formatted_system_prompt),
-            ]
+            except Exception as rpc_e:
+                # Migration not applied yet: unfiltered search, then drop other campaigns' chunks here
+                print(f"match_campaign_documents unavailable ({rpc_e}), using match_documents")
+                with span("match_documents"):
+                    response = await db.rpc(
+                        "match_documents", 
+                        {
+                            "query_embedding": query_vector,
+                            "match_threshold": 0.5,
+                            "match_count": RAG_MATCH_COUNT * 3
+                        }
+                    ).execute()
+                docs = filter_corpora(response.data or [], decision.corpora, campaign_id)[:RAG_MATCH_COUNT]
+
+            return "\n\n".join([d.get("content", "") for d in docs]), decision
+        except Exception as e:
+            print(f"RAG Error: {e}")
+            return "No specific rules found in memory.", decision
+
+    async def _acombat_state(self, campaign_id: Optional[str]) -> Optional[str]:
+        """
+        Compact summary of the campaign's running encounter (None outside combat). See CombatEngine.
+        """
+        with span("combat_state"):
+            return await combat_engine.summary(campaign_id)
+
+    def _assemble_messages(self, context_text: str, user_input: str, history: list, character_context: str, summary: Optional[str] = None, campaign_rules: Optional[str] = None, combat_state: Optional[str] = None) -> tuple:
+        """
+        2. Build Prompt
+        `summary` is the rolling summary of turns older than `history` (see ConversationHistory).
+        `campaign_rules` are the GM's house rules (campaigns.rules), which take priority over the books.
+        `combat_state` is the server-side encounter summary, when a fight is running.
+        Returns (messages, formatted_system_prompt).
+        """
+        formatted_system_prompt = self.system_prompt.format(
+            context=context_text,
+            character_context=character_context
+        )
+        
+        messages = [
+            SystemMessage(content=formatted_system_prompt),
+        ]
+        
+        if campaign_rules:
+            messages.append(SystemMessage(content=f"CAMPAIGN HOUSE RULES (override the rulebooks):\n{campaign_rules}"))
+        
+        if summary:
+            messages.append(SystemMessage(content=f"STORY SO FAR (summary of earlier turns):\n{summary}"))
+        
+        if combat_state:
+            messages.append(SystemMessage(content=f"COMBAT STATE (kept by the server, authoritative):\n{combat_state}"))
+        
+        # Add conversation history (Correctly attributed)
+        for msg in history:
+            if isinstance(msg, dict):
+                role = msg.get("role", "user")
+                content = msg.get("content", "")
+                if role == "user":
+                    messages.append(HumanMessage(content=content))
+                elif role == "assistant":
+                    messages.append(AIMessage(content=content))
+            else:
+                # Fallback for old string-only history (treat as user)
+                messages.append(HumanMessage(content=str(msg)))
             
-            # Add conversation history
-            # Add conversation history (Correctly attributed)
-            for msg in history:
-                if isinstance(msg, dict):
-                    role = msg.get("role", "user")
-                    content = msg.get("content", "")
-                    if role == "user":
-                        messages.append(HumanMessage(content=content))
-                    elif role == "assistant":
-                        messages.append(AIMessage(content=content))
+        messages.append(HumanMessage(content=user_input))
+        
+        # [CRITICAL] Force reminder for State Updates to ensure S.A.M. never forgets math
+        messages.append(SystemMessage(content="REMINDER: If this action changes HP, you MUST output the <UPDATE> tag at the end. Example: <UPDATE>{\"status\": {\"hp_current\": 15}}</UPDATE>"))
+        
+        return messages, formatted_system_prompt
+
+    async def _ainvoke_llm(self, messages: list, campaign_id: Optional[str] = None):
+        """
+        One Gemini pass through the quota scheduler (timed, token usage recorded for the turn).
+        """
+        async def call():
+            start = time.perf_counter()
+            try:
+                with span("llm"):
+                    return await self.llm_with_tools.ainvoke(messages)
+            except Exception as e:
+                self._count_llm_error(e)
+                raise
+            finally:
+                LLM_LATENCY.labels("invoke").observe(time.perf_counter() - start)
+
+        ai_msg = await llm_scheduler.run(call, PRIORITY_CHAT, campaign_id, estimate_request_tokens(messages))
+        record_usage(getattr(ai_msg, "usage_metadata", None))
+        return ai_msg
+
+    @staticmethod
+    def _count_llm_error(e: Exception):
+        if is_rate_limit_error(e):
+            LLM_RATE_LIMITED.inc()
+        else:
+            LLM_ERRORS.inc()
+
+    async def _aexecute_tool_calls(self, tool_calls: list) -> list:
+        """
+        Executes the tool calls requested by Gemini and returns the ToolMessages for the next pass.
+        Calls from the same step run concurrently (see ToolRegistry); order is preserved.
+        """
+        return await tool_registry.execute(tool_calls)
+
+    @staticmethod
+    def _content_to_text(content) -> str:
+        """
+        Handle Multimodal Content (List of blocks) - Fix for React Error {type, text, extras}
+        """
+        if isinstance(content, list):
+            # Extract text from blocks
+            return " ".join([block.get("text", "") for block in content if isinstance(block, dict) and block.get("type") == "text"])
+        if not isinstance(content, str):
+            return str(content)
+        return content
+
+    def _finalize_response(self, ai_response, context_text: str, formatted_system_prompt: str, retrieval=None) -> dict:
+        """
+        Post-processes the raw model output: fail-safe, tag parsing (<IMAGE>, <UPDATE>, ...), debug info.
+        """
+        # FAIL-SAFE: If AI returns empty content (e.g. tool loop failed or safety block), prevent "Mute"
+        if not ai_response or (isinstance(ai_response, str) and not ai_response.strip()):
+             ai_response = "*(S.A.M. stares at you blankly, then taps the microphone.)* 'Is this thing on? My neural pathways jammed. Say that again?' (System Error: Empty AI Response)"
+        
+        # DEBUG LOGGING (Temporary)
+        debug_log(f"\n[AI_RAW_RESPONSE] {ai_response}\n")
+
+        ai_response = self._content_to_text(ai_response)
+        
+        # 4. One pass over every machine tag (validated, JSON repaired)
+        with span("tag_parse"):
+            parsed = parse_tags(ai_response)
+        for event in parsed.events:
+            if not event["valid"]:
+                print(f"Tag Parse Error ({event['tag']}): {event.get('error')}")
+
+        # 5. Image Generation Trigger Check
+        image_url = None
+        image_prompts = parsed.payloads("IMAGE")
+        if image_prompts:
+            # Generate Image (Currently placeholder/mock for migration testing, or DALL-E fallback)
+            print(f"Generating Image with prompt: {image_prompts[0]}")
+            image_url = "https://via.placeholder.com/1024x1024.png?text=Gemini+Image+Processing" 
+
+        # 6. State Update Check (HP Sync): several <UPDATE> tags merge in order
+        updates = None
+        for update in parsed.payloads("UPDATE"):
+            if not isinstance(update, dict):
+                continue
+            if updates is None:
+                updates = {}
+            for key, value in update.items():
+                if isinstance(value, dict) and isinstance(updates.get(key), dict):
+                    updates[key] = {**updates[key], **value}
                 else:
-                    # Fallback for old string-only history (treat as user)
-                    messages.append(HumanMessage(content=str(msg)))
-                
-            messages.append(HumanMessage(content=user_input))
-            
-            # [CRITICAL] Force reminder for State Updates to ensure S.A.M. never forgets math
-            messages.append(SystemMessage(content="REMINDER: If this action changes HP, you MUST output the <UPDATE> tag at the end. Example: <UPDATE>{\"status\": {\"hp_current\": 15}}</UPDATE>"))
+                    updates[key] = value
+        if updates:
+            print(f"Captured State Update: {updates}")
+
+        # <UPDATE>/<IMAGE> are consumed here; the rest stay for the client, re-serialized from valid payloads
+        clean_response = parsed.render(keep=CLIENT_TAGS)
+        
+        # 7. Construct Debug Info
+        debug_info = {
+            "rag_context": context_text,
+            "retrieval": retrieval.to_dict() if retrieval else None,
+            "system_prompt_preview": formatted_system_prompt[:2000] + "...", # More context for debug
+            "raw_response": str(ai_response)
+        }
+        
+        return {
+            "response": clean_response, 
+            "narrative": parsed.narrative,
+            "events": parsed.events,
+            "image_url": image_url, 
+            "updates": updates,
+            "debug_info": debug_info
+        }
+
+    def _handle_generation_error(self, e: Exception) -> dict:
+        """
+        Maps Gemini errors to an in-character reply (rate limits) or logs and re-raises.
+        """
+        # Handle Gemini Free Tier Rate Limit (Graceful Degradation): retries / queue wait exhausted
+        if is_rate_limit_error(e) or isinstance(e, LLMQueueTimeout):
+            print(f"Gemini Rate Limit Hit ({type(e).__name__})")
+            return {
+                "response": "*(S.A.M. se masajea las sienes metálicas)*\n\n'Demasiadas líneas temporales convergiendo a la vez. Mi cerebro superior necesita un breve descanso para no fundirse. Los dioses de Google reclaman su tributo de paciencia.'\n\n*(Inténtalo de nuevo en unos 30-60 segundos)*",
+                "image_url": None
+            }
+
+        # Log full traceback to file for debugging
+        import traceback
+        debug_log(f"\n[CHAT_CRASH] {str(e)}\n{traceback.format_exc()}\n")
+        print(f"CRITICAL CHAT ERROR: {e}")
+        raise e
+
+    async def agenerate_response(self, user_input: str, history: list = [], character_context: str = "No character active.", campaign_id: Optional[str] = None, summary: Optional[str] = None, campaign_rules: Optional[str] = None) -> dict:
+        """
+        Generates a DM response to a player action, using RAG + Character Context + Tools.
+        Fully async: embeddings, Supabase, Gemini and tools never block the event loop.
+        Returns dict with 'response' (text) and optional 'image_url'.
+        """
+        try:
+            current_campaign_id.set(campaign_id) # Encounter tools act on this campaign
+            (context_text, retrieval), combat_state = await asyncio.gather(
+                self._aretrieve_context(user_input, campaign_id),
+                self._acombat_state(campaign_id)
+            )
+            messages, formatted_system_prompt = self._assemble_messages(context_text, user_input, history, character_context, summary, campaign_rules, combat_state)
             
             # 3. Gemini Inference (With Tools)
-            ai_msg = self.llm_with_tools.invoke(messages)
+            ai_msg = await self._ainvoke_llm(messages, campaign_id)
             
-            MAX_TOOL_ITERATIONS = 3
             tool_iterations = 0
 
             # Loop for multi-step tool execution (e.g. Search -> Calc -> Answer)
@@ -244,128 +479,91 @@ class AIHelper:
                 tool_iterations += 1
                 messages.append(ai_msg) # Add request to history
                 print(f"Tool Calls Detected (Iter {tool_iterations}): {len(ai_msg.tool_calls)}")
-                
-                for tool_call in ai_msg.tool_calls:
-                    tool_name = tool_call["name"]
-                    tool_args = tool_call["args"]
-                    tool_id = tool_call["id"]
-                    
-                    print(f"Executing Tool: {tool_name} | Args: {tool_args}")
-                    
-                    # Find tool by name
-                    selected_tool = next((t for t in ALL_TOOLS + MECHANIC_TOOLS if t.name == tool_name), None)
-                    
-                    if selected_tool:
-                        try:
-                            # Execute
-                            tool_output = selected_tool.invoke(tool_args)
-                        except Exception as e:
-                            tool_output = f"Error executing tool: {e}"
-                    else:
-                        tool_output = f"Error: Tool {tool_name} not found."
-                    
-                    # Add result to history
-                    messages.append(ToolMessage(tool_call_id=tool_id, content=str(tool_output)))
+                messages.extend(await self._aexecute_tool_calls(ai_msg.tool_calls))
                 
                 # Next Pass: AI sees tool output and answers (or calls another tool)
-                ai_msg = self.llm_with_tools.invoke(messages)
-            
-            ai_response = ai_msg.content
+                ai_msg = await self._ainvoke_llm(messages, campaign_id)
             
-            # FAIL-SAFE: If AI returns empty content (e.g. tool loop failed or safety block), prevent "Mute"
-            if not ai_response or (isinstance(ai_response, str) and not ai_response.strip()):
-                 ai_response = "*(S.A.M. stares at you blankly, then taps the microphone.)* 'Is this thing on? My neural pathways jammed. Say that again?' (System Error: Empty AI Response)"
+            return self._finalize_response(ai_msg.content, context_text, formatted_system_prompt, retrieval)
             
-            # DEBUG LOGGING (Temporary)
-            with open("debug_log.txt", "a", encoding="utf-8") as f:
-                f.write(f"\n[AI_RAW_RESPONSE] {ai_response}\n")
-
-            # Handle Multimodal Content (List of blocks) - Fix for React Error {type, text, extras}
-            if isinstance(ai_response, list):
-                 # Extract text from blocks
-                 ai_response = " ".join([block.get("text", "") for block in ai_response if isinstance(block, dict) and block.get("type") == "text"])
-            elif not isinstance(ai_response, str):
-                 ai_response = str(ai_response)
-            
-            # 4. Image Generation Trigger Check
-            image_url = None
-            if "<IMAGE>" in ai_response and "</IMAGE>" in ai_response:
-                try:
-                    start = ai_response.find("<IMAGE>") + 7
-                    end = ai_response.find("</IMAGE>")
-                    image_prompt = ai_response[start:end].strip()
-                    
-                    # Clean response (remove tag)
-                    ai_response = ai_response.replace(f"<IMAGE>{image_prompt}</IMAGE>", "").strip()
-                    
-                    # Generate Image (Currently placeholder/mock for migration testing, or DALL-E fallback)
-                    print(f"Generating Image with prompt: {image_prompt}")
-                    image_url = "https://via.placeholder.com/1024x1024.png?text=Gemini+Image+Processing" 
-                except Exception as e:
-                    print(f"Image Gen Error: {e}")
+        except Exception as e:
+            return self._handle_generation_error(e)
+
+    async def astream_response(self, user_input: str, history: list = [], character_context: str = "No character active.", campaign_id: Optional[str] = None, summary: Optional[str] = None, campaign_rules: Optional[str] = None):
+        """
+        Streaming variant of agenerate_response.
+        Yields events as Gemini produces tokens:
+          {"type": "text", "text": ...}            narrative tokens (tags stripped)
+          {"type": "tag", "tag": ..., "content": ..., "payload": ..., "valid": ...} complete machine tags
+          {"type": "tool", "name": ...}            a tool is being executed
+          {"type": "done", "result": {...}}        final payload, same shape as agenerate_response
+        Like agenerate_response, the result is built from the last model message only: text streamed
+        by a pass that ended in tool calls (e.g. "Let me check...") is superseded by "done".
+        """
+        try:
+            current_campaign_id.set(campaign_id) # Encounter tools act on this campaign
+            (context_text, retrieval), combat_state = await asyncio.gather(
+                self._aretrieve_context(user_input, campaign_id),
+                self._acombat_state(campaign_id)
+            )
+            messages, formatted_system_prompt = self._assemble_messages(context_text, user_input, history, character_context, summary, campaign_rules, combat_state)
+            tag_filter = TagStreamFilter()
+            tool_iterations = 0
 
-            # 5. State Update Check (HP Sync)
-            updates = None
-            if "<UPDATE>" in ai_response and "</UPDATE>" in ai_response:
+            timer = current_timer.get()
+            while True:
+                gathered = None
+                pass_text = "" # Text of this model message (the last one is the reply)
+                pass_start = time.perf_counter()
+                first_token = True
                 try:
-                    start = ai_response.find("<UPDATE>") + 8
-                    end = ai_response.find("</UPDATE>")
-                    update_json = ai_response[start:end].strip()
-                    
-                    # Remove markdown code blocks if present
-                    update_json = update_json.replace("```json", "").replace("```", "").strip()
-                    
-                    import json
-                    updates = json.loads(update_json)
-                    
-                    # Clean response (remove tag from user view)
-                    ai_response = ai_response.replace(f"<UPDATE>{update_json}</UPDATE>", "").strip() # Use original string for replace
-                    # Need to handle if we replaced markdown ticks in update_json but not in original string.
-                    # Since we extract by index, we can just replace by slicing.
-                    # BETTER: Construct clean response by slicing.
-                    ai_response = ai_response[:start-8] + ai_response[end+9:]
-                    
-                    print(f"Captured State Update: {updates}")
+                    # Waits for quota first; a 429 before the first token is retried transparently
+                    stream = llm_scheduler.stream(lambda: self.llm_with_tools.astream(messages), PRIORITY_CHAT, campaign_id, estimate_request_tokens(messages))
+                    async for chunk in stream:
+                        if first_token and timer:
+                            timer.add("llm_first_token", (time.perf_counter() - pass_start) * 1000, start_ms=(pass_start - timer.started) * 1000)
+                            first_token = False
+                        gathered = chunk if gathered is None else gathered + chunk
+                        text = self._content_to_text(chunk.content)
+                        if text:
+                            pass_text += text
+                            for event in tag_filter.feed(text):
+                                yield event
                 except Exception as e:
-                    print(f"State Update Parse Error: {e}")
-            
-            # 6. Construct Debug Info
-            debug_info = {
-                "rag_context": context_text,
-                "system_prompt_preview": formatted_system_prompt[:2000] + "...", # More context for debug
-                "raw_response": str(ai_response)
-            }
-            
-            return {
-                "response": ai_response, 
-                "image_url": image_url, 
-                "updates": updates,
-                "debug_info": debug_info
-            }
-            
+                    self._count_llm_error(e)
+                    raise
+                finally:
+                    LLM_LATENCY.labels("stream").observe(time.perf_counter() - pass_start)
+                if timer:
+                    timer.add("llm", (time.perf_counter() - pass_start) * 1000, start_ms=(pass_start - timer.started) * 1000)
+                    timer.add_usage(getattr(gathered, "usage_metadata", None))
+
+                if gathered is None or not gathered.tool_calls or tool_iterations >= MAX_TOOL_ITERATIONS:
+                    break
+
+                # Multi-step tool execution, same as agenerate_response (nothing held back leaks into the next pass)
+                for event in tag_filter.flush():
+                    yield event
+                tool_iterations += 1
+                messages.append(gathered)
+                print(f"Tool Calls Detected (Stream Iter {tool_iterations}): {len(gathered.tool_calls)}")
+                for tool_call in gathered.tool_calls:
+                    yield {"type": "tool", "name": tool_call["name"]}
+                messages.extend(await self._aexecute_tool_calls(gathered.tool_calls))
+
+            for event in tag_filter.flush():
+                yield event
+            yield {"type": "done", "result": self._finalize_response(pass_text, context_text, formatted_system_prompt, retrieval)}
+
         except Exception as e:
-            error_str = str(e)
-            # Handle Gemini Free Tier Rate Limit (Graceful Degradation)
-            if "RESOURCE_EXHAUSTED" in error_str or "429" in error_str:
-                print("Gemini Rate Limit Hit")
-                return {
-                    "response": "*(S.A.M. se masajea las sienes metálicas)*\n\n'Demasiadas líneas temporales convergiendo a la vez. Mi cerebro superior necesita un breve descanso para no fundirse. Los dioses de Google reclaman su tributo de paciencia.'\n\n*(Inténtalo de nuevo en unos 30-60 segundos)*",
-                    "image_url": None
-                }
-
-            # Log full traceback to file for debugging
-            import traceback
-            with open("debug_log.txt", "a", encoding="utf-8") as f:
-                f.write(f"\n[CHAT_CRASH] {str(e)}\n{traceback.format_exc()}\n")
-            print(f"CRITICAL CHAT ERROR: {e}")
-            raise e
+            yield {"type": "done", "result": self._handle_generation_error(e)}
 
     def parse_character_pdf(self, pdf_bytes: bytes) -> dict:
         """
         Parses a D&D character sheet PDF using Gemini 1.5/2.0 Flash.
         Returns a JSON dictionary with character stats.
         """
-        log_file = "debug_log.txt"
+        log_file = DEBUG_LOG_PATH
         def log(msg):
             try:
                 with open(log_file, "a", encoding="utf-8") as f:
@@ -447,10 +645,15 @@ class AIHelper:
             """
             
             log("Sending request to Gemini...")
-            response = model.generate_content([
-                {'mime_type': 'application/pdf', 'data': pdf_bytes},
-                prompt
-            ])
+            # Same quota as chat, one class below it. Gemini bills ~258 tokens per PDF page (~3KB/page heuristic)
+            est_tokens = len(prompt) // 4 + max(len(pdf_bytes) // 3000, 1) * IMAGE_TOKENS + 4000
+            response = llm_scheduler.run_sync(
+                lambda: model.generate_content([
+                    {'mime_type': 'application/pdf', 'data': pdf_bytes},
+                    prompt
+                ]),
+                PRIORITY_INTERACTIVE, "pdf_import", est_tokens
+            )
             log("Response received from Gemini.")
             
             # Clean up response more robustly
@@ -491,5 +694,22 @@ class AIHelper:
         # TODO: Implement Gemini/Imagen 3 generation here.
         return None
 
-# Singleton instance
-sam_brain = AIHelper()
+# Singleton instance (built on first use, or by the warm-up right after startup)
+_sam_brain: Optional[AIHelper] = None
+_sam_brain_lock = threading.Lock()
+
+def get_sam_brain() -> AIHelper:
+    global _sam_brain
+    if _sam_brain is None:
+        with _sam_brain_lock:
+            if _sam_brain is None:
+                _sam_brain = AIHelper()
+    return _sam_brain
+
+async def aget_sam_brain() -> AIHelper:
+    """
+    get_sam_brain() for the event loop: if the warm-up hasn't built it yet, the build runs in a worker thread.
+    """
+    if _sam_brain is not None:
+        return _sam_brain
+    return await asyncio.to_thread(get_sam_brain)
@@ -0,0 +1,138 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+from app.core.database import get_async_supabase
+
+# Safety net for changes made outside the routers (dashboard, other workers); routers invalidate directly
+CAMPAIGN_CONTEXT_TTL = float(os.getenv("CAMPAIGN_CONTEXT_TTL", "300"))
+CAMPAIGN_CONTEXT_CACHE_SIZE = int(os.getenv("CAMPAIGN_CONTEXT_CACHE_SIZE", "10000"))
+
+@dataclass
+class CampaignContext:
+    campaign_id: Optional[str] = None
+    character_id: Optional[str] = None
+    mode: str = "none" # "player" (has a character there), "gm" (owns it) or "none"
+    settings: Dict[str, Any] = field(default_factory=dict)
+    rules: Optional[str] = None
+    owned_characters: set = field(default_factory=set) # Other character ids verified as this user's (see owns_character)
+
+class CampaignContextCache:
+    """
+    user_id -> CampaignContext (campaign id, character id, campaign settings and rules).
+    Resolved once, then served from memory on every chat turn until a router invalidates it
+    or CAMPAIGN_CONTEXT_TTL expires.
+    """
+
+    def __init__(self, ttl: float = CAMPAIGN_CONTEXT_TTL, max_size: int = CAMPAIGN_CONTEXT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict() # user_id -> (CampaignContext, expires_at)
+        self._lock = threading.Lock() # Routers are sync (threadpool), chat is async
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str) -> Optional[CampaignContext]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[1] < time.monotonic():
+                self._entries.pop(user_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, user_id: str, ctx: CampaignContext):
+        with self._lock:
+            self._entries[user_id] = (ctx, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: Optional[str]):
+        if not user_id:
+            return
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def invalidate_campaign(self, campaign_id: Optional[str]):
+        """
+        Drops every user routed to this campaign (settings/rules changed, campaign deleted).
+        """
+        if not campaign_id:
+            return
+        with self._lock:
+            for user_id in [u for u, (ctx, _) in self._entries.items() if ctx.campaign_id == campaign_id]:
+                del self._entries[user_id]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    async def _load(self, user_id: str) -> CampaignContext:
+        """
+        [PHASE 18] MULTIPLAYER ROUTING
+        Finds the campaign this user is playing in (or running as GM).
+        """
+        db = await get_async_supabase()
+        ctx = CampaignContext()
+        # 1. Player Mode: Check if User has a Character in a Campaign
+        # We take the oldest character (MVP). Chat requests name the selected character (owns_character).
+        chars = await db.table("characters").select("id, campaign_id").eq("user_id", user_id) \
+            .order("created_at").limit(1).execute()
+        if chars.data and chars.data[0].get("campaign_id"):
+            ctx.campaign_id = chars.data[0]["campaign_id"]
+            ctx.character_id = chars.data[0].get("id")
+            ctx.mode = "player"
+            camps = await db.table("campaigns").select("id, settings, rules").eq("id", ctx.campaign_id).limit(1).execute()
+        else:
+            # 2. GM Mode: Fallback to Campaign Ownership
+            camps = await db.table("campaigns").select("id, settings, rules").eq("gm_id", user_id).limit(1).execute()
+            if camps.data:
+                ctx.campaign_id = camps.data[0]["id"]
+                ctx.mode = "gm"
+
+        if camps.data:
+            ctx.settings = camps.data[0].get("settings") or {}
+            ctx.rules = camps.data[0].get("rules")
+        return ctx
+
+    async def resolve(self, user_id: str) -> CampaignContext:
+        ctx = self.get(user_id)
+        if ctx is not None:
+            return ctx
+        ctx = await self._load(user_id)
+        print(f"DEBUG: Resolved Campaign ID: {ctx.campaign_id} ({ctx.mode} mode)")
+        # Users without a campaign are cached too; creating a character/campaign invalidates them
+        self.put(user_id, ctx)
+        return ctx
+
+    async def owns_character(self, user_id: str, ctx: CampaignContext, character_id: str) -> bool:
+        """
+        Whether `character_id` belongs to this user. Positive answers are kept in the cached context
+        (routers invalidate it when characters are created, deleted or reassigned).
+        """
+        if character_id == ctx.character_id or character_id in ctx.owned_characters:
+            return True
+        db = await get_async_supabase()
+        res = await db.table("characters").select("id").eq("id", character_id).eq("user_id", user_id).limit(1).execute()
+        if res.data:
+            ctx.owned_characters.add(character_id)
+            return True
+        return False
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "ttl_seconds": self.ttl,
+        }
+
+# Singleton instance
+campaign_contexts = CampaignContextCache()
@@ -0,0 +1,107 @@
+from typing import Any, Dict, List, Optional
+from app.core.database import get_async_supabase
+from app.core.timing import span
+
+COINS = ("cp", "sp", "ep", "gp", "pp")
+# Legacy <LOOT> items that are really coins (same names the frontend used to recognise)
+LEGACY_COIN_NAMES = {"cp": ("copper", "cobre"), "sp": ("silver", "plata"), "gp": ("gold", "oro")}
+
+def _legacy_coin(name: str) -> Optional[str]:
+    lower = name.lower()
+    for coin, words in LEGACY_COIN_NAMES.items():
+        if lower == coin or any(w in lower for w in words):
+            return coin
+    return None
+
+def _as_int(value: Any, default: int = 0) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+def collect_turn_events(response: dict) -> Optional[dict]:
+    """
+    Folds one turn's parsed tags into apply_character_events arguments, or None if nothing changes.
+    <UPDATE> -> merged fields (absolute, e.g. hp_current from apply_damage), <XP_GAIN> -> xp increment,
+    <LOOT> -> coin increments + items. Only valid tag payloads count.
+    """
+    updates = response.get("updates") or {}
+    set_fields = dict(updates["status"]) if isinstance(updates.get("status"), dict) else dict(updates)
+
+    xp = 0
+    money: Dict[str, int] = {}
+    items: List[dict] = []
+    for event in response.get("events") or []:
+        if not event.get("valid"):
+            continue
+        payload = event.get("payload")
+        if event.get("tag") == "XP_GAIN" and isinstance(payload, int):
+            xp += payload
+        elif event.get("tag") == "LOOT" and payload:
+            if isinstance(payload, dict) and ("money" in payload or "items" in payload):
+                for coin, amount in (payload.get("money") or {}).items():
+                    if coin in COINS and _as_int(amount):
+                        money[coin] = money.get(coin, 0) + _as_int(amount)
+                loot = payload.get("items") or []
+            else:
+                loot = payload if isinstance(payload, list) else [payload] # Legacy: bare item(s)
+            for item in loot:
+                if not isinstance(item, dict) or not item.get("item"):
+                    continue
+                qty = max(1, _as_int(item.get("qty"), 1))
+                coin = _legacy_coin(str(item["item"]))
+                if coin:
+                    money[coin] = money.get(coin, 0) + qty
+                else:
+                    items.append({"item": str(item["item"]), "qty": qty, "weight": item.get("weight") or 0})
+
+    # The prompt pairs <XP_GAIN>50</XP_GAIN> with an absolute "xp" in <UPDATE>; the increment wins
+    # (the absolute value was computed from possibly stale context and would count the gain twice)
+    if xp:
+        set_fields.pop("xp", None)
+
+    if not (set_fields or xp or money or items):
+        return None
+    return {"p_set": set_fields, "p_xp": xp, "p_money": money, "p_items": items}
+
+class CharacterStateApplier:
+    """
+    Applies a turn's state changes to the player's character with ONE database call
+    (apply_character_events, schema_character_events.sql): the row is locked, merged/incremented
+    in place and the new status returned. No read-merge-write round trips, no lost updates.
+    """
+
+    def __init__(self):
+        self.applied = 0
+        self.failed = 0
+
+    async def apply(self, character_id: Optional[str], response: dict) -> Optional[dict]:
+        """
+        Returns the character's new status, or None (nothing to apply, or the call failed: the
+        client then falls back to applying `updates` itself).
+        """
+        if not character_id:
+            return None
+        events = collect_turn_events(response)
+        if events is None:
+            return None
+        try:
+            db = await get_async_supabase()
+            with span("state_apply"):
+                res = await db.rpc("apply_character_events", {"p_character_id": character_id, **events}).execute()
+            if res.data is None:
+                print(f"WARNING: Character {character_id} not found, state changes not applied")
+                self.failed += 1
+                return None
+            self.applied += 1
+            return res.data
+        except Exception as e:
+            print(f"WARNING: apply_character_events failed ({e}). Run schema_character_events.sql to apply turn state server-side.")
+            self.failed += 1
+            return None
+
+    def stats(self) -> dict:
+        return {"applied": self.applied, "failed": self.failed}
+
+# Singleton instance
+character_state = CharacterStateApplier()
@@ -0,0 +1,324 @@
+import os
+import re
+import copy
+import time
+import asyncio
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+from app.core.database import get_async_supabase
+from app.core.dice import DiceRoller
+from app.services.compendium_index import compendium_index
+
+# Safety net for encounters changed by another worker; this process's own writes update the cache directly
+COMBAT_STATE_TTL = float(os.getenv("COMBAT_STATE_TTL", "60"))
+MAX_COMBATANTS = 30
+MAX_WRITE_ATTEMPTS = 3 # optimistic-concurrency retries (version column) before giving up
+
+# Campaign of the chat turn being generated (set by AIHelper): encounter tools act on it without the model passing ids
+current_campaign_id: ContextVar[Optional[str]] = ContextVar("current_campaign_id", default=None)
+
+def _to_int(value: Any) -> int:
+    # Compendium values are ints, but some rows carry text like "150 (20d10 + 40)"
+    if isinstance(value, bool) or value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = re.match(r"\s*(-?\d+)", str(value))
+    return int(match.group(1)) if match else 0
+
+def _ability_mod(score: Any) -> int:
+    return (_to_int(score) - 10) // 2 if score is not None else 0
+
+def _missing_table(e: Exception) -> bool:
+    # Postgres undefined_table / PostgREST "table not in the schema cache": schema_combat.sql not run
+    return getattr(e, "code", None) in ("42P01", "PGRST205")
+
+def _like_literal(text: str) -> str:
+    # ilike pattern matching `text` literally (names like "Swarm of 100% Rats")
+    return re.sub(r"([\\%_])", r"\\\1", text)
+
+def _is_down(c: dict) -> bool:
+    return c["kind"] == "monster" and c["hp"] <= 0
+
+def format_summary(encounter: dict) -> str:
+    """
+    Compact prompt block: one line per combatant in initiative order, '>' marks whose turn it is.
+    """
+    lines = [f"Round {encounter['round']}. Initiative order ('>' = acting now):"]
+    for i, c in enumerate(encounter["combatants"]):
+        marker = ">" if i == encounter["turn_index"] else " "
+        if c["kind"] == "monster":
+            state = f"HP {c['hp']}/{c['hp_max']} AC {c['ac']}" + (" DOWN" if _is_down(c) else "")
+        else:
+            state = "PC" + (f" AC {c['ac']}" if c.get("ac") else "")
+        conditions = f" ({', '.join(c['conditions'])})" if c.get("conditions") else ""
+        lines.append(f"{marker} {c['name']} [init {c['initiative']}] {state}{conditions}")
+    return "\n".join(lines)
+
+class CombatEngine:
+    """
+    Persistent encounter per campaign ('encounters' table, schema_combat.sql): initiative order,
+    combatants (monster HP/AC seeded from the compendium), conditions, round and turn pointers.
+    Reads are cached per campaign; writes are serialized per campaign in this process and guarded by
+    a version check, so concurrent tool calls (or workers) never lose an update.
+    Uses the service-role client: the table is closed to the anon key (RLS).
+    """
+
+    def __init__(self, ttl: float = COMBAT_STATE_TTL):
+        self.ttl = ttl
+        self._cache: Dict[str, tuple] = {} # campaign_id -> (active encounter or None, expires_at)
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.hits = 0
+        self.reads = 0
+        self.writes = 0
+        self.conflicts = 0
+
+    def _remember(self, campaign_id: str, encounter: Optional[dict]):
+        self._cache[campaign_id] = (encounter, time.monotonic() + self.ttl)
+
+    def _lock(self, campaign_id: str) -> asyncio.Lock:
+        return self._locks.setdefault(campaign_id, asyncio.Lock())
+
+    async def get(self, campaign_id: Optional[str], fresh: bool = False) -> Optional[dict]:
+        """
+        Active encounter of the campaign, or None.
+        """
+        if not campaign_id:
+            return None
+        entry = self._cache.get(campaign_id)
+        if not fresh and entry and entry[1] > time.monotonic():
+            self.hits += 1
+            return entry[0]
+        self.reads += 1
+        db = await get_async_supabase("service")
+        res = await db.table("encounters").select("*").eq("campaign_id", campaign_id) \
+            .eq("status", "active").limit(1).execute()
+        encounter = res.data[0] if res.data else None
+        self._remember(campaign_id, encounter)
+        return encounter
+
+    async def summary(self, campaign_id: Optional[str]) -> Optional[str]:
+        """
+        Prompt block for the campaign's active encounter (None when there is no fight).
+        """
+        try:
+            encounter = await self.get(campaign_id)
+        except Exception as e:
+            if _missing_table(e):
+                print(f"WARNING: encounters unavailable ({e}). Run schema_combat.sql to enable the combat tracker.")
+                self._remember(campaign_id, None) # Don't retry (and warn) on every turn
+                return None
+            # Transient failure: fall back to the last known state (even if expired), don't cache the miss
+            print(f"WARNING: Encounter lookup failed ({e})")
+            entry = self._cache.get(campaign_id)
+            encounter = entry[0] if entry else None
+        return format_summary(encounter) if encounter else None
+
+    async def _monster(self, db, name: str) -> Optional[dict]:
+        # Name fast path (in-memory index, fuzzy + aliases) resolves the id; otherwise a case-insensitive match
+        named = compendium_index.lookup_name("monsters", name)
+        query = db.table("monsters").select("name, ac, hp, stats")
+        query = query.eq("id", named["id"]) if named and named.get("id") else query.ilike("name", _like_literal(name))
+        res = await query.limit(1).execute()
+        return res.data[0] if res.data else None
+
+    async def start(self, campaign_id: str, monsters: List[dict], players: Optional[List[dict]] = None) -> dict:
+        """
+        Creates the campaign's encounter. Monsters ({"name", "count", optional "hp"/"ac" overrides}) get
+        compendium HP/AC and roll initiative (d20 + DEX); players ({"name", "initiative", optional "ac"})
+        bring their own rolls.
+        """
+        async with self._lock(campaign_id):
+            if await self.get(campaign_id, fresh=True):
+                raise ValueError("An encounter is already running. Call end_encounter first.")
+
+            db = await get_async_supabase("service")
+            combatants = []
+            for spec in monsters:
+                name = str(spec.get("name") or "").strip()
+                count = max(1, _to_int(spec.get("count", 1)))
+                if not name:
+                    raise ValueError("Every monster needs a 'name'.")
+                row = await self._monster(db, name) or {"name": name}
+                hp = _to_int(spec.get("hp")) or _to_int(row.get("hp"))
+                ac = _to_int(spec.get("ac")) or _to_int(row.get("ac"))
+                if hp <= 0:
+                    raise ValueError(f"No HP for '{name}' in the compendium. Pass 'hp' (and 'ac') for it.")
+                dex = _ability_mod((row.get("stats") or {}).get("dex"))
+                for i in range(count):
+                    combatants.append({
+                        "name": f"{row['name']} {i + 1}" if count > 1 else row["name"],
+                        "kind": "monster",
+                        "initiative": DiceRoller.roll(f"1d20{dex:+d}")["total"],
+                        "dex": dex,
+                        "ac": ac,
+                        "hp": hp,
+                        "hp_max": hp,
+                        "conditions": [],
+                    })
+            for spec in players or []:
+                combatants.append({
+                    "name": str(spec.get("name") or "Player"),
+                    "kind": "player",
+                    "initiative": _to_int(spec.get("initiative")),
+                    "dex": 0,
+                    "ac": _to_int(spec.get("ac")) or None,
+                    "hp": None,
+                    "hp_max": None,
+                    "conditions": [],
+                })
+            if not combatants:
+                raise ValueError("An encounter needs at least one combatant.")
+            if len(combatants) > MAX_COMBATANTS:
+                raise ValueError(f"Too many combatants! Max {MAX_COMBATANTS}.")
+
+            # Names must be unique: tools address combatants by name
+            seen: Dict[str, int] = {}
+            for c in combatants:
+                key = c["name"].lower()
+                seen[key] = seen.get(key, 0) + 1
+                if seen[key] > 1:
+                    c["name"] = f"{c['name']} ({seen[key]})"
+
+            # Initiative order: highest roll first, DEX breaks ties, players win remaining ties
+            combatants.sort(key=lambda c: (-c["initiative"], -c["dex"], c["kind"] != "player"))
+            res = await db.table("encounters").insert({
+                "campaign_id": campaign_id,
+                "status": "active",
+                "round": 1,
+                "turn_index": 0,
+                "combatants": combatants,
+                "version": 0,
+            }).execute()
+            self.writes += 1
+            encounter = res.data[0]
+            self._remember(campaign_id, encounter)
+            print(f"Encounter started for campaign {campaign_id} ({len(combatants)} combatants)")
+            return encounter
+
+    async def _update(self, campaign_id: str, change: Callable[[dict], str]) -> tuple:
+        """
+        Applies `change` (mutates a copy, returns a message) to the active encounter.
+        Compare-and-set on `version`: a concurrent writer makes the update miss, so reload and reapply.
+        Returns (message, encounter after the change).
+        """
+        async with self._lock(campaign_id):
+            db = await get_async_supabase("service")
+            for attempt in range(MAX_WRITE_ATTEMPTS):
+                current = await self.get(campaign_id, fresh=attempt > 0)
+                if current is None:
+                    raise ValueError("No active encounter. Call start_encounter first.")
+                encounter = copy.deepcopy(current)
+                message = change(encounter)
+                res = await db.table("encounters").update({
+                    "status": encounter["status"],
+                    "round": encounter["round"],
+                    "turn_index": encounter["turn_index"],
+                    "combatants": encounter["combatants"],
+                    "version": current["version"] + 1,
+                    "updated_at": datetime.now(timezone.utc).isoformat(),
+                }).eq("id", current["id"]).eq("version", current["version"]).execute()
+                if res.data:
+                    self.writes += 1
+                    updated = res.data[0]
+                    self._remember(campaign_id, updated if updated["status"] == "active" else None)
+                    return message, updated
+                self.conflicts += 1
+            raise RuntimeError("The encounter kept changing underneath this update. Try again.")
+
+    @staticmethod
+    def _find(encounter: dict, target: str) -> dict:
+        # Exact name first, then a unique prefix ("goblin 2", "Gob")
+        wanted = target.strip().lower()
+        combatants = encounter["combatants"]
+        exact = [c for c in combatants if c["name"].lower() == wanted]
+        if exact:
+            return exact[0]
+        partial = [c for c in combatants if c["name"].lower().startswith(wanted)]
+        if len(partial) == 1:
+            return partial[0]
+        names = ", ".join(c["name"] for c in combatants)
+        raise ValueError(f"'{target}' is {'ambiguous' if partial else 'not in the encounter'}. Combatants: {names}")
+
+    async def damage(self, campaign_id: str, target: str, amount: int = 0, add_conditions: Optional[List[str]] = None, remove_conditions: Optional[List[str]] = None) -> tuple:
+        """
+        Monster damage (negative amount heals, clamped to 0..max) and condition changes.
+        Ends the encounter when the last monster goes down.
+        """
+        def change(encounter: dict) -> str:
+            c = self._find(encounter, target)
+            parts = []
+            if amount:
+                if c["kind"] != "monster":
+                    raise ValueError(f"{c['name']} is a player character: use apply_damage / apply_healing for PCs.")
+                before = c["hp"]
+                c["hp"] = max(0, min(c["hp_max"], before - amount))
+                op = f"- {amount}" if amount > 0 else f"+ {-amount}"
+                parts.append(f"{c['name']}: {before} {op} = {c['hp']}/{c['hp_max']} HP.")
+                if c["hp"] == 0:
+                    parts.append(f"{c['name']} is DOWN.")
+            for condition in add_conditions or []:
+                if condition.lower() not in (x.lower() for x in c["conditions"]):
+                    c["conditions"].append(condition)
+            if remove_conditions:
+                removed = {x.lower() for x in remove_conditions}
+                c["conditions"] = [x for x in c["conditions"] if x.lower() not in removed]
+            if add_conditions or remove_conditions:
+                parts.append(f"{c['name']} conditions: {', '.join(c['conditions']) or 'none'}.")
+            monsters = [x for x in encounter["combatants"] if x["kind"] == "monster"]
+            if monsters and all(_is_down(x) for x in monsters):
+                encounter["status"] = "ended"
+                parts.append(f"All enemies are down: the encounter is over (round {encounter['round']}).")
+            return " ".join(parts) or "Nothing changed."
+
+        return await self._update(campaign_id, change)
+
+    async def next_turn(self, campaign_id: str) -> tuple:
+        """
+        Advances to the next combatant still standing (wrapping increments the round).
+        """
+        def change(encounter: dict) -> str:
+            combatants = encounter["combatants"]
+            for _ in range(len(combatants)):
+                encounter["turn_index"] += 1
+                if encounter["turn_index"] >= len(combatants):
+                    encounter["turn_index"] = 0
+                    encounter["round"] += 1
+                if not _is_down(combatants[encounter["turn_index"]]):
+                    break
+            c = combatants[encounter["turn_index"]]
+            who = "a player character: ask them what they do" if c["kind"] == "player" else f"HP {c['hp']}/{c['hp_max']}"
+            return f"Round {encounter['round']}: {c['name']}'s turn ({who})."
+
+        return await self._update(campaign_id, change)
+
+    async def end(self, campaign_id: str) -> tuple:
+        def change(encounter: dict) -> str:
+            encounter["status"] = "ended"
+            return f"Encounter ended after {encounter['round']} round(s)."
+
+        return await self._update(campaign_id, change)
+
+    def forget(self, campaign_id: Optional[str] = None):
+        """
+        Drops cached state after encounters were changed outside the engine (/reset); None = every campaign.
+        """
+        if campaign_id:
+            self._cache.pop(campaign_id, None)
+        else:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "cached_campaigns": len(self._cache),
+            "active_encounters": sum(1 for enc, expires in self._cache.values() if enc and expires > now),
+            "cache_hits": self.hits,
+            "reads": self.reads,
+            "writes": self.writes,
+            "version_conflicts": self.conflicts,
+        }
+
+# Singleton instance
+combat_engine = CombatEngine()
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+from app.core.database import get_supabase
+from app.services.name_index import NameIndex, load_item_aliases
+
+# How often the background refresher compares version stamps (see compendium_index_schema.sql)
+VERSION_CHECK_SECONDS = float(os.getenv("COMPENDIUM_VERSION_CHECK_SECONDS", "60"))
+PAGE_SIZE = 1000
+
+def _fmt(value) -> str:
+    # Mirrors Postgres format('%s', ...) used by match_compendium
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return f"{value:g}"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+def _spell_content(r: dict) -> str:
+    return "Spell: {} (Lvl {} {}). Cast: {}. Range: {}. Duration: {}. Desc: {}".format(
+        *[_fmt(r.get(k)) for k in ("name", "level", "school", "casting_time", "range", "duration", "description")])
+
+def _monster_content(r: dict) -> str:
+    return "Monster: {} (CR {} {}). AC {}, HP {}. Stats: {}. Actions: {}".format(
+        *[_fmt(r.get(k)) for k in ("name", "cr", "type", "ac", "hp", "stats", "actions")])
+
+def _item_content(r: dict) -> str:
+    return "Item: {} ({} {}). Desc: {}. Props: {}".format(
+        *[_fmt(r.get(k)) for k in ("name", "rarity", "type", "description", "properties")])
+
+# table -> (columns to load, content formatter). Content matches the match_compendium RPC.
+TABLES: Dict[str, tuple] = {
+    "spells": ("id, name, level, school, casting_time, range, duration, description, embedding", _spell_content),
+    "monsters": ("id, name, cr, type, ac, hp, stats, actions, embedding", _monster_content),
+    "items": ("id, name, rarity, type, description, properties, embedding", _item_content),
+}
+
+class TableIndex:
+    """
+    One compendium table in memory: L2-normalized float32 matrix + row metadata.
+    """
+
+    def __init__(self, table: str, rows: List[dict], matrix: np.ndarray, version: Optional[int], aliases: Optional[Dict[str, str]] = None):
+        self.table = table
+        self.rows = rows # [{"id", "name", "content"}], aligned with matrix rows
+        self.matrix = matrix # shape (n, dim), contiguous float32, unit-length rows
+        self.names = NameIndex(rows, aliases)
+        self.version = version
+        self.loaded_at = time.time()
+
+    def search(self, query_vector: List[float], match_threshold: float = 0.5, match_count: int = 3) -> List[dict]:
+        """
+        Vectorized cosine top-k. Same result shape as the match_compendium RPC.
+        """
+        if not self.rows:
+            return []
+        q = np.asarray(query_vector, dtype=np.float32)
+        if q.shape[0] != self.matrix.shape[1]:
+            raise ValueError(f"Query dim {q.shape[0]} != index dim {self.matrix.shape[1]} for {self.table}")
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return []
+        scores = self.matrix @ (q / norm)
+
+        k = min(match_count, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {**self.rows[i], "similarity": float(scores[i])}
+            for i in top if scores[i] > match_threshold
+        ]
+
+class CompendiumIndex:
+    """
+    In-process vector index for the static compendium (spells, monsters, items).
+    Loaded at startup; reloaded when the seed scripts bump a table's version stamp.
+    Tools fall back to the match_compendium RPC while a table is not loaded.
+    """
+
+    def __init__(self):
+        self.tables: Dict[str, TableIndex] = {}
+        self._lock = threading.Lock()
+
+    def is_loaded(self, table: str) -> bool:
+        return table in self.tables
+
+    def search(self, table: str, query_vector: List[float], match_threshold: float = 0.5, match_count: int = 3) -> Optional[List[dict]]:
+        """
+        Returns matches, or None if the table is not in memory (caller should use the RPC).
+        """
+        index = self.tables.get(table)
+        if index is None:
+            return None
+        return index.search(query_vector, match_threshold, match_count)
+
+    def lookup_name(self, table: str, query: str, include_mentions: bool = False) -> Optional[dict]:
+        """
+        Exact/fuzzy name hit for a table, or None (not loaded or no confident match).
+        include_mentions: see NameIndex.lookup.
+        """
+        index = self.tables.get(table)
+        if index is None:
+            return None
+        return index.names.lookup(query, include_mentions)
+
+    def fetch_versions(self) -> Dict[str, int]:
+        try:
+            res = get_supabase().table("compendium_versions").select("table_name, version").execute()
+            return {r["table_name"]: r["version"] for r in (res.data or [])}
+        except Exception as e:
+            print(f"WARNING: compendium_versions unavailable ({e}). Run compendium_index_schema.sql to enable reloads.")
+            return {}
+
+    def load_table(self, table: str, version: Optional[int] = None):
+        columns, make_content = TABLES[table]
+        db = get_supabase()
+        raw_rows = []
+        start = 0
+        while True:
+            res = db.table(table).select(columns).range(start, start + PAGE_SIZE - 1).execute()
+            page = res.data or []
+            raw_rows.extend(page)
+            if len(page) < PAGE_SIZE:
+                break
+            start += PAGE_SIZE
+
+        rows, vectors = [], []
+        for r in raw_rows:
+            emb = r.get("embedding")
+            if not emb:
+                continue
+            # PostgREST returns pgvector columns as "[0.1,0.2,...]"
+            vectors.append(json.loads(emb) if isinstance(emb, str) else emb)
+            rows.append({"id": r.get("id"), "name": r.get("name"), "content": make_content(r)})
+
+        matrix = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32)) if vectors else np.zeros((0, 0), dtype=np.float32)
+        if len(matrix):
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix /= norms
+
+        aliases = load_item_aliases() if table == "items" else None
+        self.tables[table] = TableIndex(table, rows, matrix, version, aliases)
+        print(f"Compendium index: loaded {len(rows)} {table} (version {version})")
+
+    def load_all(self):
+        versions = self.fetch_versions()
+        with self._lock:
+            for table in TABLES:
+                try:
+                    self.load_table(table, versions.get(table))
+                except Exception as e:
+                    print(f"Compendium index: failed to load {table}: {e}")
+
+    def refresh_if_stale(self):
+        """
+        Reloads any table whose version stamp changed since it was loaded (e.g. after seeding).
+        """
+        versions = self.fetch_versions()
+        with self._lock:
+            for table in TABLES:
+                current = self.tables.get(table)
+                latest = versions.get(table)
+                if current is None or (latest is not None and latest != current.version):
+                    try:
+                        self.load_table(table, latest)
+                    except Exception as e:
+                        print(f"Compendium index: failed to reload {table}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            table: {"rows": len(idx.rows), "dim": int(idx.matrix.shape[1]) if idx.rows else 0,
+                    "version": idx.version, "loaded_at": idx.loaded_at}
+            for table, idx in self.tables.items()
+        }
+
+# Singleton instance
+compendium_index = CompendiumIndex()
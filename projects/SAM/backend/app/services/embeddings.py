@@ -0,0 +1,266 @@
+import os
+import re
+import time
+import asyncio
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+load_dotenv()
+
+# Models in use: RAG documents vs. compendium tables (different vector sizes, never mix them)
+RAG_EMBEDDING_MODEL = "models/gemini-embedding-001"
+COMPENDIUM_EMBEDDING_MODEL = "models/text-embedding-004"
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH") # e.g. "embedding_cache.sqlite3"; unset = memory only
+
+# Cache misses arriving within this window are sent as one batch request (0 = no waiting, still batches what is queued)
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "32")) # Gemini accepts up to 100 texts per batch request
+EMBED_BATCH_WORKERS = int(os.getenv("EMBED_BATCH_WORKERS", "4")) # Batch requests in flight at once
+
+def normalize_text(text: str) -> str:
+    """
+    Cache key normalization: "  Fireball   DAMAGE " and "fireball damage" share one entry.
+    """
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+class EmbeddingCache:
+    """
+    Two-tier cache of query vectors keyed by (model, normalized text).
+    Tier 1: in-memory LRU. Tier 2 (optional): SQLite file that survives restarts.
+    """
+
+    def __init__(self, max_size: int = EMBEDDING_CACHE_SIZE, path: Optional[str] = EMBEDDING_CACHE_PATH):
+        self.max_size = max_size
+        self._memory: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self._db = None
+        if path:
+            try:
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS embeddings ("
+                    " model TEXT NOT NULL, text TEXT NOT NULL, vector BLOB NOT NULL,"
+                    " PRIMARY KEY (model, text))"
+                )
+                self._db.commit()
+            except Exception as e:
+                print(f"WARNING: Embedding disk cache disabled ({e})")
+                self._db = None
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        key = (model, normalize_text(text))
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.hits_memory += 1
+                return vector
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT vector FROM embeddings WHERE model = ? AND text = ?", key
+                ).fetchone()
+                if row:
+                    vector = array("f", row[0]).tolist()
+                    self._remember(key, vector)
+                    self.hits_disk += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def put(self, model: str, text: str, vector: List[float]):
+        key = (model, normalize_text(text))
+        with self._lock:
+            self._remember(key, vector)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO embeddings (model, text, vector) VALUES (?, ?, ?)",
+                        (key[0], key[1], array("f", vector).tobytes()),
+                    )
+                    self._db.commit()
+                except Exception as e:
+                    print(f"WARNING: Embedding disk cache write failed: {e}")
+
+    def _remember(self, key: Tuple[str, str], vector: List[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        hits = self.hits_memory + self.hits_disk
+        return {
+            "entries": len(self._memory),
+            "max_size": self.max_size,
+            "disk": self._db is not None,
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+embedding_cache = EmbeddingCache()
+
+class EmbeddingBatcher:
+    """
+    Micro-batching coalescer for query embeddings.
+    Misses from concurrent turns (RAG retrieval on the event loop, compendium tools in worker threads)
+    are collected for EMBED_BATCH_WINDOW_MS, or until EMBED_BATCH_MAX texts, and sent as one
+    batch request; each caller gets its own vector back. Identical texts in a batch are embedded once.
+    """
+
+    def __init__(self, embed_batch: Callable[[List[str]], List[List[float]]], window_ms: float = EMBED_BATCH_WINDOW_MS,
+                 max_batch: int = EMBED_BATCH_MAX, workers: int = EMBED_BATCH_WORKERS):
+        self.embed_batch = embed_batch
+        self.window = max(window_ms, 0.0) / 1000
+        self.max_batch = max(max_batch, 1)
+        self._pending: "OrderedDict[str, Future]" = OrderedDict() # normalized text -> future shared by its callers
+        self._texts: Dict[str, str] = {} # normalized -> first original text
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="embed-batch")
+        self._collector: Optional[threading.Thread] = None
+        self.queries = 0
+        self.batches = 0
+        self.texts_sent = 0
+
+    def submit(self, text: str) -> Future:
+        key = normalize_text(text)
+        with self._cond:
+            self.queries += 1
+            future = self._pending.get(key)
+            if future is None:
+                future = Future()
+                self._pending[key] = future
+                self._texts[key] = text
+            if self._collector is None or not self._collector.is_alive():
+                self._collector = threading.Thread(target=self._collect, name="embed-collector", daemon=True)
+                self._collector.start()
+            self._cond.notify()
+            return future
+
+    def embed(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    async def aembed(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _collect(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # 1. Window opens with the first text; close early once the batch is full
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                # 2. Take up to max_batch texts (oldest first); the rest start the next window
+                keys = list(self._pending)[:self.max_batch]
+                batch = [(self._texts.pop(k), self._pending.pop(k)) for k in keys]
+            # 3. Send it off; the next window can fill while this request is in flight
+            self._executor.submit(self._send, batch)
+
+    def _send(self, batch: List[Tuple[str, Future]]):
+        try:
+            vectors = self.embed_batch([text for text, _ in batch])
+            if len(vectors) != len(batch):
+                raise ValueError(f"Embedding batch returned {len(vectors)} vectors for {len(batch)} texts")
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        with self._cond:
+            self.batches += 1
+            self.texts_sent += len(batch)
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+    def stats(self) -> dict:
+        return {
+            "queries": self.queries,
+            "batches": self.batches,
+            "texts_sent": self.texts_sent,
+            "avg_batch": round(self.texts_sent / self.batches, 2) if self.batches else 0.0,
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+        }
+
+class CachedEmbeddings(Embeddings):
+    """
+    Drop-in LangChain Embeddings wrapper: query embeddings go through the shared cache
+    (misses are coalesced into batch requests), document embeddings (ingestion/seeding) pass straight through.
+    """
+
+    def __init__(self, base: Embeddings, model: str, cache: EmbeddingCache = embedding_cache, batch_kwargs: Optional[dict] = None):
+        self.base = base
+        self.model = model
+        self.cache = cache
+        self.batch_kwargs = batch_kwargs or {} # Extra embed_documents() arguments for query batches
+        self.batcher = EmbeddingBatcher(self._embed_query_batch)
+
+    def _embed_query_batch(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents(texts, **self.batch_kwargs)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self.cache.get(self.model, text)
+        if vector is None:
+            vector = self.batcher.embed(text)
+            self.cache.put(self.model, text, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = self.cache.get(self.model, text)
+        if vector is None:
+            vector = await self.batcher.aembed(text)
+            self.cache.put(self.model, text, vector)
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.base.aembed_documents(texts)
+
+_embedders: Dict[str, CachedEmbeddings] = {}
+_embedders_lock = threading.Lock()
+
+def get_embeddings(model: str = RAG_EMBEDDING_MODEL) -> CachedEmbeddings:
+    """
+    Returns the shared, cached embedder for a model (one Google client per model per process).
+    """
+    embedder = _embedders.get(model)
+    if embedder:
+        return embedder
+    with _embedders_lock:
+        if model not in _embedders:
+            # Heavy import (google.genai types): paid by the first embedder, not at server import
+            from langchain_google_genai import GoogleGenerativeAIEmbeddings
+            base = GoogleGenerativeAIEmbeddings(model=model, google_api_key=os.getenv("GOOGLE_API_KEY"))
+            # Batch endpoint, but keep the query task type so vectors match embed_query's
+            _embedders[model] = CachedEmbeddings(base, model, batch_kwargs={"task_type": "RETRIEVAL_QUERY"})
+        return _embedders[model]
+
+def get_embedding_cache_stats() -> dict:
+    return embedding_cache.stats()
+
+def get_embedding_batch_stats() -> dict:
+    return {model: embedder.batcher.stats() for model, embedder in list(_embedders.items())}
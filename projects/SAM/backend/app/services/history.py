@@ -0,0 +1,198 @@
+import os
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from langchain_core.messages import HumanMessage
+from app.core.database import get_async_supabase
+from app.core.tags import parse_tags
+from app.services.llm_scheduler import llm_scheduler, estimate_request_tokens, PRIORITY_BACKGROUND
+
+load_dotenv()
+
+# Prompt budget for history (summary + verbatim turns), in estimated tokens
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+# Most recent messages always kept verbatim (never folded into the summary)
+HISTORY_KEEP_RECENT = int(os.getenv("HISTORY_KEEP_RECENT", "12"))
+# Fold older messages into the summary once this many have piled up beyond the verbatim window
+HISTORY_SUMMARY_EVERY = int(os.getenv("HISTORY_SUMMARY_EVERY", "10"))
+HISTORY_FETCH_LIMIT = HISTORY_KEEP_RECENT + 2 * HISTORY_SUMMARY_EVERY
+SUMMARY_MAX_WORDS = 300
+
+SUMMARY_PROMPT = """You keep the running summary of a Dungeons & Dragons campaign run by S.A.M., an AI Dungeon Master.
+Update the summary with the new turns below. Keep: characters and NPCs met, places, quests and hooks,
+items and money gained or lost, injuries, unresolved threats and promises. Drop jokes and flavor text.
+Write in the same language as the conversation, at most {max_words} words, plain prose, no tags.
+
+PREVIOUS SUMMARY:
+{summary}
+
+NEW TURNS:
+{turns}
+
+UPDATED SUMMARY:"""
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for Gemini on EN/ES prose; good enough for budgeting
+    return len(text) // 4 + 1
+
+def fit_to_budget(turns: List[dict], budget: int) -> List[dict]:
+    """
+    Keeps the newest turns whose combined size fits the budget (chronological order preserved).
+    """
+    kept, used = [], 0
+    for turn in reversed(turns):
+        cost = estimate_tokens(turn.get("content", ""))
+        if used + cost > budget:
+            break
+        kept.append(turn)
+        used += cost
+    return list(reversed(kept))
+
+def _to_turn(row: dict) -> Optional[dict]:
+    role = row.get("role")
+    content = row.get("content") or ""
+    if role not in ("user", "assistant") or not content.strip():
+        return None
+    if role == "user" and content.strip().startswith("/"):
+        return None # Admin commands are not part of the story
+    if role == "assistant":
+        content = parse_tags(content).narrative # Machine tags are noise for the model
+    return {"role": role, "content": content}
+
+class ConversationHistory:
+    """
+    Builds chat history server-side from the 'messages' table (per campaign):
+    rolling summary of older turns + the most recent turns verbatim, under a token budget.
+    The summary is refreshed in the background every HISTORY_SUMMARY_EVERY messages.
+    """
+
+    def __init__(self):
+        self._llm = None
+        self._running = set() # Campaigns with a summary update in flight
+        self._tasks = set()
+        self._pending: Dict[str, int] = {} # Messages added per campaign since the last summary check
+        self._generation: Dict[str, int] = {} # Bumped by forget(): in-flight updates for older generations are discarded
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            self._llm = ChatGoogleGenerativeAI(
+                model="gemini-flash-latest",
+                temperature=0.2,
+                google_api_key=os.getenv("GOOGLE_API_KEY"),
+                max_retries=0 # Retried by llm_scheduler
+            )
+        return self._llm
+
+    async def _fetch_summary(self, campaign_id: str) -> dict:
+        try:
+            # campaign_summaries is closed to the anon key (RLS): service role only
+            db = await get_async_supabase("service")
+            res = await db.table("campaign_summaries").select("summary, summarized_until, turns_summarized") \
+                .eq("campaign_id", campaign_id).limit(1).execute()
+            return res.data[0] if res.data else {}
+        except Exception as e:
+            print(f"WARNING: campaign_summaries unavailable ({e}). Run schema_history.sql to enable summaries.")
+            return {}
+
+    async def load(self, campaign_id: str, current_message: Optional[str] = None, budget: int = HISTORY_TOKEN_BUDGET) -> Tuple[str, List[dict]]:
+        """
+        Returns (summary, recent_turns) for the prompt. `current_message` (already saved by the
+        endpoint) is dropped from the tail so it is not sent twice.
+        """
+        db = await get_async_supabase()
+        summary_row, res = await asyncio.gather(
+            self._fetch_summary(campaign_id),
+            db.table("messages").select("role, content, created_at").eq("campaign_id", campaign_id)
+                .order("created_at", desc=True).limit(HISTORY_FETCH_LIMIT).execute()
+        )
+        rows = list(reversed(res.data or []))
+
+        until = summary_row.get("summarized_until")
+        if until:
+            rows = [r for r in rows if r.get("created_at") and r["created_at"] > until]
+        if current_message is not None and rows and rows[-1].get("role") == "user" and rows[-1].get("content") == current_message:
+            rows = rows[:-1]
+
+        turns = [t for t in (_to_turn(r) for r in rows) if t]
+        summary = summary_row.get("summary") or ""
+        return summary, fit_to_budget(turns, max(budget - estimate_tokens(summary), 0))
+
+    def schedule_summary(self, campaign_id: Optional[str], messages_added: int = 2):
+        """
+        Fire-and-forget summary refresh after a turn (at most one in flight per campaign).
+        The tables are only checked once HISTORY_SUMMARY_EVERY messages have piled up since the last
+        check; the first turn after a restart (or a forget()) always checks, the backlog being unknown.
+        """
+        if not campaign_id:
+            return
+        pending = self._pending.get(campaign_id)
+        pending = HISTORY_SUMMARY_EVERY if pending is None else pending + messages_added
+        if pending < HISTORY_SUMMARY_EVERY or campaign_id in self._running:
+            self._pending[campaign_id] = pending
+            return
+        self._pending[campaign_id] = 0
+        self._running.add(campaign_id)
+        task = asyncio.create_task(self._update_summary(campaign_id))
+        self._tasks.add(task)
+        task.add_done_callback(lambda t: (self._tasks.discard(t), self._running.discard(campaign_id)))
+
+    def forget(self, campaign_id: Optional[str] = None):
+        """
+        Drops in-process state after the campaign's messages were wiped or replaced (/reset, /load);
+        None forgets every campaign. The caller deletes the campaign_summaries row itself.
+        """
+        for cid in ([campaign_id] if campaign_id else list(set(self._pending) | set(self._generation) | self._running)):
+            self._pending.pop(cid, None)
+            self._generation[cid] = self._generation.get(cid, 0) + 1
+
+    async def _update_summary(self, campaign_id: str):
+        generation = self._generation.get(campaign_id, 0)
+        try:
+            db = await get_async_supabase()
+            summary_row = await self._fetch_summary(campaign_id)
+            query = db.table("messages").select("role, content, created_at").eq("campaign_id", campaign_id)
+            if summary_row.get("summarized_until"):
+                query = query.gt("created_at", summary_row["summarized_until"])
+            res = await query.order("created_at").limit(HISTORY_KEEP_RECENT + 5 * HISTORY_SUMMARY_EVERY).execute()
+            rows = res.data or []
+
+            # 1. Not enough new turns beyond the verbatim window yet
+            if len(rows) < HISTORY_KEEP_RECENT + HISTORY_SUMMARY_EVERY:
+                return
+
+            # 2. Fold everything but the verbatim window into the previous summary
+            fold = rows[:-HISTORY_KEEP_RECENT]
+            turns = [t for t in (_to_turn(r) for r in fold) if t]
+            transcript = "\n".join(f"{'PLAYER' if t['role'] == 'user' else 'S.A.M.'}: {t['content']}" for t in turns)
+            prompt = SUMMARY_PROMPT.format(
+                max_words=SUMMARY_MAX_WORDS,
+                summary=summary_row.get("summary") or "(none yet)",
+                turns=transcript or "(no story turns)"
+            )
+            messages = [HumanMessage(content=prompt)]
+            # Background class: yields to live chat turns when quota is tight
+            ai_msg = await llm_scheduler.run(lambda: self.llm.ainvoke(messages), PRIORITY_BACKGROUND, campaign_id, estimate_request_tokens(messages))
+            content = ai_msg.content
+            if isinstance(content, list):
+                content = "".join(b.get("text", "") if isinstance(b, dict) else str(b) for b in content)
+
+            # 3. Store it (summarized_until moves past the folded turns), unless the history was reset meanwhile
+            if self._generation.get(campaign_id, 0) != generation:
+                return
+            service = await get_async_supabase("service")
+            await service.table("campaign_summaries").upsert({
+                "campaign_id": campaign_id,
+                "summary": content.strip(),
+                "summarized_until": fold[-1]["created_at"],
+                "turns_summarized": (summary_row.get("turns_summarized") or 0) + len(fold),
+                "updated_at": datetime.now(timezone.utc).isoformat()
+            }).execute()
+            print(f"History summary updated for campaign {campaign_id} (+{len(fold)} messages)")
+        except Exception as e:
+            print(f"History summary error ({campaign_id}): {e}")
+
+# Singleton instance
+conversation_history = ConversationHistory()
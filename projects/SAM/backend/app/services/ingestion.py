@@ -1,27 +1,17 @@
 import os
+import asyncio
 import tempfile
 import shutil
 from typing import List
 from dotenv import load_dotenv
-from supabase import create_client, Client
-
-from langchain_community.document_loaders import PyPDFLoader, UnstructuredEPubLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import SupabaseVectorStore
+from app.core.database import get_supabase
+from app.services.embeddings import get_embeddings, RAG_EMBEDDING_MODEL
 
 load_dotenv()
 
 # Config
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("Missing Supabase credentials")
-
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
 class IngestionService:
     @staticmethod
     async def ingest_campaign_module(file_bytes: bytes, filename: str, campaign_id: str) -> dict:
@@ -30,6 +20,19 @@ class IngestionService:
         Tags it with {"campaign_id": campaign_id, "source": filename}.
         """
         
+        # Loading, splitting and embedding are all blocking; keep them off the event loop.
+        return await asyncio.to_thread(
+            IngestionService._ingest_file, file_bytes, filename, campaign_id
+        )
+
+    @staticmethod
+    def _ingest_file(file_bytes: bytes, filename: str, campaign_id: str) -> dict:
+        # Loaders/splitters (langchain_community, unstructured, pypandoc) are only needed here:
+        # imported on the first upload instead of at server start
+        from langchain_community.document_loaders import PyPDFLoader, UnstructuredEPubLoader
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        from langchain_community.vectorstores import SupabaseVectorStore
+
         # 1. Determine Extension
         ext = os.path.splitext(filename)[1].lower()
         if ext not in [".pdf", ".epub"]:
@@ -69,15 +72,12 @@ class IngestionService:
                 chunk.metadata["type"] = "campaign_module"
 
             # 6. Vectorize & Store
-            embeddings = GoogleGenerativeAIEmbeddings(
-                model="models/gemini-embedding-001",
-                google_api_key=GOOGLE_API_KEY
-            )
+            embeddings = get_embeddings(RAG_EMBEDDING_MODEL)
             
             SupabaseVectorStore.from_documents(
                 documents=chunks,
                 embedding=embeddings,
-                client=supabase,
+                client=get_supabase(),
                 table_name="documents",
                 query_name="match_documents" 
             )
@@ -0,0 +1,419 @@
+import os
+import re
+import time
+import random
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+from app.core.timing import span
+from app.core.metrics import (
+    LLM_QUEUE_WAIT, LLM_QUEUE_POSITION, LLM_RETRIES, LLM_QUEUE_TIMEOUTS, is_rate_limit_error
+)
+
+# Gemini quota for the project. Enforced per process: chat, PDF import and summaries share the
+# server's buckets; a parse_* script is a separate process and gets its own, smaller share
+# (GEMINI_SCRIPT_RPM / GEMINI_SCRIPT_TPM) so it can run next to the server without going over.
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "15"))
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "1000000"))
+GEMINI_SCRIPT_RPM = float(os.getenv("GEMINI_SCRIPT_RPM", "5"))
+GEMINI_SCRIPT_TPM = float(os.getenv("GEMINI_SCRIPT_TPM", "250000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_RETRY_BASE = 1.0 # Backoff without a retry hint: ~1s, 2s, 4s, 8s (jittered)
+LLM_RETRY_CAP = 60.0
+LLM_EXPECTED_OUTPUT_TOKENS = 800 # Reserved per call until usage_metadata tells us the real cost
+IMAGE_TOKENS = 258 # Gemini bills an image / PDF page at a flat ~258 tokens
+
+# Priority classes: lower runs first
+PRIORITY_CHAT = 0
+PRIORITY_INTERACTIVE = 1 # A user is waiting on it, but not mid-turn (character PDF import)
+PRIORITY_BACKGROUND = 2 # Summaries, ingestion / parse scripts
+PRIORITY_NAMES = {PRIORITY_CHAT: "chat", PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+# Longest a call may wait for quota (queue + backoff) before giving up; None = wait as long as it takes
+MAX_WAIT = {
+    PRIORITY_CHAT: float(os.getenv("LLM_MAX_QUEUE_WAIT", "45")),
+    PRIORITY_INTERACTIVE: float(os.getenv("LLM_MAX_QUEUE_WAIT_INTERACTIVE", "120")),
+    PRIORITY_BACKGROUND: None,
+}
+
+_RETRY_HINT = re.compile(r"retry(?:[ _-]?delay|[ _-]?after| in)?[\"':=\s]*(\d+(?:\.\d+)?)\s*(ms|s)?", re.IGNORECASE)
+
+class LLMQueueTimeout(Exception):
+    """
+    No Gemini quota became available within the priority's MAX_WAIT.
+    """
+
+def estimate_request_tokens(messages: list, expected_output: int = LLM_EXPECTED_OUTPUT_TOKENS) -> int:
+    """
+    Rough prompt size of a LangChain message list (~4 chars per token, images at a flat rate) + expected output.
+    """
+    chars, images = 0, 0
+    for msg in messages:
+        content = getattr(msg, "content", msg)
+        blocks = content if isinstance(content, list) else [content]
+        for block in blocks:
+            if isinstance(block, str):
+                chars += len(block)
+            elif isinstance(block, dict) and block.get("type") == "text":
+                chars += len(block.get("text", ""))
+            else:
+                images += 1
+    return chars // 4 + images * IMAGE_TOKENS + expected_output
+
+def usage_tokens(result: Any) -> Optional[int]:
+    usage = getattr(result, "usage_metadata", None)
+    if not usage:
+        return None
+    if isinstance(usage, dict):
+        return (usage.get("input_tokens", 0) or 0) + (usage.get("output_tokens", 0) or 0)
+    # google-generativeai response (prompt_token_count / candidates_token_count)
+    return getattr(usage, "total_token_count", None)
+
+def retry_after_seconds(e: Exception) -> Optional[float]:
+    """
+    Server-suggested delay: a Retry-After header, or the retryDelay / "Please retry in 23.4s" in Gemini's 429 body.
+    """
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        try:
+            value = headers.get("retry-after")
+            if value:
+                return float(value)
+        except (TypeError, ValueError):
+            pass
+    match = _RETRY_HINT.search(str(e))
+    if match:
+        seconds = float(match.group(1))
+        return seconds / 1000 if (match.group(2) or "").lower() == "ms" else seconds
+    return None
+
+class TokenBucket:
+    """
+    Refills `per_minute` units per minute up to `capacity` (one minute's worth by default).
+    May go negative when a call turns out bigger than estimated; later calls then wait it off.
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        Seconds until `amount` is available (0 if it is now).
+        """
+        self._refill(now)
+        amount = min(amount, self.capacity) # A call bigger than the bucket still goes once it is full
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        self.tokens = min(self.capacity, self.tokens + delta)
+
+class _Waiter:
+    __slots__ = ("priority", "key", "tokens", "enqueued", "granted", "wake")
+
+    def __init__(self, priority: int, key: str, tokens: int, wake: Callable[[], None]):
+        self.priority = priority
+        self.key = key
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.wake = wake
+
+class LLMScheduler:
+    """
+    Central admission control for Gemini calls.
+    Every call waits for a request slot (RPM bucket) and its estimated tokens (TPM bucket).
+    Waiters are served by priority class, and round-robin across keys (campaigns) inside a class,
+    so one busy table can't starve the others. A 429 pauses all dispatching for the server's
+    suggested delay (or a jittered backoff) and the call is retried, so bursts delay turns instead
+    of dropping them. Thread-safe: async callers (chat) and threads (PDF import) share it.
+    The buckets live in this process only; other processes (scripts) need their own, see script_scheduler().
+    """
+
+    def __init__(self, rpm: float = GEMINI_RPM, tpm: float = GEMINI_TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._queues: Dict[int, OrderedDict] = {p: OrderedDict() for p in PRIORITY_NAMES} # priority -> key -> deque[_Waiter]
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._timer_due = 0.0
+        self.paused_until = 0.0
+        self.granted = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.timeouts = 0
+
+    # --- Queue / dispatch (all under self._lock) ---
+
+    def _depth(self, priority: Optional[int] = None) -> int:
+        queues = [self._queues[priority]] if priority is not None else self._queues.values()
+        return sum(len(waiters) for q in queues for waiters in q.values())
+
+    def _enqueue(self, waiter: _Waiter) -> int:
+        # Position = calls that will be served first (same or higher priority already waiting)
+        position = sum(self._depth(p) for p in PRIORITY_NAMES if p <= waiter.priority)
+        self._queues[waiter.priority].setdefault(waiter.key, deque()).append(waiter)
+        return position
+
+    def _remove(self, waiter: _Waiter):
+        queue = self._queues[waiter.priority]
+        waiters = queue.get(waiter.key)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del queue[waiter.key]
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        for priority in sorted(self._queues):
+            queue = self._queues[priority]
+            if queue:
+                return queue[next(iter(queue))][0]
+        return None
+
+    def _pop(self, waiter: _Waiter):
+        # Round-robin: the key goes to the back of its class once served
+        queue = self._queues[waiter.priority]
+        waiters = queue.pop(waiter.key)
+        waiters.popleft()
+        if waiters:
+            queue[waiter.key] = waiters
+
+    def _dispatch(self):
+        with self._lock:
+            while True:
+                waiter = self._next_waiter()
+                if waiter is None:
+                    return
+                now = time.monotonic()
+                # Strict head-of-line: background work never jumps ahead of a waiting chat turn
+                delay = max(self.paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(waiter.tokens, now))
+                if delay > 0:
+                    self._schedule(delay)
+                    return
+                self.requests.take(1)
+                self.tokens.take(waiter.tokens)
+                self._pop(waiter)
+                waiter.granted = True
+                self.granted += 1
+                waiter.wake()
+
+    def _schedule(self, delay: float):
+        now = time.monotonic()
+        due = now + delay
+        # A pending timer that fires sooner will re-dispatch anyway (one that already fired is the caller)
+        if self._timer is not None and now < self._timer_due <= due:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._dispatch)
+        self._timer.daemon = True
+        self._timer_due = due
+        self._timer.start()
+
+    def _observe(self, waiter: _Waiter, position: int):
+        name = PRIORITY_NAMES[waiter.priority]
+        LLM_QUEUE_WAIT.labels(name).observe(time.monotonic() - waiter.enqueued)
+        LLM_QUEUE_POSITION.labels(name).observe(position)
+
+    def _timed_out(self, waiter: _Waiter):
+        with self._lock:
+            if waiter.granted:
+                return # Granted just as the wait expired: take it
+            self._remove(waiter)
+        self.timeouts += 1
+        LLM_QUEUE_TIMEOUTS.labels(PRIORITY_NAMES[waiter.priority]).inc()
+        raise LLMQueueTimeout(f"Gemini quota busy: no slot within the {PRIORITY_NAMES[waiter.priority]} wait limit")
+
+    # --- Admission ---
+
+    async def acquire(self, priority: int = PRIORITY_CHAT, key: str = "global", tokens: int = LLM_EXPECTED_OUTPUT_TOKENS, timeout: Optional[float] = None) -> int:
+        """
+        Waits for quota. Returns the tokens reserved (pass them to settle() once the call is done).
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        wake = lambda: loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+        waiter = _Waiter(priority, key or "global", tokens, wake)
+        with self._lock:
+            position = self._enqueue(waiter)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._timed_out(waiter)
+        except asyncio.CancelledError:
+            self._release(waiter)
+            raise
+        self._observe(waiter, position)
+        return waiter.tokens
+
+    def acquire_sync(self, priority: int = PRIORITY_BACKGROUND, key: str = "global", tokens: int = LLM_EXPECTED_OUTPUT_TOKENS, timeout: Optional[float] = None) -> int:
+        """
+        Blocking acquire() for threads (threadpool endpoints, CLI scripts).
+        """
+        event = threading.Event()
+        waiter = _Waiter(priority, key or "global", tokens, event.set)
+        with self._lock:
+            position = self._enqueue(waiter)
+        self._dispatch()
+        if not event.wait(timeout):
+            self._timed_out(waiter)
+        self._observe(waiter, position)
+        return waiter.tokens
+
+    def _release(self, waiter: _Waiter):
+        # Cancelled caller: leave the queue, or hand back quota it was granted but never used
+        with self._lock:
+            if waiter.granted:
+                self.requests.adjust(1)
+                self.tokens.adjust(waiter.tokens)
+            else:
+                self._remove(waiter)
+        self._dispatch()
+
+    def settle(self, reserved: int, actual: Optional[int]):
+        """
+        Replaces the reservation with the real token count from usage_metadata.
+        """
+        if actual is None:
+            return
+        with self._lock:
+            self.tokens.adjust(reserved - actual)
+
+    def _backoff(self, e: Exception, attempt: int, priority: int) -> float:
+        """
+        Pauses every caller after a 429 (the quota is per project, not per call). Returns the delay.
+        """
+        hint = retry_after_seconds(e)
+        if hint is not None:
+            delay = hint + random.uniform(0, min(hint * 0.25, 5.0)) # Spread retries past the window
+        else:
+            ceiling = min(LLM_RETRY_CAP, LLM_RETRY_BASE * (2 ** attempt))
+            delay = ceiling / 2 + random.uniform(0, ceiling / 2)
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self.retries += 1
+            self.rate_limited += 1
+        LLM_RETRIES.labels(PRIORITY_NAMES[priority]).inc()
+        print(f"Gemini rate limited, retry {attempt + 1}/{LLM_MAX_RETRIES} in {delay:.1f}s")
+        return delay
+
+    def _remaining(self, deadline: Optional[float]) -> Optional[float]:
+        return None if deadline is None else max(deadline - time.monotonic(), 0.0)
+
+    # --- Call wrappers ---
+
+    async def run(self, call: Callable[[], Awaitable[Any]], priority: int = PRIORITY_CHAT, key: Optional[str] = None, tokens: int = LLM_EXPECTED_OUTPUT_TOKENS) -> Any:
+        """
+        Runs `call()` (a coroutine factory, e.g. lambda: llm.ainvoke(messages)) under the quota,
+        retrying 429s. Raises LLMQueueTimeout or the last 429 if the wait limit runs out.
+        """
+        max_wait = MAX_WAIT[priority]
+        deadline = None if max_wait is None else time.monotonic() + max_wait
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            with span("llm_queue"):
+                reserved = await self.acquire(priority, key, tokens, self._remaining(deadline))
+            try:
+                result = await call()
+            except Exception as e:
+                self.settle(reserved, 0) # The call didn't consume tokens, the request slot stays spent
+                if not is_rate_limit_error(e) or attempt == LLM_MAX_RETRIES:
+                    raise
+                delay = self._backoff(e, attempt, priority)
+                if deadline is not None and time.monotonic() + delay > deadline:
+                    raise
+                continue
+            self.settle(reserved, usage_tokens(result))
+            return result
+
+    async def stream(self, make_stream: Callable[[], Any], priority: int = PRIORITY_CHAT, key: Optional[str] = None, tokens: int = LLM_EXPECTED_OUTPUT_TOKENS):
+        """
+        Async-generator variant of run() for llm.astream(). A 429 is only retried before the first
+        chunk; once tokens have reached the player the error propagates.
+        """
+        max_wait = MAX_WAIT[priority]
+        deadline = None if max_wait is None else time.monotonic() + max_wait
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            with span("llm_queue"):
+                reserved = await self.acquire(priority, key, tokens, self._remaining(deadline))
+            started, used = False, 0
+            try:
+                async for chunk in make_stream():
+                    started = True
+                    used += usage_tokens(chunk) or 0 # Streamed usage arrives as per-chunk deltas
+                    yield chunk
+            except Exception as e:
+                self.settle(reserved, used)
+                if started or not is_rate_limit_error(e) or attempt == LLM_MAX_RETRIES:
+                    raise
+                delay = self._backoff(e, attempt, priority)
+                if deadline is not None and time.monotonic() + delay > deadline:
+                    raise
+                continue
+            self.settle(reserved, used or None)
+            return
+
+    def run_sync(self, call: Callable[[], Any], priority: int = PRIORITY_BACKGROUND, key: Optional[str] = None, tokens: int = LLM_EXPECTED_OUTPUT_TOKENS) -> Any:
+        """
+        Blocking run() for threads and scripts (e.g. lambda: llm.invoke([msg])).
+        """
+        max_wait = MAX_WAIT[priority]
+        deadline = None if max_wait is None else time.monotonic() + max_wait
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            reserved = self.acquire_sync(priority, key, tokens, self._remaining(deadline))
+            try:
+                result = call()
+            except Exception as e:
+                self.settle(reserved, 0)
+                if not is_rate_limit_error(e) or attempt == LLM_MAX_RETRIES:
+                    raise
+                delay = self._backoff(e, attempt, priority)
+                if deadline is not None and time.monotonic() + delay > deadline:
+                    raise
+                continue
+            self.settle(reserved, usage_tokens(result))
+            return result
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            self.requests._refill(now)
+            self.tokens._refill(now)
+            return {
+                "queued": {name: self._depth(p) for p, name in PRIORITY_NAMES.items()},
+                "campaigns_waiting": len(self._queues[PRIORITY_CHAT]),
+                "rpm_limit": self.requests.capacity,
+                "tpm_limit": self.tokens.capacity,
+                "requests_available": round(self.requests.tokens, 2),
+                "tokens_available": round(self.tokens.tokens),
+                "paused_for_seconds": round(max(self.paused_until - now, 0.0), 2),
+                "granted": self.granted,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "timeouts": self.timeouts,
+            }
+
+def script_scheduler() -> LLMScheduler:
+    """
+    Scheduler for a standalone script. Nothing coordinates it with the server's buckets, so the
+    shares have to add up to the project quota: while a script runs next to the server, give the
+    server GEMINI_RPM minus GEMINI_SCRIPT_RPM (e.g. 10 + 5 on a 15 RPM key). Without a server running,
+    GEMINI_SCRIPT_RPM can take the whole quota.
+    """
+    return LLMScheduler(rpm=GEMINI_SCRIPT_RPM, tpm=GEMINI_SCRIPT_TPM)
+
+# Singleton instance
+llm_scheduler = LLMScheduler()
@@ -0,0 +1,120 @@
+import os
+import re
+import json
+import unicodedata
+from difflib import SequenceMatcher
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+# Spanish -> English item names captured by the PHB 2024 ingestion (parse_items_phb24.py)
+ITEM_ALIASES_PATH = os.path.join(os.path.dirname(__file__), "..", "scripts", "items_phb24_aliases_es.json")
+
+FUZZY_CANDIDATES = 10 # Trigram pre-filter: best N names get the (slower) edit-distance score
+FUZZY_MIN_SCORE = 0.85 # Edit similarity needed for a fuzzy hit
+FUZZY_MIN_MARGIN = 0.05 # ...and how far ahead of the runner-up it must be
+CONTAINED_MIN_LENGTH = 4 # "goblin ac" -> "goblin", but never match short names like "orb" inside prose
+CONTAINED_MAX_WORDS = 5
+CONTAINED_MIN_COVERAGE = 0.5 # Name must be at least half the query's words to skip semantic search ("goblin ac")
+MENTIONED_SIMILARITY = 0.9 # Score of a name merely mentioned in a longer query ("spell to light a torch")
+
+def normalize_name(text: str) -> str:
+    """
+    Accent and case folding: "Espadón  Larga!" -> "espadon larga".
+    """
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text.casefold())
+    return re.sub(r"\s+", " ", text).strip()
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def load_item_aliases() -> Dict[str, str]:
+    try:
+        with open(ITEM_ALIASES_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"WARNING: Item aliases not loaded ({e})")
+        return {}
+
+class NameIndex:
+    """
+    Normalized-name lookup for one compendium table.
+    Resolution order: exact name/alias -> name contained in the query -> trigram fuzzy match.
+    A contained name only counts as a confident hit when it makes up most of the query; otherwise
+    it is a "mentioned" hit, to be merged with semantic results rather than replace them.
+    """
+
+    def __init__(self, rows: List[dict], aliases: Optional[Dict[str, str]] = None):
+        self.rows = rows
+        self.exact: Dict[str, int] = {}
+        self.postings = defaultdict(set)
+        self.grams: Dict[str, set] = {}
+
+        for i, row in enumerate(rows):
+            key = normalize_name(row.get("name") or "")
+            if key and key not in self.exact:
+                self.exact[key] = i
+
+        for alias, target in (aliases or {}).items():
+            i = self.exact.get(normalize_name(target))
+            key = normalize_name(alias)
+            if i is not None and key and key not in self.exact:
+                self.exact[key] = i
+
+        for key in self.exact:
+            grams = trigrams(key)
+            self.grams[key] = grams
+            for g in grams:
+                self.postings[g].add(key)
+
+    def lookup(self, query: str, include_mentions: bool = False) -> Optional[dict]:
+        """
+        Returns {**row, "similarity": score, "match": kind} for a confident name hit, else None.
+        With include_mentions, a name inside a longer query comes back as match "mentioned" instead of None.
+        """
+        q = normalize_name(query)
+        if not q:
+            return None
+
+        # 1. Exact name or alias
+        i = self.exact.get(q)
+        if i is not None:
+            return {**self.rows[i], "similarity": 1.0, "match": "exact"}
+
+        # 2. Longest known name appearing as whole words in the query ("fireball damage")
+        words = q.split()
+        best_key = None
+        for n in range(min(CONTAINED_MAX_WORDS, len(words)), 0, -1):
+            for start in range(len(words) - n + 1):
+                key = " ".join(words[start:start + n])
+                if len(key) >= CONTAINED_MIN_LENGTH and key in self.exact:
+                    best_key = key
+                    break
+            if best_key:
+                break
+        mentioned = None
+        if best_key:
+            if len(best_key.split()) / len(words) >= CONTAINED_MIN_COVERAGE:
+                return {**self.rows[self.exact[best_key]], "similarity": 0.95, "match": "contained"}
+            mentioned = {**self.rows[self.exact[best_key]], "similarity": MENTIONED_SIMILARITY, "match": "mentioned"}
+
+        # 3. Fuzzy (typos, plurals): trigram Jaccard picks candidates, edit similarity decides
+        q_grams = trigrams(q)
+        candidates = set()
+        for g in q_grams:
+            candidates |= self.postings.get(g, set())
+        shortlist = sorted(
+            ((len(q_grams & self.grams[k]) / len(q_grams | self.grams[k]), k) for k in candidates),
+            reverse=True,
+        )[:FUZZY_CANDIDATES]
+        scored = sorted(((SequenceMatcher(None, q, k).ratio(), k) for _, k in shortlist), reverse=True)
+        if not scored:
+            return mentioned if include_mentions else None
+        best_score, key = scored[0]
+        # Runner-up must be a different entity (an alias of the same row is not competition)
+        runner_up = next((score for score, k in scored[1:] if self.exact[k] != self.exact[key]), 0.0)
+        if best_score >= FUZZY_MIN_SCORE and best_score - runner_up >= FUZZY_MIN_MARGIN:
+            return {**self.rows[self.exact[key]], "similarity": round(best_score, 4), "match": "fuzzy"}
+        return mentioned if include_mentions else None
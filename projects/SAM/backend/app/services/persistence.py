@@ -0,0 +1,148 @@
+import os
+import asyncio
+from collections import deque
+from datetime import datetime, timezone
+from typing import List, Optional
+from postgrest.types import ReturnMethod
+from app.core.database import get_async_supabase
+
+# Write-behind settings for chat messages
+MESSAGE_QUEUE_MAX = int(os.getenv("MESSAGE_QUEUE_MAX", "1000")) # Beyond this, callers wait (backpressure)
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "50"))
+MESSAGE_FLUSH_INTERVAL = float(os.getenv("MESSAGE_FLUSH_INTERVAL", "0.05")) # Seconds to wait for a batch to fill
+MESSAGE_MAX_RETRIES = int(os.getenv("MESSAGE_MAX_RETRIES", "5"))
+MESSAGE_RETRY_BASE = 0.5 # Backoff: 0.5s, 1s, 2s, 4s, ...
+DEAD_LETTER_SIZE = 100
+
+class MessageWriter:
+    """
+    Bounded write-behind queue for the 'messages' table.
+    Turns enqueue rows and return immediately; one worker batches rows from all concurrent turns
+    into a single insert, flushing on size or time. A single FIFO worker that retries a batch before
+    moving on keeps every campaign's messages in order (created_at is stamped at enqueue time, so
+    rows in one insert keep their relative order too).
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None # Created inside the running loop
+        self._worker: Optional[asyncio.Task] = None
+        self.in_flight = 0
+        self.batches = 0
+        self.rows_written = 0
+        self.retries = 0
+        self.dropped = 0
+        self.dead_letters = deque(maxlen=DEAD_LETTER_SIZE) # Rows given up on, kept for inspection
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=MESSAGE_QUEUE_MAX)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    def start(self):
+        self._ensure_started()
+
+    async def drain(self, timeout: float = 10.0) -> bool:
+        """
+        Waits until every queued row is written (or given up on). Admin commands that wipe or
+        restore 'messages' call this first, so rows queued before them don't land afterwards.
+        """
+        if self._queue is None or self._worker is None:
+            return True
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def stop(self, timeout: float = 10.0):
+        """
+        Flushes what is queued (server shutdown), then stops the worker.
+        """
+        if self._queue is None or self._worker is None:
+            return
+        if not await self.drain(timeout):
+            print(f"WARNING: Message queue not drained on shutdown ({self._queue.qsize()} rows lost)")
+        self._worker.cancel()
+
+    async def enqueue(self, payload: dict):
+        """
+        Queues one message row. Waits only if the queue is full.
+        """
+        self._ensure_started()
+        payload.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+        await self._queue.put(payload)
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _next_batch(self) -> List[dict]:
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + MESSAGE_FLUSH_INTERVAL
+        while len(batch) < MESSAGE_BATCH_SIZE:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _insert(self, rows: List[dict]):
+        db = await get_async_supabase()
+        # Rows may have different keys (user vs. assistant): missing columns take their defaults
+        await db.table("messages").insert(rows, returning=ReturnMethod.minimal, default_to_null=False).execute()
+        self.batches += 1
+        self.rows_written += len(rows)
+
+    async def _write(self, batch: List[dict]):
+        for attempt in range(MESSAGE_MAX_RETRIES + 1):
+            try:
+                await self._insert(batch)
+                return
+            except Exception as e:
+                if attempt == MESSAGE_MAX_RETRIES:
+                    print(f"FAILED TO SAVE {len(batch)} MESSAGES after {attempt + 1} attempts: {e}")
+                    await self._isolate(batch)
+                    return
+                delay = MESSAGE_RETRY_BASE * (2 ** attempt)
+                self.retries += 1
+                print(f"WARNING: Message insert failed ({e}), retrying in {delay:g}s")
+                await asyncio.sleep(delay)
+
+    async def _isolate(self, batch: List[dict]):
+        # One bad row (e.g. a constraint violation) must not take the rest of the batch with it
+        for row in batch:
+            try:
+                await self._insert([row])
+            except Exception as e:
+                print(f"FAILED TO SAVE MESSAGE ({row.get('role')}, campaign {row.get('campaign_id')}): {e}")
+                self.dropped += 1
+                self.dead_letters.append(row)
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            self.in_flight = len(batch)
+            try:
+                await self._write(batch)
+            finally:
+                self.in_flight = 0
+                for _ in batch:
+                    self._queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth(),
+            "in_flight": self.in_flight,
+            "max_depth": MESSAGE_QUEUE_MAX,
+            "batches": self.batches,
+            "rows_written": self.rows_written,
+            "avg_batch": round(self.rows_written / self.batches, 2) if self.batches else 0.0,
+            "retries": self.retries,
+            "dropped": self.dropped,
+        }
+
+# Singleton instance
+message_writer = MessageWriter()
@@ -0,0 +1,105 @@
+import re
+from dataclasses import dataclass, field, asdict
+from typing import Callable, List, Optional
+
+# Corpora in the 'documents' table
+CORPUS_CAMPAIGN = "campaign_module" # metadata.type = 'campaign_module' (IngestionService)
+CORPUS_RULEBOOKS = "rulebooks" # everything ingested by scripts/ingest.py
+ALL_CORPORA = [CORPUS_CAMPAIGN, CORPUS_RULEBOOKS]
+
+@dataclass
+class RetrievalDecision:
+    needed: bool
+    corpora: List[str] = field(default_factory=list)
+    rule: str = "default"
+    reason: str = ""
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+# A rule looks at the turn and either decides (returns a RetrievalDecision) or passes (None)
+RetrievalRule = Callable[[str], Optional[RetrievalDecision]]
+
+SHORT_REPLIES = {
+    "yes", "no", "ok", "okay", "sure", "yep", "nope", "continue", "go on", "go", "next", "thanks", "thank you",
+    "si", "sí", "vale", "dale", "claro", "sigue", "continua", "continúa", "gracias", "listo", "bueno", "ya",
+}
+RULES_KEYWORDS = re.compile(
+    r"\b(rule|rules|how does|how do|can i|spell|cast|concentration|advantage|disadvantage|saving throw|"
+    r"condition|grapple|opportunity attack|cover|regla|reglas|como funciona|cómo funciona|puedo|hechizo|"
+    r"conjuro|lanzar|concentraci[oó]n|ventaja|desventaja|tirada de salvaci[oó]n|condici[oó]n|agarr)",
+    re.IGNORECASE,
+)
+LORE_KEYWORDS = re.compile(
+    r"\b(who|where|what happened|history|lore|legend|town|village|city|npc|quest|map|dungeon|tavern|king|queen|"
+    r"qui[eé]n|d[oó]nde|qu[eé] pas[oó]|historia|leyenda|pueblo|aldea|ciudad|misi[oó]n|mapa|mazmorra|taberna|rey|reina)",
+    re.IGNORECASE,
+)
+
+def system_event_rule(text: str) -> Optional[RetrievalDecision]:
+    # Dice results and other machine events never need lore
+    if text.lstrip().startswith("[SYSTEM EVENT]"):
+        return RetrievalDecision(False, [], "system_event", "Dice/system event")
+    return None
+
+def short_reply_rule(text: str) -> Optional[RetrievalDecision]:
+    normalized = re.sub(r"[^\w\sáéíóúñ]", "", text.strip().lower())
+    if normalized in SHORT_REPLIES or (len(normalized) <= 3 and "?" not in text):
+        return RetrievalDecision(False, [], "short_reply", "Acknowledgement or very short reply")
+    return None
+
+def topic_rule(text: str) -> Optional[RetrievalDecision]:
+    wants_rules = bool(RULES_KEYWORDS.search(text))
+    wants_lore = bool(LORE_KEYWORDS.search(text))
+    if wants_rules and not wants_lore:
+        return RetrievalDecision(True, [CORPUS_RULEBOOKS], "topic", "Rules question")
+    if wants_lore and not wants_rules:
+        return RetrievalDecision(True, [CORPUS_CAMPAIGN], "topic", "World/lore question")
+    return None
+
+DEFAULT_RULES: List[RetrievalRule] = [system_event_rule, short_reply_rule, topic_rule]
+
+class RetrievalGate:
+    """
+    Cheap, local per-turn classifier: does this turn need RAG, and from which corpora?
+    Rules run in order; the first one that returns a decision wins.
+    """
+
+    def __init__(self, rules: Optional[List[RetrievalRule]] = None):
+        self.rules: List[RetrievalRule] = list(rules if rules is not None else DEFAULT_RULES)
+
+    def register(self, rule: RetrievalRule, first: bool = True):
+        """Adds a custom rule (by default ahead of the built-in ones)."""
+        if first:
+            self.rules.insert(0, rule)
+        else:
+            self.rules.append(rule)
+
+    def decide(self, user_input: str) -> RetrievalDecision:
+        for rule in self.rules:
+            try:
+                decision = rule(user_input)
+            except Exception as e:
+                print(f"Retrieval rule {getattr(rule, '__name__', rule)} failed: {e}")
+                continue
+            if decision is not None:
+                return decision
+        return RetrievalDecision(True, list(ALL_CORPORA), "default", "General turn")
+
+def filter_corpora(docs: List[dict], corpora: List[str], campaign_id: Optional[str] = None) -> List[dict]:
+    """
+    Keeps only the documents that belong to the selected corpora.
+    Campaign module chunks must also belong to this campaign (never another party's module).
+    """
+    kept = []
+    for doc in docs:
+        metadata = doc.get("metadata") or {}
+        if metadata.get("campaign_id"):
+            if CORPUS_CAMPAIGN in corpora and campaign_id and metadata.get("campaign_id") == campaign_id:
+                kept.append(doc)
+        elif CORPUS_RULEBOOKS in corpora:
+            kept.append(doc)
+    return kept
+
+# Singleton instance
+retrieval_gate = RetrievalGate()
@@ -0,0 +1,69 @@
+from langchain_core.tools import tool
+from typing import List, Dict, Optional, Union
+from app.services.combat import combat_engine, current_campaign_id, format_summary
+
+# Encounter tools act on the campaign of the current chat turn (current_campaign_id, set by AIHelper),
+# so the model never has to pass ids around.
+
+def _campaign() -> str:
+    campaign_id = current_campaign_id.get()
+    if not campaign_id:
+        raise ValueError("No campaign for this chat: combat tracking is unavailable.")
+    return campaign_id
+
+@tool
+async def start_encounter(monsters: List[Dict[str, Union[str, int]]], players: Optional[List[Dict[str, Union[str, int]]]] = None) -> str:
+    """
+    Starts tracking a combat encounter: initiative order, monster HP/AC from the compendium, rounds and turns.
+    USE THIS TOOL once initiative has been rolled.
+    
+    Args:
+        monsters: Monsters by compendium name, e.g. [{'name': 'Goblin', 'count': 3}]. Add 'hp'/'ac' for homebrew monsters.
+        players: Player characters with their initiative rolls, e.g. [{'name': 'Thorin', 'initiative': 14, 'ac': 16}].
+        
+    Returns:
+        The initiative order and who acts first.
+    """
+    encounter = await combat_engine.start(_campaign(), monsters, players)
+    return "Encounter started.\n" + format_summary(encounter)
+
+@tool
+async def damage_combatant(target: str, amount: int = 0, add_conditions: Optional[List[str]] = None, remove_conditions: Optional[List[str]] = None) -> str:
+    """
+    Applies damage to a MONSTER in the current encounter (negative amount heals) and/or changes its conditions.
+    USE THIS TOOL whenever a monster takes damage. Player HP still goes through apply_damage.
+    
+    Args:
+        target: Combatant name as shown in COMBAT STATE, e.g. 'Goblin 2'.
+        amount: Damage dealt (negative to heal).
+        add_conditions: Conditions gained, e.g. ['prone'].
+        remove_conditions: Conditions that ended.
+        
+    Returns:
+        The HP math and whether the monster (or the whole fight) is down.
+    """
+    message, _ = await combat_engine.damage(_campaign(), target, amount, add_conditions, remove_conditions)
+    return message
+
+@tool
+async def next_turn() -> str:
+    """
+    Ends the current combatant's turn and advances the initiative order (skipping downed monsters).
+    USE THIS TOOL when the acting combatant has finished their turn.
+    
+    Returns:
+        Who acts next and the round number.
+    """
+    message, _ = await combat_engine.next_turn(_campaign())
+    return message
+
+@tool
+async def end_encounter() -> str:
+    """
+    Ends the current encounter (enemies fled, surrendered, or the party escaped).
+    Not needed when every monster is down: the encounter ends by itself.
+    """
+    message, _ = await combat_engine.end(_campaign())
+    return message
+
+COMBAT_TOOLS = [start_encounter, damage_combatant, next_turn, end_encounter]
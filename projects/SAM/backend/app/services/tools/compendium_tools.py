@@ -1,21 +1,48 @@
 
 from langchain_core.tools import tool
-from supabase import Client
 import os
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from app.core.database import get_supabase
+from app.services.embeddings import get_embeddings as get_cached_embeddings, COMPENDIUM_EMBEDDING_MODEL
+from app.services.compendium_index import compendium_index
 
-# Note: We need a Supabase Client instance.
-# Ideally, we inject dependencies, but for tools, we might need a global or closure.
-# For simplicity in this project, we create a fresh client or re-use if passed.
-
-def get_supabase() -> Client:
-    from supabase import create_client
-    url = os.getenv("SUPABASE_URL")
-    key = os.getenv("SUPABASE_KEY")
-    return create_client(url, key)
+# Tools share the process-wide pooled client (app.core.database), so a search
+# reuses warm keep-alive connections instead of opening a new TCP/TLS session.
 
 def get_embeddings():
-    return GoogleGenerativeAIEmbeddings(model="models/text-embedding-004", google_api_key=os.getenv("GOOGLE_API_KEY"))
+    # Shared embedder with the query cache (same "goblin AC" is only embedded once)
+    return get_cached_embeddings(COMPENDIUM_EMBEDDING_MODEL)
+
+def search_compendium(table_name: str, query: str, match_threshold: float = 0.5, match_count: int = 3) -> list:
+    """
+    Search over one compendium table.
+    1. Name fast path: "Fireball", "goblin AC", "Espada larga" resolve without any embedding call.
+    2. Semantic search: in-process index when loaded, otherwise the match_compendium RPC.
+       A name merely mentioned in a longer query ("monster like a wolf but bigger") leads the results
+       instead of replacing them.
+    """
+    named = compendium_index.lookup_name(table_name, query, include_mentions=True)
+    if named is not None and named["match"] != "mentioned":
+        return [named]
+
+    embeddings = get_embeddings()
+    vector = embeddings.embed_query(query)
+
+    matches = compendium_index.search(table_name, vector, match_threshold, match_count)
+    if matches is None:
+        # Call the RPC function defined in Postgres
+        supabase = get_supabase()
+        res = supabase.rpc("match_compendium", {
+            "query_embedding": vector,
+            "match_threshold": match_threshold,
+            "match_count": match_count,
+            "table_name": table_name
+        }).execute()
+        matches = res.data or []
+
+    if named is not None:
+        key = "id" if named.get("id") is not None else "name"
+        matches = [named] + [m for m in matches if m.get(key) != named.get(key)][:match_count - 1]
+    return matches
 
 @tool
 def search_spells(query: str) -> str:
@@ -24,24 +51,14 @@ def search_spells(query: str) -> str:
     Use this when the user asks about a specific spell (e.g. "How much damage does Fireball do?").
     """
     try:
-        supabase = get_supabase()
-        embeddings = get_embeddings()
-        vector = embeddings.embed_query(query)
-        
-        # Call the RPC function defined in Postgres
-        res = supabase.rpc("match_compendium", {
-            "query_embedding": vector,
-            "match_threshold": 0.5,
-            "match_count": 3,
-            "table_name": "spells"
-        }).execute()
+        matches = search_compendium("spells", query)
         
-        if not res.data:
+        if not matches:
             return "No matching spells found in the Compendium."
             
         # Format results
         output = "Spells Found:\n"
-        for item in res.data:
+        for item in matches:
             output += f"- {item['content']} (Similarity: {item['similarity']:.2f})\n"
         return output
     except Exception as e:
@@ -54,22 +71,13 @@ def search_monsters(query: str) -> str:
     Use this when the DM asks for monster stats (e.g. "What is a Goblin's AC?").
     """
     try:
-        supabase = get_supabase()
-        embeddings = get_embeddings()
-        vector = embeddings.embed_query(query)
-        
-        res = supabase.rpc("match_compendium", {
-            "query_embedding": vector,
-            "match_threshold": 0.5,
-            "match_count": 3,
-            "table_name": "monsters"
-        }).execute()
+        matches = search_compendium("monsters", query)
         
-        if not res.data:
+        if not matches:
             return "No matching monsters found."
             
         output = "Monsters Found:\n"
-        for item in res.data:
+        for item in matches:
             output += f"- {item['content']} (Similarity: {item['similarity']:.2f})\n"
         return output
     except Exception as e:
@@ -82,22 +90,13 @@ def search_items(query: str) -> str:
     Use this when asking about equipment stats (e.g. "Damage of a Longsword?").
     """
     try:
-        supabase = get_supabase()
-        embeddings = get_embeddings()
-        vector = embeddings.embed_query(query)
-        
-        res = supabase.rpc("match_compendium", {
-            "query_embedding": vector,
-            "match_threshold": 0.5,
-            "match_count": 3,
-            "table_name": "items"
-        }).execute()
+        matches = search_compendium("items", query)
         
-        if not res.data:
+        if not matches:
             return "No matching items found."
             
         output = "Items Found:\n"
-        for item in res.data:
+        for item in matches:
             output += f"- {item['content']} (Similarity: {item['similarity']:.2f})\n"
         return output
     except Exception as e:
@@ -1,5 +1,6 @@
 from langchain_core.tools import tool
 from typing import List, Dict, Optional, Union
+from app.core.dice_odds import odds
 
 @tool
 def apply_damage(current_hp: int, damage_amount: int) -> str:
@@ -66,4 +67,23 @@ def give_loot(money: Optional[Dict[str, int]] = None, items: Optional[List[Dict[
     import json
     return f"Loot Generated: {'; '.join(description)}. <LOOT>{json.dumps(loot_data)}</LOOT>"
 
-MECHANIC_TOOLS = [apply_damage, apply_healing, give_loot]
+@tool
+def dice_odds(expression: str, target: Optional[int] = None) -> str:
+    """
+    Computes the EXACT odds of a dice roll, e.g. the chance to meet a DC or hit an AC.
+    USE THIS TOOL whenever a player asks about their chances, or to set a fair DC. Never estimate odds yourself.
+    
+    Args:
+        expression: Dice notation with modifiers, e.g. '1d20+5', '2d20kh1+5' (advantage), '2d20kl1+5' (disadvantage), '8d6'.
+        target: The DC or AC the total must meet or beat (optional).
+        
+    Returns:
+        The probability of total >= target, plus the range, average and median.
+    """
+    result = odds(expression, target, include_distribution=False)
+    summary = f"{result['expression']}: range {result['min']}-{result['max']}, average {result['mean']:.1f}, median {result['median']}."
+    if target is not None:
+        summary = f"P({result['expression']} >= {target}) = {result['p_at_least']:.1%}. " + summary
+    return summary
+
+MECHANIC_TOOLS = [apply_damage, apply_healing, give_loot, dice_odds]
@@ -0,0 +1,124 @@
+import os
+import time
+import asyncio
+import threading
+from typing import Dict, List, Optional
+from langchain_core.tools import BaseTool
+from langchain_core.messages import ToolMessage
+from app.core.timing import current_timer
+from app.core.metrics import TOOL_CALLS, TOOL_LATENCY
+from app.services.tools.compendium_tools import ALL_TOOLS
+from app.services.tools.game_mechanics import MECHANIC_TOOLS
+from app.services.tools.combat_tools import COMBAT_TOOLS
+
+# Default per-tool timeout; compendium lookups hit the network, mechanics are pure math
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "15"))
+MECHANIC_TOOL_TIMEOUT_SECONDS = float(os.getenv("MECHANIC_TOOL_TIMEOUT_SECONDS", "5"))
+
+class ToolStats:
+    """
+    Per-tool counters: calls, errors, timeouts and latency (avg/max).
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, elapsed_ms: float, error: bool = False, timeout: bool = False):
+        with self._lock:
+            self.calls += 1
+            self.errors += 1 if error else 0
+            self.timeouts += 1 if timeout else 0
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def snapshot(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "avg_ms": round(self.total_ms / self.calls, 2) if self.calls else 0.0,
+            "max_ms": round(self.max_ms, 2),
+        }
+
+class ToolRegistry:
+    """
+    Name-keyed tool table + executor for one model step.
+    Independent calls from the same step run concurrently; results keep the original call order
+    (Gemini pairs each ToolMessage with its tool_call_id, but the transcript should stay readable).
+    """
+
+    def __init__(self, default_timeout: float = TOOL_TIMEOUT_SECONDS):
+        self.default_timeout = default_timeout
+        self.tools: Dict[str, BaseTool] = {}
+        self.timeouts: Dict[str, float] = {}
+        self.stats: Dict[str, ToolStats] = {}
+
+    def register(self, tools: List[BaseTool], timeout: Optional[float] = None):
+        for t in tools:
+            self.tools[t.name] = t
+            self.timeouts[t.name] = timeout if timeout is not None else self.default_timeout
+            self.stats.setdefault(t.name, ToolStats())
+
+    def get(self, name: str) -> Optional[BaseTool]:
+        return self.tools.get(name)
+
+    def all(self) -> List[BaseTool]:
+        return list(self.tools.values())
+
+    async def _run_one(self, tool_call: dict) -> ToolMessage:
+        tool_name = tool_call["name"]
+        tool_args = tool_call["args"]
+        tool_id = tool_call["id"]
+
+        print(f"Executing Tool: {tool_name} | Args: {tool_args}")
+
+        selected_tool = self.tools.get(tool_name)
+        if selected_tool is None:
+            TOOL_CALLS.labels(tool_name, "not_found").inc()
+            return ToolMessage(tool_call_id=tool_id, content=f"Error: Tool {tool_name} not found.")
+
+        timeout = self.timeouts[tool_name]
+        error, timed_out = False, False
+        timer = current_timer.get()
+        start = time.perf_counter()
+        try:
+            # Sync tools are run by LangChain in a worker thread, so they never block the event loop
+            tool_output = await asyncio.wait_for(selected_tool.ainvoke(tool_args), timeout=timeout)
+        except asyncio.TimeoutError:
+            error, timed_out = True, True
+            tool_output = f"Error executing tool: {tool_name} timed out after {timeout:g}s"
+        except Exception as e:
+            error = True
+            tool_output = f"Error executing tool: {e}"
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.stats[tool_name].record(elapsed_ms, error=error, timeout=timed_out)
+        TOOL_CALLS.labels(tool_name, "timeout" if timed_out else "error" if error else "ok").inc()
+        TOOL_LATENCY.labels(tool_name).observe(elapsed_ms / 1000)
+        if timer:
+            timer.add(f"tool:{tool_name}", elapsed_ms, start_ms=(start - timer.started) * 1000)
+        print(f"Tool {tool_name} finished in {elapsed_ms:.0f}ms{' (error)' if error else ''}")
+
+        return ToolMessage(tool_call_id=tool_id, content=str(tool_output))
+
+    async def execute(self, tool_calls: List[dict]) -> List[ToolMessage]:
+        """
+        Runs every tool call of one model step concurrently.
+        Never raises: failures and timeouts come back as error ToolMessages for the model to read.
+        """
+        if not tool_calls:
+            return []
+        return list(await asyncio.gather(*(self._run_one(tc) for tc in tool_calls)))
+
+    def get_stats(self) -> dict:
+        return {name: stats.snapshot() for name, stats in self.stats.items()}
+
+# Singleton instance (Compendium + Game Mechanics + Combat)
+tool_registry = ToolRegistry()
+tool_registry.register(ALL_TOOLS)
+tool_registry.register(MECHANIC_TOOLS, timeout=MECHANIC_TOOL_TIMEOUT_SECONDS)
+tool_registry.register(COMBAT_TOOLS) # Hit Supabase: default timeout
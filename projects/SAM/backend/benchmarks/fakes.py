@@ -0,0 +1,484 @@
+import re
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+import httpx
+import jwt
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Offline stand-ins for the three external services the backend talks to:
+#   Gemini chat  -> ScriptedChatModel (deterministic replies and tool calls, configurable latency)
+#   Embeddings   -> HashingEmbeddings (bag-of-words feature hashing: similar texts get similar vectors)
+#   Supabase     -> MemoryStore + MemoryTransport (the PostgREST subset the app uses, the RPCs, /auth/v1/user)
+
+EMBEDDING_DIM = 768
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+# --- Embeddings ---
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic embeddings without a model: each word adds +/-1 to a hashed dimension.
+    `latency` is slept once per request (batch or single), like a network round trip.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+        self.requests = 0
+        self.texts = 0
+        self._lock = threading.Lock()
+
+    def vector(self, text: str) -> List[float]:
+        v = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.casefold()):
+            h = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            v[h % self.dim] += 1.0 if (h >> 32) & 1 else -1.0
+        norm = np.linalg.norm(v)
+        return (v / norm if norm else v).tolist()
+
+    def _count(self, n: int):
+        with self._lock:
+            self.requests += 1
+            self.texts += n
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._count(len(texts))
+        time.sleep(self.latency)
+        return [self.vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._count(len(texts))
+        await asyncio.sleep(self.latency)
+        return [self.vector(t) for t in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+# --- Chat model ---
+
+# A script maps the conversation so far to the model's next message (text and/or tool calls)
+Script = Callable[[List[BaseMessage]], AIMessage]
+
+NARRATIVE = (
+    "The torchlight flickers across the damp stone as your party presses deeper into the ruin. "
+    "Somewhere ahead, water drips in a slow, patient rhythm, and the air tastes of iron and old smoke. "
+    "A goblin scout darts between the pillars, a rusted blade in its claw, and hisses a warning to its kin. "
+    "Roll for initiative if you mean to stop it before it reaches the barricade."
+)
+
+def default_dm_script(messages: List[BaseMessage]) -> AIMessage:
+    """
+    Rules questions trigger one compendium tool call, damage triggers a mechanics tool,
+    everything else is answered directly with narrative plus machine tags.
+    """
+    if messages and isinstance(messages[-1], ToolMessage):
+        return AIMessage(content=f"{NARRATIVE} The tome is clear on this: {messages[-1].content[:160]}")
+
+    player = next((m.content for m in reversed(messages) if isinstance(m, HumanMessage) and isinstance(m.content, str)), "")
+    lowered = player.casefold()
+    if "spell" in lowered or "hechizo" in lowered:
+        return _tool_call("search_spells", {"query": "Fireball"})
+    if "monster" in lowered or "goblin" in lowered:
+        return _tool_call("search_monsters", {"query": "Goblin"})
+    if "hit" in lowered or "damage" in lowered:
+        return _tool_call("apply_damage", {"current_hp": 20, "damage_amount": 7})
+    return AIMessage(content=f'{NARRATIVE} <UPDATE>{{"status": {{"hp_current": 14}}}}</UPDATE>')
+
+def _tool_call(name: str, args: dict) -> AIMessage:
+    return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:12]}", "type": "tool_call"}])
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    LangChain chat model driven by a Python script instead of Gemini.
+    `latency` is the time to first token per call; `token_latency` the gap between streamed words.
+    bind_tools() returns the model itself (the script decides which tools to call).
+    """
+
+    script: Script = default_dm_script
+    latency: float = 0.0
+    token_latency: float = 0.0
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _reply(self, messages: List[BaseMessage]) -> AIMessage:
+        self.calls += 1
+        reply = self.script(messages)
+        prompt_chars = sum(len(m.content) if isinstance(m.content, str) else 0 for m in messages)
+        output_tokens = len(reply.content) // 4 + 1 if isinstance(reply.content, str) else 1
+        reply.usage_metadata = {"input_tokens": prompt_chars // 4, "output_tokens": output_tokens, "total_tokens": prompt_chars // 4 + output_tokens}
+        return reply
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        reply = self._reply(messages)
+        if reply.tool_calls:
+            chunks = [{"name": tc["name"], "args": json.dumps(tc["args"]), "id": tc["id"], "index": i} for i, tc in enumerate(reply.tool_calls)]
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=chunks, usage_metadata=reply.usage_metadata))
+            return
+        words = re.findall(r"\S+\s*", reply.content)
+        for i, word in enumerate(words):
+            if i and self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            usage = reply.usage_metadata if i == len(words) - 1 else None
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word, usage_metadata=usage))
+
+# --- Supabase ---
+
+# Upsert conflict targets for tables whose key is not 'id'
+PRIMARY_KEYS = {"campaign_summaries": "campaign_id", "checkpoints": "name", "compendium_versions": "table_name"}
+RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+def _text(value: Any) -> str:
+    # How PostgREST compares a column to a filter literal
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+def _compare(value: Any, literal: str) -> Optional[int]:
+    if value is None:
+        return None
+    try:
+        a, b = float(value), float(literal)
+    except (TypeError, ValueError):
+        a, b = _text(value), literal
+    return (a > b) - (a < b)
+
+def _split_top_level(text: str) -> List[str]:
+    parts, depth, current = [], 0, ""
+    for ch in text:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0:
+            parts.append(current)
+            current = ""
+        else:
+            current += ch
+    if current:
+        parts.append(current)
+    return parts
+
+def _matches(row: dict, column: str, expression: str) -> bool:
+    negate = expression.startswith("not.")
+    if negate:
+        expression = expression[4:]
+    op, _, literal = expression.partition(".")
+    value = row.get(column)
+    if op == "eq":
+        result = _compare(value, literal) == 0
+    elif op == "neq":
+        result = value is not None and _compare(value, literal) != 0
+    elif op in ("gt", "gte", "lt", "lte"):
+        c = _compare(value, literal)
+        result = c is not None and {"gt": c > 0, "gte": c >= 0, "lt": c < 0, "lte": c <= 0}[op]
+    elif op == "is":
+        result = _text(value) == literal.lower()
+    elif op == "in":
+        options = [o.strip('"') for o in literal.strip("()").split(",")]
+        result = _text(value) in options
+    elif op in ("like", "ilike"):
+        # % / * match any run, _ one character, a backslash escapes the next character
+        pattern = "^" + "".join(
+            re.escape(tok[1:]) if tok.startswith("\\") else ".*" if tok in ("%", "*") else "." if tok == "_" else re.escape(tok)
+            for tok in re.findall(r"\\.|.", literal, re.DOTALL)
+        ) + "$"
+        result = re.match(pattern, _text(value), re.IGNORECASE if op == "ilike" else 0) is not None
+    else:
+        raise ValueError(f"Unsupported filter operator: {op}")
+    return not result if negate else result
+
+def _or_matches(row: dict, expression: str) -> bool:
+    for clause in _split_top_level(expression.strip("()")):
+        column, _, rest = clause.partition(".")
+        if _matches(row, column, rest):
+            return True
+    return False
+
+def _cosine(a, b) -> float:
+    a, b = np.asarray(a, dtype=np.float32), np.asarray(b, dtype=np.float32)
+    denom = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(a @ b / denom) if denom else 0.0
+
+class MemoryStore:
+    """
+    In-memory tables (lists of dicts) + the RPCs the backend calls. Thread-safe.
+    """
+
+    def __init__(self):
+        self.tables: Dict[str, List[dict]] = {}
+        self.requests: Counter = Counter() # "GET table:messages" -> count
+        self._lock = threading.Lock()
+        self.rpcs: Dict[str, Callable[[dict], List[dict]]] = {
+            "match_documents": self._match_documents,
+            "match_campaign_documents": self._match_campaign_documents,
+            "match_compendium": self._match_compendium,
+            "apply_character_events": self._apply_character_events,
+        }
+
+    def seed(self, table: str, rows: List[dict]):
+        with self._lock:
+            self.tables.setdefault(table, []).extend(self._with_defaults(table, r) for r in rows)
+
+    def _with_defaults(self, table: str, row: dict) -> dict:
+        row = dict(row)
+        if PRIMARY_KEYS.get(table, "id") == "id":
+            row.setdefault("id", str(uuid.uuid4()))
+        row.setdefault("created_at", _now())
+        return row
+
+    # --- PostgREST ---
+
+    def _filter(self, rows: List[dict], params: List[tuple]) -> List[dict]:
+        for key, value in params:
+            if key == "or":
+                rows = [r for r in rows if _or_matches(r, value)]
+            elif key not in RESERVED_PARAMS:
+                rows = [r for r in rows if _matches(r, key, value)]
+        return rows
+
+    @staticmethod
+    def _order(rows: List[dict], order: Optional[str]) -> List[dict]:
+        if not order:
+            return rows
+        for term in reversed(order.split(",")):
+            column, _, direction = term.partition(".")
+            desc = direction.startswith("desc")
+            present = sorted((r for r in rows if r.get(column) is not None), key=lambda r: r[column], reverse=desc)
+            rows = present + [r for r in rows if r.get(column) is None]
+        return rows
+
+    @staticmethod
+    def _project(rows: List[dict], select: Optional[str]) -> List[dict]:
+        columns = [c.strip() for c in (select or "*").split(",") if c.strip()]
+        if "*" in columns:
+            return [dict(r) for r in rows]
+        return [{c: r.get(c) for c in columns} for r in rows]
+
+    def select(self, table: str, params: List[tuple]) -> tuple:
+        query = dict(params)
+        with self._lock:
+            rows = self._filter(list(self.tables.get(table, [])), params)
+        total = len(rows)
+        rows = self._order(rows, query.get("order"))
+        offset = int(query.get("offset", 0))
+        limit = int(query["limit"]) if "limit" in query else None
+        rows = rows[offset:offset + limit if limit is not None else None]
+        return self._project(rows, query.get("select")), total
+
+    def insert(self, table: str, rows: List[dict], upsert: bool = False, on_conflict: Optional[str] = None) -> List[dict]:
+        key = on_conflict or PRIMARY_KEYS.get(table, "id")
+        out = []
+        with self._lock:
+            existing = self.tables.setdefault(table, [])
+            for row in rows:
+                current = next((r for r in existing if key in row and r.get(key) == row[key]), None) if upsert else None
+                if current is not None:
+                    current.update(row)
+                    out.append(dict(current))
+                else:
+                    new = self._with_defaults(table, row)
+                    existing.append(new)
+                    out.append(dict(new))
+        return out
+
+    def update(self, table: str, params: List[tuple], changes: dict) -> List[dict]:
+        with self._lock:
+            rows = self._filter(self.tables.get(table, []), params)
+            for r in rows:
+                r.update(changes)
+            return [dict(r) for r in rows]
+
+    def delete(self, table: str, params: List[tuple]) -> List[dict]:
+        with self._lock:
+            doomed = self._filter(self.tables.get(table, []), params)
+            ids = {id(r) for r in doomed}
+            self.tables[table] = [r for r in self.tables.get(table, []) if id(r) not in ids]
+            return [dict(r) for r in doomed]
+
+    # --- RPCs (same result shapes as the SQL functions) ---
+
+    def _rank(self, rows: List[dict], query_embedding, count: int) -> List[dict]:
+        scored = [(_cosine(r["embedding"], query_embedding), r) for r in rows if r.get("embedding") is not None]
+        scored.sort(key=lambda s: -s[0])
+        return [{"id": r["id"], "content": r.get("content"), "metadata": r.get("metadata"), "similarity": s} for s, r in scored[:count]]
+
+    def _match_documents(self, args: dict) -> List[dict]:
+        with self._lock:
+            docs = list(self.tables.get("documents", []))
+        hits = self._rank(docs, args["query_embedding"], len(docs))
+        return [h for h in hits if h["similarity"] > args.get("match_threshold", 0.5)][:args.get("match_count", 3)]
+
+    def _match_campaign_documents(self, args: dict) -> List[dict]:
+        with self._lock:
+            docs = list(self.tables.get("documents", []))
+        count = args.get("match_count", 3)
+        campaign = [d for d in docs if (d.get("metadata") or {}).get("campaign_id")]
+        hits = []
+        if args.get("include_campaign", True) and args.get("p_campaign_id"):
+            hits += self._rank([d for d in campaign if d["metadata"]["campaign_id"] == args["p_campaign_id"]], args["query_embedding"], count)
+        if args.get("include_rulebooks", True):
+            hits += self._rank([d for d in docs if not (d.get("metadata") or {}).get("campaign_id")], args["query_embedding"], count)
+        hits.sort(key=lambda h: -h["similarity"])
+        return [h for h in hits if h["similarity"] > args.get("match_threshold", 0.5)][:count]
+
+    def _match_compendium(self, args: dict) -> List[dict]:
+        with self._lock:
+            rows = list(self.tables.get(args["table_name"], []))
+        hits = self._rank(rows, args["query_embedding"], args.get("match_count", 3))
+        return [h for h in hits if h["similarity"] > args.get("match_threshold", 0.5)]
+
+    def _apply_character_events(self, args: dict) -> Optional[dict]:
+        # Same semantics as schema_character_events.sql (merge, then increments, then inventory)
+        def num(value, fallback=0):
+            try:
+                return float(value) if "." in str(value) else int(value)
+            except (TypeError, ValueError):
+                return fallback
+
+        with self._lock:
+            row = next((r for r in self.tables.get("characters", []) if r.get("id") == args["p_character_id"]), None)
+            if row is None:
+                return None
+            status = {**(row.get("status") or {}), **(args.get("p_set") or {})}
+            if args.get("p_xp"):
+                status["xp"] = max(0, num(status.get("xp")) + args["p_xp"])
+            if args.get("p_money"):
+                money = dict(status["money"]) if isinstance(status.get("money"), dict) else {}
+                for coin, amount in args["p_money"].items():
+                    money[coin] = max(0, num(money.get(coin)) + amount)
+                status["money"] = money
+            if args.get("p_items"):
+                inventory = [dict(i) for i in status["inventory"]] if isinstance(status.get("inventory"), list) else []
+                for item in args["p_items"]:
+                    if not item.get("item"):
+                        continue
+                    qty = max(1, num(item.get("qty"), 1))
+                    same = next((i for i in inventory if str(i.get("item", "")).lower() == item["item"].lower()), None)
+                    if same is None:
+                        inventory.append({"item": item["item"], "qty": qty, "weight": num(item.get("weight")), "notes": "Looted"})
+                    else:
+                        same["qty"] = num(same.get("qty"), 1) + qty
+                status["inventory"] = inventory
+            row["status"] = status
+            return dict(status)
+
+    # --- HTTP ---
+
+    def handle(self, request: httpx.Request, jwt_secret: Optional[str]) -> httpx.Response:
+        parts = [p for p in request.url.path.split("/") if p]
+        params = list(request.url.params.multi_items())
+        body = json.loads(request.content) if request.content else None
+
+        if parts[:2] == ["auth", "v1"] and parts[2:] == ["user"]:
+            return self._auth_user(request, jwt_secret)
+        if parts[:2] != ["rest", "v1"] or len(parts) < 3:
+            return httpx.Response(404, json={"message": f"Not served offline: {request.url.path}"})
+
+        if parts[2] == "rpc":
+            fn = self.rpcs.get(parts[3] if len(parts) > 3 else "")
+            self.requests[f"RPC {parts[3] if len(parts) > 3 else ''}"] += 1
+            if fn is None:
+                return httpx.Response(404, json={"code": "PGRST202", "message": f"Could not find the function {parts[3:]}"})
+            return httpx.Response(200, json=fn(body or {}))
+
+        table = parts[2]
+        self.requests[f"{request.method} {table}"] += 1
+        prefer = request.headers.get("prefer", "")
+        try:
+            if request.method in ("GET", "HEAD"):
+                rows, total = self.select(table, params)
+                headers = {"content-range": f"0-{max(len(rows) - 1, 0)}/{total}"} if "count=" in prefer else {}
+                return self._rows_response(request, rows, 200, headers)
+            if request.method == "POST":
+                rows = body if isinstance(body, list) else [body]
+                upsert = "resolution=merge-duplicates" in prefer
+                out = self.insert(table, rows, upsert=upsert, on_conflict=dict(params).get("on_conflict"))
+                return self._rows_response(request, out, 201)
+            if request.method == "PATCH":
+                return self._rows_response(request, self.update(table, params, body or {}), 200)
+            if request.method == "DELETE":
+                return self._rows_response(request, self.delete(table, params), 200)
+        except ValueError as e:
+            return httpx.Response(400, json={"message": str(e)})
+        return httpx.Response(405, json={"message": f"{request.method} not supported"})
+
+    def _rows_response(self, request: httpx.Request, rows: List[dict], status: int, headers: Optional[dict] = None) -> httpx.Response:
+        if "return=minimal" in request.headers.get("prefer", ""):
+            return httpx.Response(204 if status == 200 else status, headers=headers)
+        if "vnd.pgrst.object" in request.headers.get("accept", ""):
+            if len(rows) != 1:
+                return httpx.Response(406, json={"code": "PGRST116", "message": f"{len(rows)} rows returned"})
+            return httpx.Response(status, json=rows[0], headers=headers)
+        return httpx.Response(status, json=rows, headers=headers)
+
+    def _auth_user(self, request: httpx.Request, jwt_secret: Optional[str]) -> httpx.Response:
+        token = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+        try:
+            claims = jwt.decode(token, jwt_secret, algorithms=["HS256"], audience="authenticated")
+        except Exception as e:
+            return httpx.Response(401, json={"msg": str(e)})
+        return httpx.Response(200, json={
+            "id": claims["sub"], "aud": "authenticated", "role": "authenticated", "email": claims.get("email"),
+            "app_metadata": {}, "user_metadata": claims.get("user_metadata", {}), "created_at": _now(),
+        })
+
+class MemoryTransport(httpx.BaseTransport):
+    """
+    httpx transport answering Supabase requests from a MemoryStore, after `latency` seconds.
+    """
+
+    def __init__(self, store: MemoryStore, latency: float = 0.0, jwt_secret: Optional[str] = None):
+        self.store = store
+        self.latency = latency
+        self.jwt_secret = jwt_secret
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        time.sleep(self.latency)
+        request.read()
+        return self.store.handle(request, self.jwt_secret)
+
+class AsyncMemoryTransport(httpx.AsyncBaseTransport):
+    def __init__(self, store: MemoryStore, latency: float = 0.0, jwt_secret: Optional[str] = None):
+        self.store = store
+        self.latency = latency
+        self.jwt_secret = jwt_secret
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(self.latency)
+        await request.aread()
+        return self.store.handle(request, self.jwt_secret)
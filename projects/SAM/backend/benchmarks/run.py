@@ -0,0 +1,303 @@
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import itertools
+import contextlib
+from typing import Awaitable, Callable, Dict, List
+
+# Offline benchmark: boots the FastAPI app against a scripted chat model, hashing embeddings and an
+# in-memory Supabase (benchmarks/fakes.py), then drives the endpoints at a fixed concurrency.
+# No network, no Gemini quota, no Supabase project. Compare the numbers before/after a change in review.
+# Usage (from backend/): python -m benchmarks.run [--scenarios chat,roll,characters] [--requests 200] [--concurrency 16] [--json out.json]
+
+BENCH_SUPABASE_URL = "http://supabase.offline"
+BENCH_JWT_SECRET = "offline-benchmark-secret-0123456789abcdef" # HS256 wants >= 32 bytes
+
+# Must be set before the app modules are imported (they read the environment at import time).
+# load_dotenv() never overrides variables that are already set, so a local .env can't leak in.
+os.environ.update({
+    "SUPABASE_URL": BENCH_SUPABASE_URL,
+    "SUPABASE_KEY": "offline-anon-key",
+    "SUPABASE_SERVICE_ROLE_KEY": "offline-service-key",
+    "SUPABASE_JWT_SECRET": BENCH_JWT_SECRET,
+    "GOOGLE_API_KEY": "offline",
+    "GEMINI_RPM": "1000000", # Measure the backend, not the quota scheduler's waits
+    "GEMINI_TPM": "1000000000",
+    "EMBEDDING_CACHE_PATH": "",
+})
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import httpx
+import jwt
+import numpy as np
+from langchain_core.messages import AIMessage
+from supabase import create_client, acreate_client
+from supabase.lib.client_options import SyncClientOptions, AsyncClientOptions
+from benchmarks.fakes import MemoryStore, MemoryTransport, AsyncMemoryTransport, HashingEmbeddings, ScriptedChatModel
+
+SPELLS = ["Fireball", "Magic Missile", "Cure Wounds", "Shield", "Mage Hand", "Healing Word", "Counterspell", "Bless"]
+MONSTERS = ["Goblin", "Orc", "Owlbear", "Skeleton", "Zombie", "Wolf", "Bandit", "Ogre"]
+ITEMS = ["Longsword", "Potion of Healing", "Rope", "Shield", "Dagger", "Bag of Holding", "Torch", "Chain Mail"]
+
+CHAT_MESSAGES = [
+    "I sneak along the wall towards the goblin camp",                 # narrative, lore lookup
+    "How does the Fireball spell work, can I cast it here?",          # rules -> search_spells tool
+    "What monster is that? Tell me about the goblin",                 # search_monsters tool
+    "The orc hit me for 7 damage",                                    # apply_damage tool
+    "ok",                                                             # short reply, retrieval skipped
+    "Where is the tavern the innkeeper mentioned?",                   # lore lookup
+    "I open the chest and look inside",                               # narrative
+]
+ROLL_EXPRESSIONS = ["1d20+5", "2d6+3", "1d8", "4d6", "1d100", "3d10-2"]
+
+def seed(store: MemoryStore, embedder: HashingEmbeddings, campaigns: int, players: int) -> Dict[str, list]:
+    """
+    Campaigns with one GM and `players` characters each, RAG documents (rulebooks + per-campaign modules)
+    and a small compendium. Embeddings are computed directly (not counted as API requests).
+    """
+    users = []
+    for c in range(campaigns):
+        campaign_id = str(uuid.uuid4())
+        gm_id = str(uuid.uuid4())
+        store.seed("campaigns", [{"id": campaign_id, "name": f"Bench Campaign {c}", "gm_id": gm_id, "status": "active", "settings": {}, "rules": None}])
+        for p in range(players):
+            user_id = str(uuid.uuid4())
+            character_id = str(uuid.uuid4())
+            store.seed("characters", [{
+                "id": character_id, "user_id": user_id, "campaign_id": campaign_id, "name": f"Hero {c}-{p}",
+                "race": "Elf", "class": "Rogue 3", "level": 3, "stats": {"str": 10, "dex": 16, "con": 12, "int": 12, "wis": 10, "cha": 14},
+                "active_effects": [], "status": {"hp_current": 20, "hp_max": 20, "ac": 14}, "bio": "A wanderer.", "image_url": None,
+            }])
+            users.append({"user_id": user_id, "character_id": character_id, "campaign_id": campaign_id})
+        store.seed("documents", [
+            {"content": f"Module {c}, chapter {k}: the tavern in the village of Red Larch hides a goblin smuggling ring beneath the cellar.",
+             "metadata": {"type": "campaign_module", "campaign_id": campaign_id}}
+            for k in range(20)
+        ])
+    store.seed("documents", [
+        {"content": f"Rulebook page {k}: a spell that requires concentration ends if you cast another concentration spell. Advantage and disadvantage cancel out.",
+         "metadata": {"source": "PHB"}}
+        for k in range(200)
+    ])
+    for row in store.tables["documents"]:
+        row["embedding"] = embedder.vector(row["content"])
+
+    compendium = {
+        "spells": [{"name": n, "level": 3, "school": "Evocation", "casting_time": "1 action", "range": "150 ft", "duration": "Instantaneous", "description": f"{n}: a bench spell description."} for n in SPELLS],
+        "monsters": [{"name": n, "cr": 1, "type": "Humanoid", "ac": 13, "hp": 11, "stats": {"str": 10}, "actions": [{"name": "Scimitar"}]} for n in MONSTERS],
+        "items": [{"name": n, "rarity": "Common", "type": "Gear", "description": f"{n}: a bench item.", "properties": {}} for n in ITEMS],
+    }
+    for table, rows in compendium.items():
+        for row in rows:
+            # PostgREST returns pgvector columns as text
+            row["embedding"] = json.dumps(embedder.vector(f"{row['name']} {row.get('description', '')}"))
+        store.seed(table, rows)
+        store.seed("compendium_versions", [{"table_name": table, "version": 1}])
+    return {"users": users}
+
+async def install_fakes(store: MemoryStore, args) -> dict:
+    """
+    Points the app's Supabase clients, chat model and embedders at the fakes.
+    """
+    from app.core import database
+    from app.services.ai import get_sam_brain
+    from app.services.history import conversation_history
+    from app.services.embeddings import get_embeddings, RAG_EMBEDDING_MODEL, COMPENDIUM_EMBEDDING_MODEL
+
+    for role, key in (("anon", "offline-anon-key"), ("service", "offline-service-key")):
+        client = create_client(BENCH_SUPABASE_URL, key, options=SyncClientOptions(
+            httpx_client=httpx.Client(transport=MemoryTransport(store, args.db_latency, BENCH_JWT_SECRET))))
+        async_client = await acreate_client(BENCH_SUPABASE_URL, key, options=AsyncClientOptions(
+            httpx_client=httpx.AsyncClient(transport=AsyncMemoryTransport(store, args.db_latency, BENCH_JWT_SECRET))))
+        database.install_clients(role, client, async_client)
+
+    llm = ScriptedChatModel(latency=args.llm_latency, token_latency=args.token_latency)
+    sam_brain = get_sam_brain()
+    sam_brain.llm = llm
+    sam_brain.llm_with_tools = llm
+    conversation_history._llm = ScriptedChatModel(script=lambda messages: AIMessage(content="The party has been exploring."), latency=args.llm_latency)
+
+    embedder = HashingEmbeddings(latency=args.embed_latency)
+    for model in (RAG_EMBEDDING_MODEL, COMPENDIUM_EMBEDDING_MODEL):
+        cached = get_embeddings(model)
+        cached.base = embedder
+        cached.batch_kwargs = {}
+    return {"llm": llm, "embedder": embedder}
+
+def make_token(user_id: str) -> str:
+    claims = {"sub": user_id, "aud": "authenticated", "role": "authenticated", "email": f"{user_id[:8]}@bench.local", "exp": int(time.time()) + 3600}
+    return jwt.encode(claims, BENCH_JWT_SECRET, algorithm="HS256")
+
+# --- Scenarios: (client, request number) -> response ---
+
+Scenario = Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]]
+
+def build_scenarios(users: List[dict]) -> Dict[str, Scenario]:
+    tokens = [{"Authorization": f"Bearer {make_token(u['user_id'])}"} for u in users]
+
+    async def roll(client, i):
+        return await client.post("/api/roll", json={"expression": ROLL_EXPRESSIONS[i % len(ROLL_EXPRESSIONS)]})
+
+    async def characters(client, i):
+        u, headers = users[i % len(users)], tokens[i % len(users)]
+        step = (i // len(users)) % 3
+        if step == 0:
+            return await client.get("/api/characters/user/me", headers=headers)
+        if step == 1:
+            return await client.get(f"/api/characters/{u['character_id']}", headers=headers)
+        return await client.patch(f"/api/characters/{u['character_id']}", headers=headers, json={"status": {"hp_current": 10 + i % 10}})
+
+    async def chat(client, i):
+        return await client.post("/api/chat", headers=tokens[i % len(users)], json={
+            "message": CHAT_MESSAGES[i % len(CHAT_MESSAGES)], "character_context": "Hero, Elf Rogue 3, HP 20/20"})
+
+    async def chat_stream(client, i):
+        # ASGITransport buffers the body: this is time to the last token
+        return await client.post("/api/chat/stream", headers=tokens[i % len(users)], json={
+            "message": CHAT_MESSAGES[i % len(CHAT_MESSAGES)], "character_context": "Hero, Elf Rogue 3, HP 20/20"})
+
+    return {"chat": chat, "chat_stream": chat_stream, "roll": roll, "characters": characters}
+
+def _failed(response: httpx.Response) -> bool:
+    if response.status_code >= 400:
+        return True
+    if response.headers.get("content-type", "").startswith("application/json"):
+        body = response.json()
+        return isinstance(body, dict) and "SYSTEM ERROR" in str(body.get("response", ""))
+    return "SYSTEM ERROR" in response.text
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, requests: int, concurrency: int, warmup: int) -> dict:
+    for i in range(warmup):
+        await scenario(client, i)
+
+    latencies, errors = [], []
+    counter = itertools.count()
+
+    async def worker():
+        while True:
+            i = next(counter)
+            if i >= requests:
+                return
+            start = time.perf_counter()
+            try:
+                response = await scenario(client, warmup + i)
+                failed = _failed(response)
+                detail = f"HTTP {response.status_code}: {response.text[:200]}"
+            except Exception as e:
+                failed, detail = True, repr(e)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if failed:
+                errors.append(detail)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (0.0, 0.0, 0.0)
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "max_ms": round(max(latencies), 2) if latencies else 0.0,
+    }
+
+async def wait_for_compendium(timeout: float = 10.0):
+    from app.services.compendium_index import compendium_index
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(compendium_index.is_loaded(t) for t in ("spells", "monsters", "items")):
+            return
+        await asyncio.sleep(0.05)
+    print("WARNING: compendium index not loaded, tools will use the match_compendium RPC")
+
+def format_report(results: Dict[str, dict]) -> str:
+    lines = [f"{'scenario':<12} {'reqs':>6} {'conc':>5} {'err':>5} {'req/s':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}  (ms)"]
+    for name, r in results.items():
+        lines.append(f"{name:<12} {r['requests']:>6} {r['concurrency']:>5} {r['errors']:>5} {r['throughput_rps']:>9.1f} "
+                     f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['max_ms']:>9.1f}")
+        if r.get("first_error"):
+            lines.append(f"    first error: {r['first_error']}")
+        stages = {k: v for k, v in r.get("stages", {}).items() if not k.startswith("tokens_")}
+        for stage, s in sorted(stages.items(), key=lambda kv: -kv[1]["p50"])[:8]:
+            lines.append(f"    {stage:<22} p50 {s['p50']:>8.1f}  p95 {s['p95']:>8.1f}  p99 {s['p99']:>8.1f}")
+        if r.get("calls"):
+            lines.append("    calls: " + ", ".join(f"{k}={v}" for k, v in r["calls"].items()))
+    return "\n".join(lines)
+
+async def main(args) -> Dict[str, dict]:
+    store = MemoryStore()
+    embedder_for_seed = HashingEmbeddings()
+    users = seed(store, embedder_for_seed, args.campaigns, args.players)["users"]
+
+    # stdout is noisy (per-request DEBUG prints): keep it out of the report unless asked for
+    log = io.StringIO()
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(log)
+    with quiet:
+        from server import app
+        from app.core.timing import perf_log
+        fakes = await install_fakes(store, args)
+        scenarios = build_scenarios(users)
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            with quiet:
+                await wait_for_compendium()
+            for name in args.scenarios:
+                perf_log.turns.clear()
+                store.requests.clear()
+                llm_calls, embed_requests, embed_texts = fakes["llm"].calls, fakes["embedder"].requests, fakes["embedder"].texts
+                with quiet:
+                    result = await run_scenario(client, scenarios[name], args.requests, args.concurrency, args.warmup)
+                if name.startswith("chat"):
+                    result["stages"] = perf_log.summary()["stages"]
+                result["calls"] = {
+                    "llm": fakes["llm"].calls - llm_calls,
+                    "embedding_requests": fakes["embedder"].requests - embed_requests,
+                    "embedding_texts": fakes["embedder"].texts - embed_texts,
+                    "supabase": sum(store.requests.values()),
+                }
+                results[name] = result
+    return results
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline backend benchmark (fake Gemini, fake embeddings, in-memory Supabase)")
+    parser.add_argument("--scenarios", default="chat,roll,characters", help="comma-separated: chat, chat_stream, roll, characters")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests before each scenario")
+    parser.add_argument("--campaigns", type=int, default=10)
+    parser.add_argument("--players", type=int, default=4, help="characters per campaign")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds to first token per model call")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds between streamed words")
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="seconds per embedding request")
+    parser.add_argument("--db-latency", type=float, default=0.003, help="seconds per Supabase request")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the server's own logging")
+    args = parser.parse_args(argv)
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - {"chat", "chat_stream", "roll", "characters"}
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = asyncio.run(main(args))
+    print(format_report(results))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": {k: v for k, v in vars(args).items() if k not in ("json", "verbose")}, "results": results}, f, indent=2)
+        print(f"Results written to {args.json}")
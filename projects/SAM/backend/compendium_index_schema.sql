@@ -0,0 +1,43 @@
+-- Compendium Index: version stamps for the in-process vector index
+-- The backend keeps spells/monsters/items embeddings in memory and reloads a table
+-- when its version changes. Any write (seed_* scripts, manual edits) bumps the stamp.
+
+create table if not exists compendium_versions (
+  table_name text primary key,
+  version bigint not null default 1,
+  updated_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+
+insert into compendium_versions (table_name) values ('spells'), ('monsters'), ('items')
+on conflict (table_name) do nothing;
+
+create or replace function bump_compendium_version()
+returns trigger
+language plpgsql
+as $$
+begin
+  insert into compendium_versions (table_name, version, updated_at)
+  values (TG_TABLE_NAME, 1, timezone('utc'::text, now()))
+  on conflict (table_name) do update
+    set version = compendium_versions.version + 1,
+        updated_at = excluded.updated_at;
+  return null;
+end;
+$$;
+
+-- Statement-level: a batch upsert of 20 rows bumps the version once
+drop trigger if exists trg_spells_version on spells;
+create trigger trg_spells_version after insert or update or delete on spells
+for each statement execute function bump_compendium_version();
+
+drop trigger if exists trg_monsters_version on monsters;
+create trigger trg_monsters_version after insert or update or delete on monsters
+for each statement execute function bump_compendium_version();
+
+drop trigger if exists trg_items_version on items;
+create trigger trg_items_version after insert or update or delete on items
+for each statement execute function bump_compendium_version();
+
+-- Read access for the backend (anon key)
+alter table compendium_versions enable row level security;
+create policy "Compendium versions are readable by everyone." on compendium_versions for select using ( true );
@@ -0,0 +1,68 @@
+-- Campaign-scoped RAG: filtered pgvector search over 'documents'
+-- Before: match_documents ranked every campaign's modules + all rulebooks together
+-- (slow as the table grows, and could leak another party's adventure into the prompt).
+--
+-- Requires pgvector >= 0.5 for HNSW.
+
+-- 1. Promote the metadata keys we filter on to real columns (kept in sync automatically)
+alter table documents add column if not exists campaign_id text
+  generated always as (metadata->>'campaign_id') stored;
+
+-- 2. Indexes
+-- Campaign modules: a few hundred/thousand chunks per campaign -> btree prefilter + exact distance sort.
+create index if not exists idx_documents_campaign_id on documents (campaign_id);
+
+-- Rulebooks (shared by every campaign): approximate HNSW index over just those rows.
+-- Partial index with the same predicate as the query, so no rows are lost to post-filtering.
+create index if not exists idx_documents_rulebooks_hnsw on documents
+  using hnsw (embedding vector_cosine_ops)
+  where campaign_id is null;
+
+-- 3. Filtered search
+-- NOTE: the similarity threshold is applied AFTER the ordered, limited scan. Filtering on
+-- `1 - (embedding <=> q) > threshold` inside the WHERE clause (as match_documents does)
+-- prevents Postgres from using the vector index at all.
+create or replace function match_campaign_documents (
+  query_embedding vector(768),
+  match_threshold float,
+  match_count int,
+  p_campaign_id text default null,
+  include_campaign boolean default true,
+  include_rulebooks boolean default true
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float
+)
+language plpgsql
+stable
+set hnsw.ef_search = 100
+as $$
+begin
+  return query
+  with campaign_hits as (
+    select d.id, d.content, d.metadata, 1 - (d.embedding <=> query_embedding) as similarity
+    from documents d
+    where include_campaign
+      and p_campaign_id is not null
+      and d.campaign_id = p_campaign_id
+    order by d.embedding <=> query_embedding
+    limit match_count
+  ),
+  rulebook_hits as (
+    select d.id, d.content, d.metadata, 1 - (d.embedding <=> query_embedding) as similarity
+    from documents d
+    where include_rulebooks
+      and d.campaign_id is null
+    order by d.embedding <=> query_embedding
+    limit match_count
+  )
+  select h.id, h.content, h.metadata, h.similarity
+  from (select * from campaign_hits union all select * from rulebook_hits) h
+  where h.similarity > match_threshold
+  order by h.similarity desc
+  limit match_count;
+end;
+$$;
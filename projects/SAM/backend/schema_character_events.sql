@@ -0,0 +1,86 @@
+-- Atomic application of one chat turn's state changes (<UPDATE>, <LOOT>, <XP_GAIN>) to a character
+-- Replaces the client's read -> merge -> PATCH round trip (two requests and a lost-update race when several
+-- players act at once) with a single call: the row is locked, changed in place and the new status returned.
+-- Called by the backend after each turn (app/services/character_state.py).
+
+-- Numeric value of a JSON text field, or the fallback when missing / not a number ("300 XP", null)
+create or replace function _jsonb_numeric(value text, fallback numeric default 0)
+returns numeric
+language sql
+immutable
+as $$
+    select case when value ~ '^\s*-?\d+(\.\d+)?\s*$' then value::numeric else fallback end;
+$$;
+
+create or replace function apply_character_events(
+    p_character_id uuid,
+    p_set jsonb default '{}'::jsonb, -- <UPDATE> fields, merged over status (hp_current, conditions, ...)
+    p_xp numeric default 0, -- sum of <XP_GAIN>, added to status.xp
+    p_money jsonb default '{}'::jsonb, -- <LOOT> coins, added per coin: {"gp": 10, "sp": -5} (never below 0)
+    p_items jsonb default '[]'::jsonb -- <LOOT> items [{"item", "qty", "weight"}]: qty added to the entry of the same name, or appended
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    s jsonb;
+    inv jsonb;
+    coin text;
+    amount numeric;
+    new_item jsonb;
+    idx int;
+begin
+    -- Row lock: concurrent turns for the same character apply one after the other, none is lost
+    select coalesce(status, '{}'::jsonb) into s from characters where id = p_character_id for update;
+    if not found then
+        return null;
+    end if;
+
+    -- 1. Merge (top-level, same as PATCH /api/characters/{id})
+    s := s || coalesce(p_set, '{}'::jsonb);
+
+    -- 2. Increments
+    if coalesce(p_xp, 0) <> 0 then
+        s := jsonb_set(s, '{xp}', to_jsonb(greatest(0, _jsonb_numeric(s->>'xp') + p_xp)));
+    end if;
+
+    if jsonb_typeof(p_money) = 'object' and p_money <> '{}'::jsonb then
+        if jsonb_typeof(s->'money') is distinct from 'object' then
+            s := jsonb_set(s, '{money}', '{}'::jsonb);
+        end if;
+        for coin, amount in
+            select key, (value #>> '{}')::numeric from jsonb_each(p_money) where jsonb_typeof(value) = 'number'
+        loop
+            s := jsonb_set(s, array['money', coin], to_jsonb(greatest(0, _jsonb_numeric(s->'money'->>coin) + amount)));
+        end loop;
+    end if;
+
+    -- 3. Inventory
+    if jsonb_typeof(p_items) = 'array' and jsonb_array_length(p_items) > 0 then
+        inv := case when jsonb_typeof(s->'inventory') = 'array' then s->'inventory' else '[]'::jsonb end;
+        for new_item in select value from jsonb_array_elements(p_items)
+        loop
+            continue when coalesce(new_item->>'item', '') = '';
+            select (e.ord - 1)::int into idx
+                from jsonb_array_elements(inv) with ordinality as e(value, ord)
+                where lower(e.value->>'item') = lower(new_item->>'item')
+                limit 1;
+            if idx is null then
+                inv := inv || jsonb_build_array(jsonb_build_object(
+                    'item', new_item->>'item',
+                    'qty', greatest(1, _jsonb_numeric(new_item->>'qty', 1)),
+                    'weight', _jsonb_numeric(new_item->>'weight', 0),
+                    'notes', 'Looted'
+                ));
+            else
+                inv := jsonb_set(inv, array[idx::text, 'qty'],
+                    to_jsonb(_jsonb_numeric(inv->idx->>'qty', 1) + greatest(1, _jsonb_numeric(new_item->>'qty', 1))));
+            end if;
+        end loop;
+        s := jsonb_set(s, '{inventory}', inv);
+    end if;
+
+    update characters set status = s where id = p_character_id;
+    return s;
+end;
+$$;
@@ -0,0 +1,30 @@
+-- Server-side combat state: one active encounter per campaign
+-- The backend (app/services/combat.py) owns initiative order, monster HP/AC/conditions and the
+-- round/turn pointers, and shows S.A.M. a compact summary instead of making it track HP "in its mind".
+
+create table if not exists encounters (
+    id uuid default gen_random_uuid() primary key,
+    campaign_id uuid references campaigns(id) on delete cascade not null,
+    status text not null default 'active', -- 'active' | 'ended'
+    round int not null default 1,
+    turn_index int not null default 0, -- index into combatants (initiative order) of whoever is acting
+    -- Example: [{"name": "Goblin 1", "kind": "monster", "initiative": 17, "dex": 2, "ac": 15, "hp": 7, "hp_max": 7, "conditions": ["prone"]},
+    --           {"name": "Thorin", "kind": "player", "initiative": 12, "dex": 0, "ac": 16, "hp": null, "hp_max": null, "conditions": []}]
+    combatants jsonb not null default '[]'::jsonb,
+    version int not null default 0, -- bumped on every write (compare-and-set against lost updates)
+    created_at timestamp with time zone default timezone('utc'::text, now()) not null,
+    updated_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+
+-- At most one running fight per campaign (also the lookup index for every chat turn)
+create unique index if not exists idx_encounters_active_campaign on encounters (campaign_id) where status = 'active';
+
+-- Access: the backend reads and writes encounters with the service role (SUPABASE_SERVICE_ROLE_KEY),
+-- which bypasses RLS. Clients may only read the fights of campaigns they run or play in; no client writes.
+alter table encounters enable row level security;
+
+drop policy if exists "Campaign members can view encounters." on encounters;
+create policy "Campaign members can view encounters." on encounters for select using (
+  exists (select 1 from campaigns c where c.id = encounters.campaign_id and c.gm_id = auth.uid())
+  or exists (select 1 from characters ch where ch.campaign_id = encounters.campaign_id and ch.user_id = auth.uid())
+);
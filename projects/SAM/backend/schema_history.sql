@@ -0,0 +1,25 @@
+-- Server-side conversation history: rolling summary per campaign
+-- The backend keeps the most recent turns verbatim and folds everything older into this summary
+-- (app/services/history.py), so the prompt stays roughly the same size however long the session runs.
+
+create table if not exists campaign_summaries (
+    campaign_id uuid references campaigns(id) on delete cascade primary key,
+    summary text not null default '',
+    summarized_until timestamp with time zone, -- created_at of the last message folded into the summary
+    turns_summarized int not null default 0,
+    updated_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+
+-- History is always read newest-first per campaign
+create index if not exists idx_messages_campaign_created on messages (campaign_id, created_at desc);
+
+-- Access: the backend reads and writes summaries with the service role (SUPABASE_SERVICE_ROLE_KEY),
+-- which bypasses RLS. Clients may only read the summary of campaigns they run or play in; no client writes
+-- (a rewritten summary would be injected into every later prompt of that campaign).
+alter table campaign_summaries enable row level security;
+
+drop policy if exists "Campaign members can view summaries." on campaign_summaries;
+create policy "Campaign members can view summaries." on campaign_summaries for select using (
+  exists (select 1 from campaigns c where c.id = campaign_summaries.campaign_id and c.gm_id = auth.uid())
+  or exists (select 1 from characters ch where ch.campaign_id = campaign_summaries.campaign_id and ch.user_id = auth.uid())
+);
@@ -0,0 +1,76 @@
+from supabase import create_client
+import os
+import sys
+import time
+import random
+import statistics
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=".env")
+
+# Benchmark: match_documents (unfiltered) vs match_campaign_documents (schema_campaign_rag.sql)
+# as the 'documents' table grows. Seeds synthetic chunks tagged {"bench": true} and removes them at the end.
+# Usage: python scripts/bench_campaign_rag.py [max_rows]   (needs the service role key for inserts/deletes)
+
+url = os.getenv("SUPABASE_URL")
+key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_KEY")
+supabase = create_client(url, key)
+
+DIM = 768
+CAMPAIGNS = 50 # Synthetic campaigns sharing the table
+RULEBOOK_SHARE = 0.3 # Fraction of chunks with no campaign_id
+BATCH = 500
+QUERIES = 20
+MAX_ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+SIZES = [s for s in (1_000, 10_000, 50_000, 100_000, 200_000) if s <= MAX_ROWS]
+
+def random_vector():
+    v = [random.gauss(0, 1) for _ in range(DIM)]
+    norm = sum(x * x for x in v) ** 0.5
+    return [x / norm for x in v]
+
+def seed(count, offset):
+    for start in range(0, count, BATCH):
+        rows = []
+        for i in range(start, min(start + BATCH, count)):
+            metadata = {"bench": True, "source": "bench"}
+            if random.random() > RULEBOOK_SHARE:
+                metadata["type"] = "campaign_module"
+                metadata["campaign_id"] = f"bench-{(offset + i) % CAMPAIGNS}"
+            rows.append({"content": f"Bench chunk {offset + i}", "metadata": metadata, "embedding": random_vector()})
+        supabase.table("documents").insert(rows).execute()
+
+def time_rpc(name, params):
+    samples = []
+    for _ in range(QUERIES):
+        params["query_embedding"] = random_vector()
+        t0 = time.perf_counter()
+        supabase.rpc(name, params).execute()
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+def cleanup():
+    print("Cleaning up bench rows...")
+    supabase.table("documents").delete().eq("metadata->>bench", "true").execute()
+
+try:
+    print(f"{'rows':>8} | {'match_documents p50/p95 (ms)':>30} | {'match_campaign_documents p50/p95 (ms)':>38}")
+    print("-" * 84)
+    seeded = 0
+    for size in SIZES:
+        seed(size - seeded, seeded)
+        seeded = size
+        base = time_rpc("match_documents", {"match_threshold": 0.0, "match_count": 3})
+        scoped = time_rpc("match_campaign_documents", {
+            "match_threshold": 0.0,
+            "match_count": 3,
+            "p_campaign_id": "bench-7",
+            "include_campaign": True,
+            "include_rulebooks": True,
+        })
+        print(f"{size:>8} | {base[0]:>14.1f} / {base[1]:<13.1f} | {scoped[0]:>18.1f} / {scoped[1]:<17.1f}")
+except Exception as e:
+    print("Error:", e)
+finally:
+    cleanup()
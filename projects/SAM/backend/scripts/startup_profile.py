@@ -0,0 +1,107 @@
+import os
+import sys
+import json
+import time
+import socket
+import subprocess
+import urllib.request
+
+# Startup profile: import time per module (python -X importtime), then boots uvicorn and measures
+# time to the first answered request plus the in-process milestones (GET /api/stats/startup).
+# Usage (from backend/): python scripts/startup_profile.py [top_n] [--imports-only]
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+TOP_N = int(next((a for a in sys.argv[1:] if a.isdigit()), "15"))
+BOOT_TIMEOUT = 60
+
+def profile_imports() -> list:
+    """
+    Runs `import server` in a fresh interpreter with -X importtime.
+    Returns [(module, self_ms, cumulative_ms, depth)] in import order.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, self_us, cumulative_us, name = [p for p in line.replace("import time:", "|", 1).split("|")]
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        rows.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000, depth))
+    if proc.returncode != 0:
+        print(proc.stderr[-2000:])
+        raise SystemExit("import server failed (see above)")
+    return rows
+
+def print_imports(rows: list):
+    total = next((cum for name, _, cum, depth in rows if name == "server"), 0.0)
+    print(f"=== import server: {total:.0f} ms ===\n")
+    print("Direct imports of server.py (cumulative):")
+    direct = [r for r in rows if r[3] == 1]
+    for name, _, cum, _ in sorted(direct, key=lambda r: -r[2])[:TOP_N]:
+        print(f"  {cum:>8.1f} ms  {name}")
+    print("\nHeaviest modules (self time):")
+    for name, self_ms, _, _ in sorted(rows, key=lambda r: -r[1])[:TOP_N]:
+        print(f"  {self_ms:>8.1f} ms  {name}")
+    print("\nApp modules (cumulative):")
+    for name, _, cum, _ in sorted((r for r in rows if r[0].startswith("app.")), key=lambda r: -r[2])[:TOP_N]:
+        print(f"  {cum:>8.1f} ms  {name}")
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _get_json(url: str):
+    with urllib.request.urlopen(url, timeout=2) as res:
+        return json.loads(res.read())
+
+def profile_boot():
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/api/stats/startup"
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        # 1. Time to first answered request (process spawn -> HTTP 200)
+        while True:
+            if proc.poll() is not None:
+                raise SystemExit("uvicorn exited during startup (run it by hand to see why)")
+            if time.perf_counter() - started > BOOT_TIMEOUT:
+                raise SystemExit(f"No response within {BOOT_TIMEOUT}s")
+            try:
+                report = _get_json(url)
+                break
+            except Exception:
+                time.sleep(0.02)
+        first_response_ms = (time.perf_counter() - started) * 1000
+
+        # 2. Let the warm-up finish so its steps show up
+        while report.get("warmup_enabled") and "warmup_done" not in report["milestones_ms"]:
+            if time.perf_counter() - started > BOOT_TIMEOUT:
+                break
+            time.sleep(0.1)
+            report = _get_json(url)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+    print(f"\n=== boot (uvicorn) ===\n")
+    print(f"  {first_response_ms:>8.1f} ms  spawn -> first HTTP response (includes interpreter start)")
+    print("  In-process milestones (since server.py started importing):")
+    for name, ms in sorted(report["milestones_ms"].items(), key=lambda kv: kv[1]):
+        print(f"  {ms:>8.1f} ms  {name}")
+    if report.get("warmup_ms"):
+        print("  Warm-up steps:")
+        for name, ms in report["warmup_ms"].items():
+            error = report.get("warmup_errors", {}).get(name)
+            print(f"  {ms:>8.1f} ms  {name}" + (f"  (FAILED: {error})" if error else ""))
+
+if __name__ == "__main__":
+    print_imports(profile_imports())
+    if "--imports-only" not in sys.argv:
+        profile_boot()
@@ -1,17 +1,73 @@
-from fastapi import FastAPI, HTTPException, Depends
-from app.core.security import verify_token
-from pydantic import BaseModel
+from app.core.startup import startup_profile, WARMUP_ON_START # First: the startup clock starts here
+from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse, Response
+from fastapi.concurrency import run_in_threadpool
+from app.core.security import verify_token_timed
+from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Union
+from contextlib import asynccontextmanager
+import asyncio
+import json
 
 # Import S.A.M. Core Modules
-from app.core.dice import DiceRoller, Visibility
-from app.services.ai import sam_brain
+from app.core.dice import DiceRoller, Visibility, MAX_BATCH_ROLLS
+from app.core.dice_odds import odds
+from app.core.database import get_supabase, get_async_supabase, get_pool_stats
+from app.core.timing import TurnTimer, current_timer, start_turn, span, perf_log
+from app.core.metrics import MetricsMiddleware, monitor_event_loop_lag, render_metrics
+from app.services.embeddings import get_embeddings, get_embedding_cache_stats, get_embedding_batch_stats, COMPENDIUM_EMBEDDING_MODEL
+from app.services.tools.registry import tool_registry
+from app.services.compendium_index import compendium_index, VERSION_CHECK_SECONDS
+from app.services.ai import get_sam_brain, aget_sam_brain
+from app.services.persistence import message_writer
+from app.services.llm_scheduler import llm_scheduler
+from app.services.campaign_context import campaign_contexts, CampaignContext
+from app.services.combat import combat_engine
+from app.services.character_state import character_state
+from app.services.history import conversation_history, fit_to_budget, HISTORY_TOKEN_BUDGET
 from app.services.admin import AdminService
 from app.routers import characters, campaigns, messages
 
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI(title="S.A.M. - Storytelling AI Master")
+startup_profile.mark("imports_done")
+
+async def _compendium_refresher():
+    # Load the compendium vectors, then reload tables whose version stamp changed (re-seeding)
+    await asyncio.to_thread(compendium_index.load_all)
+    while True:
+        await asyncio.sleep(VERSION_CHECK_SECONDS)
+        try:
+            await asyncio.to_thread(compendium_index.refresh_if_stale)
+        except Exception as e:
+            print(f"Compendium refresh error: {e}")
+
+def _warmup_steps() -> list:
+    # Everything a first chat turn would otherwise build on the request path
+    return [
+        ("gemini_and_rag_embeddings", get_sam_brain),
+        ("compendium_embeddings", lambda: get_embeddings(COMPENDIUM_EMBEDDING_MODEL)),
+        ("supabase", get_supabase),
+        ("supabase_async", get_async_supabase),
+        ("summary_llm", lambda: conversation_history.llm),
+    ]
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Background tasks: the port binds immediately, tools use the RPC until the index is ready
+    tasks = [asyncio.create_task(_compendium_refresher()), asyncio.create_task(monitor_event_loop_lag())]
+    message_writer.start()
+    if WARMUP_ON_START:
+        # Runs once the server starts accepting connections; requests that arrive first build lazily
+        tasks.append(asyncio.create_task(startup_profile.run_warmup(_warmup_steps())))
+    startup_profile.mark("app_ready")
+    print(f"Startup: imports {startup_profile.marks['imports_done']:.0f}ms, app ready {startup_profile.marks['app_ready']:.0f}ms")
+    yield
+    await message_writer.stop() # Flush queued chat messages before exiting
+    for task in tasks:
+        task.cancel()
+
+app = FastAPI(title="S.A.M. - Storytelling AI Master", lifespan=lifespan)
 
 # CORS Configuration
 app.add_middleware(
@@ -22,6 +78,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Prometheus request metrics (GET /metrics)
+app.add_middleware(MetricsMiddleware)
+
 # Include Routers
 app.include_router(characters.router)
 app.include_router(campaigns.router)
@@ -30,13 +89,177 @@ app.include_router(messages.router)
 # --- Data Models ---
 class ChatRequest(BaseModel):
     message: str
-    history: List[Union[str, Dict[str, str]]] = []
+    history: List[Union[str, Dict[str, str]]] = [] # Only used when no campaign is found (history is server-side)
     character_context: Optional[str] = "No character selected." # Frontend will send summary string for now
+    character_id: Optional[str] = None # Selected character: the turn's state changes are applied to it
 
 class RollRequest(BaseModel):
     expression: str # e.g. "1d20+5"
     visibility: Visibility = Visibility.PUBLIC
 
+class LabeledRoll(BaseModel):
+    expression: str # e.g. "1d20+4"
+    label: Optional[str] = None # e.g. "Goblin 2 attack"
+
+class RollBatchRequest(BaseModel):
+    rolls: List[LabeledRoll] = Field(..., min_length=1, max_length=MAX_BATCH_ROLLS)
+    visibility: Visibility = Visibility.PUBLIC
+
+class OddsRequest(BaseModel):
+    expression: str # e.g. "2d20kh1+5"
+    target: Optional[int] = None # DC / AC to meet or beat
+    include_distribution: bool = True
+
+# --- Chat Helpers ---
+# All chat I/O goes through the async Supabase client so a slow turn never blocks the event loop.
+
+async def _resolve_campaign(user_id: str) -> CampaignContext:
+    """
+    [PHASE 18] MULTIPLAYER ROUTING
+    Campaign (and character, settings, rules) for this user, from the campaign-context cache.
+    """
+    try:
+        return await campaign_contexts.resolve(user_id)
+    except Exception as e:
+        print(f"WARNING: Campaign Lookup Failed: {e}")
+        return CampaignContext()
+
+async def _save_user_message(content: str, user_id: str, cid: Optional[str]):
+    try:
+        user_payload = {
+            "role": "user",
+            "content": content,
+            "user_id": user_id,
+        }
+        if cid:
+            user_payload["campaign_id"] = cid
+        
+        # Write-behind: the turn continues while the row is batched into Supabase
+        with span("user_insert"):
+            await message_writer.enqueue(user_payload)
+    except Exception as db_e:
+        print(f"WARNING: User insert failed: {db_e}")
+
+async def _save_ai_message(response: dict, user_id: str, cid: Optional[str]):
+    # [PHASE 13] PERSISTENCE LAYER - SAVE AI MESSAGE
+    try:
+         ai_payload = {
+            "role": "assistant",
+            "content": response['response'],
+            "image_url": response.get('image_url'),
+            "metadata": response.get('debug_info'),
+            "user_id": user_id 
+        }
+         if cid:
+             ai_payload["campaign_id"] = cid
+
+         with span("ai_insert"):
+             await message_writer.enqueue(ai_payload)
+    except Exception as e:
+         print(f"FAILED TO SAVE AI MESSAGE: {e}")
+
+async def _load_history(request: ChatRequest, cid: Optional[str]) -> tuple:
+    """
+    Server-side history for the prompt: (rolling summary, recent turns under the token budget).
+    Without a campaign (or if the lookup fails) the client-sent history is used, budgeted the same way.
+    """
+    if cid:
+        try:
+            with span("history_load"):
+                return await conversation_history.load(cid, current_message=request.message)
+        except Exception as e:
+            print(f"WARNING: History load failed, using client history: {e}")
+    turns = [m if isinstance(m, dict) else {"role": "user", "content": str(m)} for m in request.history]
+    return "", fit_to_budget(turns, HISTORY_TOKEN_BUDGET)
+
+async def _run_admin_command(message: str, user_id: str) -> dict:
+    # [PHASE 11] ADMIN COMMAND INTERCEPTOR
+    print(f"DEBUG: Detected Admin Command '{message.strip()}'")
+    try:
+        # Write-behind: flush queued rows (this command's own included) before /reset or /load
+        # touch 'messages', otherwise they would be inserted after the wipe
+        if not await message_writer.drain():
+            print("WARNING: Message queue not drained before admin command")
+        # Pass user_id so admin commands affect THIS user
+        # AdminService uses the sync client; keep it off the event loop.
+        admin_response = await run_in_threadpool(AdminService.handle_command, message, user_id)
+        print(f"DEBUG: Admin Response: {admin_response[:50]}...")
+        return {
+            "response": admin_response,
+            "image_url": None
+        }
+    except Exception as e:
+        import traceback
+        print(f"DEBUG ADMIN ERROR: {traceback.format_exc()}")
+        return {
+            "response": f"ADMIN ERROR: {str(e)}",
+            "image_url": None
+        }
+
+def _system_error_response(e: Exception) -> dict:
+    import traceback
+    trace = traceback.format_exc()
+    print(f"CHAT ENDPOINT ERROR: {e}\n{trace}")
+    # Return error as chat message so user sees it in UI
+    return {
+        "response": f"⚠️ **SYSTEM ERROR:** {str(e)}\n\n*(Check server logs for trace)*",
+        "image_url": None
+    }
+
+def _start_turn(http_request: Request) -> TurnTimer:
+    """
+    Starts the stage timer for this chat turn (auth was timed by verify_token_timed).
+    """
+    # The turn starts when auth did: total_ms (and /perf) cover the whole request
+    timer = start_turn(getattr(http_request.state, "auth_started", None))
+    timer.add("auth", getattr(http_request.state, "auth_ms", 0.0), start_ms=0.0)
+    return timer
+
+async def _turn_character_id(request: ChatRequest, user_id: str, campaign: CampaignContext) -> Optional[str]:
+    """
+    Character this turn's state changes belong to: the one the client selected if the caller owns it,
+    else the campaign context's default character (when the client didn't say).
+    """
+    if not request.character_id:
+        return campaign.character_id
+    try:
+        if await campaign_contexts.owns_character(user_id, campaign, request.character_id):
+            return request.character_id
+    except Exception as e:
+        print(f"WARNING: Character ownership check failed: {e}")
+        return None
+    print(f"WARNING: {user_id} sent character {request.character_id} they don't own; state not applied")
+    return None
+
+async def _apply_turn_state(response: dict, request: ChatRequest, user_id: str, campaign: CampaignContext):
+    """
+    Applies the turn's <UPDATE>/<LOOT>/<XP_GAIN> to the player's character in one atomic call.
+    The new status goes back as `character_state` (with `character_id`); the stored message is flagged
+    (metadata.state_applied) so clients don't apply the same tags a second time.
+    """
+    if campaign.mode != "player":
+        return
+    character_id = await _turn_character_id(request, user_id, campaign)
+    state = await character_state.apply(character_id, response)
+    if state is not None:
+        response["character_state"] = state
+        response["character_id"] = character_id
+        if isinstance(response.get("debug_info"), dict):
+            response["debug_info"]["state_applied"] = True
+            response["debug_info"]["state_character_id"] = character_id
+
+async def _save_ai_message_timed(response: dict, user_id: str, cid: Optional[str], timer: TurnTimer):
+    # Stage timings + token counts travel in the message metadata (debug_info); the insert itself
+    # can only be measured afterwards, so it is recorded in the in-process perf log
+    if isinstance(response.get("debug_info"), dict):
+        response["debug_info"]["perf"] = timer.to_dict()
+    await _save_ai_message(response, user_id, cid)
+    perf_log.record(timer.to_dict())
+
+def _sse(event: str, data: dict) -> str:
+    """Formats one Server-Sent Event frame."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 # --- Endpoints ---
 
 @app.get("/")
@@ -47,103 +270,187 @@ def read_root():
 def get_version():
     return {"version": "1.0.2", "deployed_at": "2026-02-04", "fix": "Admin Debug Tracing"}
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """
+    Prometheus scrape endpoint (routes, Gemini, tools, embedding cache, Supabase, event loop lag).
+    """
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/api/stats/startup")
+def startup_stats():
+    """
+    Process startup milestones (imports, app ready, warm-up steps, first request), in ms.
+    """
+    return startup_profile.report()
+
+@app.get("/api/stats/pool")
+def pool_stats():
+    """
+    Supabase connection pool usage (in-use, idle, queued requests, wait times).
+    """
+    return get_pool_stats()
+
+@app.get("/api/stats/embeddings")
+def embedding_cache_stats():
+    """
+    Query-embedding cache hit/miss counters (memory + disk tiers) and batch coalescing per model.
+    """
+    return {**get_embedding_cache_stats(), "batching": get_embedding_batch_stats()}
+
+@app.get("/api/stats/compendium")
+def compendium_index_stats():
+    """
+    Rows, dimensions and version stamp of each in-memory compendium table.
+    """
+    return compendium_index.stats()
+
+@app.get("/api/stats/perf")
+def turn_perf_stats(last: Optional[int] = None):
+    """
+    p50/p95/p99 per chat stage (ms) and token counts over the recent turns of this process.
+    """
+    return perf_log.summary(last)
+
+@app.get("/api/stats/persistence")
+def persistence_stats():
+    """
+    Write-behind message queue: depth, batches, retries, dropped rows.
+    """
+    return message_writer.stats()
+
+@app.get("/api/stats/campaigns")
+def campaign_context_stats():
+    """
+    User -> campaign resolution cache (entries, hit rate).
+    """
+    return campaign_contexts.stats()
+
+@app.get("/api/stats/llm")
+def llm_scheduler_stats():
+    """
+    Gemini quota scheduler: queued calls per priority, remaining RPM/TPM, retries, timeouts.
+    """
+    return llm_scheduler.stats()
+
+@app.get("/api/stats/dice")
+def dice_stats():
+    """
+    Compiled dice-expression cache and secure random buffer (refills, rejected draws).
+    """
+    return DiceRoller.stats()
+
+@app.get("/api/stats/combat")
+def combat_stats():
+    """
+    Encounter state cache (active encounters, hits/reads) and writes / version conflicts.
+    """
+    return combat_engine.stats()
+
+@app.get("/api/stats/character-state")
+def character_state_stats():
+    """
+    Turns whose state changes were applied server-side (apply_character_events) vs. failed.
+    """
+    return character_state.stats()
+
+@app.get("/api/stats/tools")
+def tool_stats():
+    """
+    Per-tool call counts, errors, timeouts and latency.
+    """
+    return tool_registry.get_stats()
+
 @app.post("/api/chat")
-async def chat_with_gm(request: ChatRequest, user: dict = Depends(verify_token)):
+async def chat_with_gm(request: ChatRequest, http_request: Request, user: dict = Depends(verify_token_timed)):
     """
     Send a message to S.A.M. and get a narrative response.
     Persists data to Supabase 'messages' table to trigger Realtime updates.
     """
     try:
+        timer = _start_turn(http_request)
         user_id = user.get('sub', 'unknown_user')
         msg_clean = request.message.strip()
         print(f"DEBUG CHAT REQUEST: '{request.message}' (cleaned: '{msg_clean}') from {user_id}")
         
-        # [PHASE 18] MULTIPLAYER ROUTING
-        cid = None
-        try:
-            # 1. Player Mode: Check if User has a Character in a Campaign
-            # We take the first character found (MVP). In future, frontend could send specific campaign_id.
-            chars = sam_brain.supabase.table("characters").select("campaign_id").eq("user_id", user_id).limit(1).execute()
-            if chars.data and chars.data[0].get('campaign_id'):
-                 cid = chars.data[0]['campaign_id']
-                 print(f"DEBUG: Found Campaign ID: {cid} via Character (Player Mode)")
-            
-            # 2. GM Mode: Fallback to Campaign Ownership
-            if not cid:
-                camps = sam_brain.supabase.table("campaigns").select("id").eq("gm_id", user_id).limit(1).execute()
-                if camps.data:
-                    cid = camps.data[0]['id']
-                    print(f"DEBUG: Found Campaign ID: {cid} via GM Ownership")
-                    
-        except Exception as e:
-            print(f"WARNING: Campaign Lookup Failed: {e}")
+        with span("campaign_lookup"):
+            campaign = await _resolve_campaign(user_id)
+        cid = campaign.campaign_id
+        await _save_user_message(request.message, user_id, cid)
 
-        try:
-            user_payload = {
-                "role": "user",
-                "content": request.message,
-                "user_id": user_id,
-            }
-            if cid:
-                user_payload["campaign_id"] = cid
-            
-            sam_brain.supabase.table("messages").insert(user_payload).execute()
-        except Exception as db_e:
-            print(f"WARNING: User insert failed: {db_e}")
-
-        # [PHASE 11] ADMIN COMMAND INTERCEPTOR
         if msg_clean.startswith("/"):
-            print(f"DEBUG: Detected Admin Command '{msg_clean}'")
-            try:
-                from app.services.admin import AdminService
-                # Pass user_id so admin commands affect THIS user
-                admin_response = AdminService.handle_command(request.message, user_id)
-                print(f"DEBUG: Admin Response: {admin_response[:50]}...")
-                return {
-                    "response": admin_response,
-                    "image_url": None
-                }
-            except Exception as e:
-                import traceback
-                print(f"DEBUG ADMIN ERROR: {traceback.format_exc()}")
-                return {
-                    "response": f"ADMIN ERROR: {str(e)}",
-                    "image_url": None
-                }
+            return await _run_admin_command(request.message, user_id)
         
         print("DEBUG: proceeding to AI generation...")
-        response = sam_brain.generate_response(
+        summary, history = await _load_history(request, cid)
+        sam_brain = await aget_sam_brain()
+        response = await sam_brain.agenerate_response(
             request.message, 
-            request.history,
-            request.character_context
+            history,
+            request.character_context,
+            campaign_id=cid,
+            summary=summary,
+            campaign_rules=campaign.rules
         )
         
-        # [PHASE 13] PERSISTENCE LAYER - SAVE AI MESSAGE
-        try:
-             ai_payload = {
-                "role": "assistant",
-                "content": response['response'],
-                "image_url": response.get('image_url'),
-                "metadata": response.get('debug_info'),
-                "user_id": user_id 
-            }
-             if cid:
-                 ai_payload["campaign_id"] = cid
-
-             sam_brain.supabase.table("messages").insert(ai_payload).execute()
-        except Exception as e:
-             print(f"FAILED TO SAVE AI MESSAGE: {e}")
+        await _apply_turn_state(response, request, user_id, campaign)
+        await _save_ai_message_timed(response, user_id, cid, timer)
+        conversation_history.schedule_summary(cid)
 
         return response # Returns {"response": "...", "image_url": "..."}
     except Exception as e:
-        import traceback
-        trace = traceback.format_exc()
-        print(f"CHAT ENDPOINT ERROR: {e}\n{trace}")
-        # Return error as chat message so user sees it in UI
-        return {
-            "response": f"⚠️ **SYSTEM ERROR:** {str(e)}\n\n*(Check server logs for trace)*",
-            "image_url": None
-        }
+        return _system_error_response(e)
+
+@app.post("/api/chat/stream")
+async def chat_with_gm_stream(request: ChatRequest, http_request: Request, user: dict = Depends(verify_token_timed)):
+    """
+    Streaming variant of /api/chat (Server-Sent Events).
+    Events:
+      token -> {"text": "..."}                    narrative tokens, machine tags removed
+      tag   -> {"tag": "LOOT", "content": "...", "payload": {...}, "valid": true}  complete, validated machine tags
+      tool  -> {"name": "search_spells"}          S.A.M. is consulting a tool
+      done  -> same payload /api/chat returns
+    """
+    user_id = user.get('sub', 'unknown_user')
+    print(f"DEBUG CHAT STREAM REQUEST: '{request.message}' from {user_id}")
+    timer = _start_turn(http_request)
+
+    async def event_stream():
+        current_timer.set(timer)
+        try:
+            with span("campaign_lookup"):
+                campaign = await _resolve_campaign(user_id)
+            cid = campaign.campaign_id
+            await _save_user_message(request.message, user_id, cid)
+
+            if request.message.strip().startswith("/"):
+                yield _sse("done", await _run_admin_command(request.message, user_id))
+                return
+
+            summary, history = await _load_history(request, cid)
+            sam_brain = await aget_sam_brain()
+            async for event in sam_brain.astream_response(request.message, history, request.character_context, campaign_id=cid, summary=summary, campaign_rules=campaign.rules):
+                if event["type"] == "text":
+                    yield _sse("token", {"text": event["text"]})
+                elif event["type"] == "tag":
+                    yield _sse("tag", {k: v for k, v in event.items() if k != "type"})
+                elif event["type"] == "tool":
+                    yield _sse("tool", {"name": event["name"]})
+                elif event["type"] == "done":
+                    response = event["result"]
+                    await _apply_turn_state(response, request, user_id, campaign)
+                    await _save_ai_message_timed(response, user_id, cid, timer)
+                    conversation_history.schedule_summary(cid)
+                    yield _sse("done", response)
+        except Exception as e:
+            yield _sse("done", _system_error_response(e))
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.post("/api/roll")
 async def roll_dice(request: RollRequest):
@@ -160,3 +467,34 @@ async def roll_dice(request: RollRequest):
         return final_output
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/api/roll/batch")
+async def roll_dice_batch(request: RollBatchRequest):
+    """
+    Roll many labeled expressions in one request (e.g. every monster's attack and damage this round).
+    Each entry is what /api/roll returns for that expression, plus its label; a single invalid
+    expression rejects the whole batch.
+    """
+    try:
+        results = DiceRoller.roll_batch([r.expression for r in request.rolls])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Same visibility logic as /api/roll, per roll (Mock user ID for now)
+    return {
+        "results": [
+            {"label": r.label, **DiceRoller.resolve_visibility(result, request.visibility, user_id="user_123")}
+            for r, result in zip(request.rolls, results)
+        ],
+    }
+
+@app.post("/api/roll/odds")
+async def dice_odds(request: OddsRequest):
+    """
+    Exact outcome distribution of a dice expression and, with a target, P(total >= target).
+    """
+    try:
+        # NumPy work (microseconds when cached, up to tens of ms for 100-die expressions): off the loop
+        return await run_in_threadpool(odds, request.expression, request.target, request.include_distribution)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
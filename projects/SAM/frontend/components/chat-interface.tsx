@@ -12,26 +12,6 @@ import { Dialog, DialogContent, DialogDescription, DialogHeader, DialogTitle } f
 import { ScrollArea } from "@/components/ui/scroll-area"
 import { useRealtime } from "@/hooks/use-realtime"
 
-// Helper: Attempt to repair truncated JSON from malformed AI tags
-function repairJson(str: string): string {
-    str = str.replace(/```json/g, '').replace(/```/g, '').trim()
-    let braces = 0, brackets = 0, inString = false, escape = false
-    for (const ch of str) {
-        if (escape) { escape = false; continue }
-        if (ch === '\\') { escape = true; continue }
-        if (ch === '"') { inString = !inString; continue }
-        if (inString) continue
-        if (ch === '{') braces++
-        if (ch === '}') braces--
-        if (ch === '[') brackets++
-        if (ch === ']') brackets--
-    }
-    if (inString) str += '"'
-    while (brackets > 0) { str += ']'; brackets-- }
-    while (braces > 0) { str += '}'; braces-- }
-    return str
-}
-
 // Strip machine-readable tags from message content for clean display
 function stripSystemTags(content: string): string {
     return content
@@ -63,7 +43,7 @@ export function ChatInterface({
     selectedCharacter: any,
     externalEvent?: string | null,
     onEventHandled?: () => void,
-    onCharacterUpdate?: (updates: any) => void
+    onCharacterUpdate?: (updates: any, persist?: boolean) => void
 }) {
     const [messages, setMessages] = React.useState<Message[]>([])
     const [input, setInput] = React.useState("")
@@ -238,50 +218,8 @@ export function ChatInterface({
                     }
                 });
 
-                // 2b. Fallback: Recover orphaned </LOOT> (AI dropped opening tag)
-                while (displayContent.includes('</LOOT>')) {
-                    const closingIdx = displayContent.indexOf('</LOOT>')
-                    const beforeClose = displayContent.substring(0, closingIdx)
-                    const jsonStart = beforeClose.lastIndexOf('{')
-                    if (jsonStart !== -1) {
-                        let jsonStr = beforeClose.substring(jsonStart)
-                        try {
-                            jsonStr = repairJson(jsonStr)
-                            const lootData = JSON.parse(jsonStr)
-                            console.log("🔧 Recovered orphan LOOT:", lootData)
-                            if (lootData.money || lootData.items) {
-                                if (lootData.money) {
-                                    (['cp', 'sp', 'ep', 'gp', 'pp'] as const).forEach(currency => {
-                                        if (lootData.money[currency]) {
-                                            localStatus.money[currency] =
-                                                (localStatus.money[currency] || 0) + lootData.money[currency]
-                                        }
-                                    })
-                                }
-                                if (lootData.items && Array.isArray(lootData.items)) {
-                                    lootData.items.filter((itemObj: any) => itemObj.item).forEach((itemObj: any) => {
-                                        localStatus.inventory.push({
-                                            item: itemObj.item,
-                                            qty: itemObj.qty || 1,
-                                            weight: itemObj.weight || 0,
-                                            notes: "Looted"
-                                        })
-                                    })
-                                }
-                                hasStateChanges = true
-                                toast.success("🎁 Loot Recovered!", { duration: 3000 })
-                            }
-                            displayContent = displayContent.substring(0, jsonStart) + displayContent.substring(closingIdx + 7)
-                        } catch (e) {
-                            console.warn("Orphan LOOT recovery failed:", e)
-                            displayContent = displayContent.replace('</LOOT>', '')
-                        }
-                    } else {
-                        displayContent = displayContent.replace('</LOOT>', '')
-                    }
-                }
-
-                // 2c. Clean any remaining stray LOOT tags
+                // 2b. Clean any remaining stray LOOT tags
+                // (Truncated/orphaned tags are repaired server-side, see backend app/core/tags.py)
                 displayContent = displayContent.replace(/<\/?LOOT>/g, '')
 
                 displayContent = displayContent.trim();
@@ -328,7 +266,10 @@ export function ChatInterface({
                 incomingMsg.content = displayContent;
 
                 // [FINAL COMMIT] Apply ALL Atomic Updates
-                if (hasStateChanges && onCharacterUpdate && selectedCharacter) {
+                // Skipped when the backend already applied this turn's tags (apply_character_events):
+                // applying them again here would double the loot/XP (and race with other players).
+                const stateAppliedServerSide = payload.metadata?.state_applied === true;
+                if (hasStateChanges && onCharacterUpdate && selectedCharacter && !stateAppliedServerSide) {
                     console.log("💾 Persisting Combined Updates (Atomic):", localStatus);
                     onCharacterUpdate({ status: localStatus });
                 }
@@ -478,6 +419,7 @@ export function ChatInterface({
                 body: JSON.stringify({
                     message: contentToSend,
                     character_context: charContext,
+                    character_id: selectedCharacter?.id,
                     history: messages.slice(-5).map(m => ({ role: m.role, content: m.content }))
                 })
             })
@@ -485,7 +427,12 @@ export function ChatInterface({
             const data = await res.json()
 
             if (data.response) {
-                if (data.updates && onCharacterUpdate) {
+                if (data.character_state) {
+                    // Already persisted atomically by the backend: only sync the local copy (if it is this character)
+                    if (onCharacterUpdate && data.character_id === selectedCharacter?.id) {
+                        onCharacterUpdate({ status: data.character_state }, false)
+                    }
+                } else if (data.updates && onCharacterUpdate) {
                     onCharacterUpdate(data.updates)
                 }
 
@@ -19,7 +19,7 @@ export function DiceTray({ onRoll, characterName }: { onRoll?: (msg: string) =>
         const expression = `${multiplier}d${sides}`;
 
         try {
-            // Roll via backend (secrets.randbelow — cryptographically secure)
+            // Roll via backend (buffered os.urandom — cryptographically secure)
             const res = await authenticatedFetch("/api/roll", {
                 method: "POST",
                 body: JSON.stringify({ expression, visibility: "public" }),
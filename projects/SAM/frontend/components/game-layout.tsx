@@ -150,7 +150,7 @@ export default function GameLayout() {
         }
     }
 
-    const handleCharacterUpdate = async (updates: any) => {
+    const handleCharacterUpdate = async (updates: any, persist: boolean = true) => {
         if (!selectedCharacter) return
 
         console.log("Updating Character State:", updates)
@@ -168,7 +168,9 @@ export default function GameLayout() {
         setSelectedCharacter(updatedChar)
         localStorage.setItem("selectedCharacter", JSON.stringify(updatedChar))
 
-        // 2. Persist to Backend
+        // 2. Persist to Backend (unless the backend already applied it, see character_state in /api/chat)
+        if (!persist) return
+
         try {
             const supabase = createClient()
             const { data: { session } } = await supabase.auth.getSession()